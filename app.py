@@ -1,227 +1,334 @@
-from dash import Dash, html, dcc, Input, Output, dash_table, State, ctx
-from mongodb_utils import get_keyword_trend, get_keyword_list
-from neo4j_utils import get_univ_list, get_prof_list
+from dash import Dash, html, dcc, Input, Output, dash_table, State, no_update
+from dash.exceptions import PreventUpdate
+from mongodb_utils import get_keyword_trend
 from neo4j_utils import get_top_professor, get_top_keywords_of_univ, get_top_keywords_of_prof
-from mysql_utils import fetch_all_fav_keywords, add_fav_keyword, delete_fav_keyword
-from mysql_utils import get_recommended_prof, get_recommended_univ
+from mysql_utils import fetch_all_fav_keywords, add_fav_keyword, add_fav_keywords, delete_fav_keywords
+from mysql_utils import get_recommendations
+import mongodb_utils
+import mysql_utils
+import snapshot_utils
+from async_utils import call
 import dash_bootstrap_components as dbc
 import plotly.express as px
+from option_utils import get_options
+from search_utils import NameIndex
+from concurrent_utils import fan_out
+from metrics_utils import render_prometheus
+from flask import Response
+import logging
+import os
+import threading
+import re
+import uuid
+
+# with RFE_ASYNC=1 the callbacks use the async variants of the data layer, which run
+# on one event loop per process (see async_utils): a callback thread only waits for its
+# results, and the queries of all threads share the async drivers and pools
+use_async_queries = os.environ.get('RFE_ASYNC') == '1'
+if use_async_queries:
+    from async_mongodb_utils import get_keyword_trend
+    from async_neo4j_utils import get_top_professor, get_top_keywords_of_univ, get_top_keywords_of_prof
+    from async_mysql_utils import fetch_all_fav_keywords, add_fav_keyword, add_fav_keywords, delete_fav_keywords
+    from async_mysql_utils import get_recommendations
 
 # create the Dash app
 app = Dash(external_stylesheets=[dbc.themes.SOLAR])
+# the Flask server, for gunicorn (app:server) and the extra routes below
+server = app.server
 
-# get lists of options
-keyword_options = [{'label': keyword, 'value': keyword}
-                   for keyword in get_keyword_list()]
-
-university_options = [{'label': univ, 'value': univ}
-                      for univ in get_univ_list()]
-
-faculty_options = [{'label': prof, 'value': prof}
-                     for prof in get_prof_list()]
-
-# create the layout
-app.layout = dbc.Container([
-    dbc.Row([
-        html.H1("Research Field Explorer",
-                style={'textAlign': 'center', 'color':'white','fontWeight': 'bold' }),
-    ], align="center", justify="center", class_name='pt-3'),
-
-    # first row
-    dbc.Row([
-        # first widget
-        dbc.Col([
-            html.H2("See the Trend of Research Field", style={'color': 'white'}),
-            html.Div([
-                html.H4("Select Research Field", style={'color': 'white'}),
-                dcc.Dropdown(
-                    id="keyword",
-                    options=keyword_options,
-                    value=keyword_options[0]["value"],
-                )
-            ]),
-            html.Div([
-                dcc.Graph(
-                    id="keyword-trend",
-                    figure={}
-                )
-            ]),
-        ], width=5),
-
-        # second widget
-        dbc.Col([
-            html.H2("Top 10 Professors of Research Field", style={'color': 'white'}),
-            
-            dbc.Row([
+
+# query latency, rows, bytes and connection waits of this process (see metrics_utils)
+@server.route('/metrics')
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+# number of matches sent to a keyword/professor dropdown per keystroke
+search_limit = 20
+
+# per-query timeouts (seconds) of the queries a callback runs concurrently
+query_timeouts = {
+    'recommendations': 5,
+    'write': 10,
+}
+
+# type-ahead indexes over the keyword and professor lists, built on first use
+_search_indexes = {}
+_search_indexes_lock = threading.Lock()
+
+
+def get_search_index(name):
+    if name not in _search_indexes:
+        with _search_indexes_lock:
+            if name not in _search_indexes:
+                _search_indexes[name] = NameIndex(get_options()[name])
+    return _search_indexes[name]
+
+
+def make_options(names):
+    return [{'label': name, 'value': name} for name in names]
+
+
+# DataTable rows from the columns of a DataFrame as plain Python values; cheaper than
+# DataFrame.to_dict('records'), which goes through pandas for every cell
+def to_records(df):
+    columns = list(df.columns)
+    return [dict(zip(columns, row)) for row in zip(*(df[column].tolist() for column in columns))]
+
+
+# option lists come from the on-disk snapshot (see option_utils). The keyword and
+# professor dropdowns only carry their selected value, matches are sent as the user types.
+# Favorite keywords belong to the browser's session id and are loaded by load_favorites.
+def serve_layout():
+    options = get_options()
+    default_keyword = options['keywords'][0]
+    default_prof = options['professors'][2]
+
+    university_options = make_options(options['universities'])
+
+    # create the layout
+    return dbc.Container([
+        dbc.Row([
+            html.H1("Research Field Explorer",
+                    style={'textAlign': 'center', 'color':'white','fontWeight': 'bold' }),
+        ], align="center", justify="center", class_name='pt-3'),
+
+        # first row
+        dbc.Row([
+            # first widget
+            dbc.Col([
+                html.H2("See the Trend of Research Field", style={'color': 'white'}),
+                html.Div([
                     html.H4("Select Research Field", style={'color': 'white'}),
                     dcc.Dropdown(
-                        id="keyword-dropdown",
-                        options=keyword_options,
-                        value=keyword_options[0]['value']
+                        id="keyword",
+                        options=make_options([default_keyword]),
+                        value=default_keyword,
+                    )
+                ]),
+                html.Div([
+                    dcc.Graph(
+                        id="keyword-trend",
+                        figure={}
                     )
-                    ], class_name='my-3'),
+                ]),
+            ], width=5),
+
+            # second widget
+            dbc.Col([
+                html.H2("Top 10 Professors of Research Field", style={'color': 'white'}),
             
-            dbc.Row([
-                html.H4("Select Year Range", style={'color': 'white'}),
-                dcc.RangeSlider(
-                    id="year-range-slider",
-                    min=1980,
-                    max=2020,
-                    step=1,
-                    value=[1980, 2020],
-                    marks={
-                        str(year): str(year)
-                        for year in range(1980, 2020, 5)
-                    }
-                )
-            ], class_name='my-3'),
-
-            dash_table.DataTable(
-                id="results-table",
-                columns=[{"name": "Professor", "id": "Professor"},
-                         {"name": "Institute", "id": "Institute"},
-                         {"name": "Citation Score", "id": "Citation Score"}],
-                editable=False,
-                row_deletable=False,
-                style_cell={'textAlign': 'left'},
-                style_header={
-                    'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
-                style_table={'marginBottom': '10px'},
-            ),
-
-            html.H6("Ranked by Keyword-Relevant Citation (KRC)", style={'color': 'white'}),
-        ], width=5),
-    ], class_name='p-3 d-flex justify-content-around'),
-
-    # second row
-    dbc.Row([
-        # third widget
-        dbc.Col([
-            html.H2("Top Research Keywords of University", style={'color': 'white'}),
+                dbc.Row([
+                        html.H4("Select Research Field", style={'color': 'white'}),
+                        dcc.Dropdown(
+                            id="keyword-dropdown",
+                            options=make_options([default_keyword]),
+                            value=default_keyword
+                        )
+                        ], class_name='my-3'),
             
-            html.Div([
-                html.H4("Select University", style={'color': 'white'}),
-                dcc.Dropdown(
-                    id="university",
-                    options=university_options,
-                    value=university_options[0]["value"],
-                )
-            ]),
-            html.Div([
-                dcc.Graph(
-                    id="keyword-scores",
-                    figure={}
-                )
-            ]),
-            html.H6("Ranked by number of faculty interested in the field", style={'color': 'white'}),
-        ], width=5),
-
-        # fourth widget
-        dbc.Col([
-            html.H2('Top Keywords of Professor', style={'color': 'white'}),
+                dbc.Row([
+                    html.H4("Select Year Range", style={'color': 'white'}),
+                    dcc.RangeSlider(
+                        id="year-range-slider",
+                        min=1980,
+                        max=2020,
+                        step=1,
+                        value=[1980, 2020],
+                        # one update when the handle is released, not one per step of the drag
+                        updatemode='mouseup',
+                        marks={
+                            str(year): str(year)
+                            for year in range(1980, 2020, 5)
+                        }
+                    )
+                ], class_name='my-3'),
+
+                dash_table.DataTable(
+                    id="results-table",
+                    columns=[{"name": "Professor", "id": "Professor"},
+                             {"name": "Institute", "id": "Institute"},
+                             {"name": "Citation Score", "id": "Citation Score"}],
+                    editable=False,
+                    row_deletable=False,
+                    style_cell={'textAlign': 'left'},
+                    style_header={
+                        'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
+                    style_table={'marginBottom': '10px'},
+                ),
+
+                html.H6("Ranked by Keyword-Relevant Citation (KRC)", style={'color': 'white'}),
+            ], width=5),
+        ], class_name='p-3 d-flex justify-content-around'),
+
+        # second row
+        dbc.Row([
+            # third widget
+            dbc.Col([
+                html.H2("Top Research Keywords of University", style={'color': 'white'}),
             
-            dbc.Row([
-                html.H4("Select Professor", style={'color': 'white'}),
-                dcc.Dropdown(
-                    id="faculty-dropdown",
-                    options=faculty_options,
-                    value=faculty_options[2]["value"],
-                )
-            ], className='my-3'),
-
-            html.Div(id='table-container'),
-            html.H6("Ranked by Keyword-Relevant Citation (KRC)", style={'color': 'white'}),
-
-        ], width=5)
-    ], class_name='p-3 d-flex justify-content-around'),
-
-    # third row
-
-    dbc.Row([
-        # add to Favorite Keywords 
-        dbc.Col([
-            html.H2("Add Your Favorite Keywords", style={'color': 'white'}),
-            dbc.Row([
-                dbc.Col([
+                html.Div([
+                    html.H4("Select University", style={'color': 'white'}),
                     dcc.Dropdown(
-                        id='keyword-dropdown-2',
-                        options=keyword_options,
-                        value='',
-                    ),
+                        id="university",
+                        options=university_options,
+                        value=university_options[0]["value"],
+                    )
                 ]),
-                dbc.Col([
-                    dbc.Button('Add', id='add-to-fav-button',
-                               n_clicks=0, color='secondary', className='mr-2')
+                html.Div([
+                    dcc.Graph(
+                        id="keyword-scores",
+                        figure={}
+                    )
                 ]),
-            ], className='my-3'),
-            dash_table.DataTable(
-                id='fav-keywords-table',
-                columns=[{"name": "Favorite Keywords", "id": "keywords"}],
-                data=[{"keywords": k}
-                      for k in fetch_all_fav_keywords()],
-                editable=True,
-                sort_action="native",
-                sort_mode="multi",
-                row_deletable=True,
-                page_size=10,
-                selected_rows=[],
-                style_cell={'textAlign': 'left'},
-                style_header={
-                    'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
-                style_table={'marginBottom': '10px'},
-
-            ),
-        ], width=5, style={'paddingRight': '50px', 'paddingLeft': '100px', 'marginTop': '40px', 'marginBottom': '10px'}),
-
-        # fifth widget
-
-        dbc.Col([
-            html.H2("Recommended Professors", style={'color': 'white'}),
-            dash_table.DataTable(
-                id='top-faculty-table',
-                columns=[{"name": "Professor", "id": "Professor"},
-                         {"name": "University", "id": "Institute"},
-                         {"name": "Total Citation Score", "id": "Total Citation Score"}],
-                data=get_recommended_prof(),
-                sort_action="native",
-                sort_mode="multi",
-                page_size=10,
-                style_cell={'textAlign': 'left'},
-                style_header={
-                    'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
-                style_table={'marginBottom': '10px'},
-            ),
-        ], width=5, style={ 'marginTop': '40px'}),
+                html.H6("Ranked by number of faculty interested in the field", style={'color': 'white'}),
+            ], width=5),
+
+            # fourth widget
+            dbc.Col([
+                html.H2('Top Keywords of Professor', style={'color': 'white'}),
+            
+                dbc.Row([
+                    html.H4("Select Professor", style={'color': 'white'}),
+                    dcc.Dropdown(
+                        id="faculty-dropdown",
+                        options=make_options([default_prof]),
+                        value=default_prof,
+                    )
+                ], className='my-3'),
+
+                html.Div(id='table-container'),
+                html.H6("Ranked by Keyword-Relevant Citation (KRC)", style={'color': 'white'}),
+
+            ], width=5)
+        ], class_name='p-3 d-flex justify-content-around'),
+
+        # third row
+
+        dbc.Row([
+            # add to Favorite Keywords 
+            dbc.Col([
+                html.H2("Add Your Favorite Keywords", style={'color': 'white'}),
+                dbc.Row([
+                    dbc.Col([
+                        dcc.Dropdown(
+                            id='keyword-dropdown-2',
+                            options=[],
+                            value='',
+                        ),
+                    ]),
+                    dbc.Col([
+                        dbc.Button('Add', id='add-to-fav-button',
+                                   n_clicks=0, color='secondary', className='mr-2')
+                    ]),
+                ], className='my-3'),
+                dbc.Row([
+                    dbc.Col([
+                        dcc.Textarea(
+                            id='import-keywords-text',
+                            placeholder='Import keywords, one per line',
+                            style={'width': '100%', 'height': '60px'},
+                        ),
+                    ]),
+                    dbc.Col([
+                        dbc.Button('Import', id='import-keywords-button',
+                                   n_clicks=0, color='secondary', className='mr-2')
+                    ]),
+                ], className='my-3'),
+                # a new id for browsers without one, kept in local storage across visits
+                dcc.Store(id='session-id', storage_type='local', data=uuid.uuid4().hex),
+                dcc.Store(id='fav-keywords-store', data=[]),
+                dash_table.DataTable(
+                    id='fav-keywords-table',
+                    columns=[{"name": "Favorite Keywords", "id": "keywords"}],
+                    data=[],
+                    editable=True,
+                    sort_action="native",
+                    sort_mode="multi",
+                    row_deletable=True,
+                    page_size=10,
+                    selected_rows=[],
+                    style_cell={'textAlign': 'left'},
+                    style_header={
+                        'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
+                    style_table={'marginBottom': '10px'},
+
+                ),
+            ], width=5, style={'paddingRight': '50px', 'paddingLeft': '100px', 'marginTop': '40px', 'marginBottom': '10px'}),
+
+            # fifth widget
+
+            dbc.Col([
+                html.H2("Recommended Professors", style={'color': 'white'}),
+                dash_table.DataTable(
+                    id='top-faculty-table',
+                    columns=[{"name": "Professor", "id": "Professor"},
+                             {"name": "University", "id": "Institute"},
+                             {"name": "Total Citation Score", "id": "Total Citation Score"}],
+                    data=[],
+                    sort_action="native",
+                    sort_mode="multi",
+                    page_size=10,
+                    style_cell={'textAlign': 'left'},
+                    style_header={
+                        'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
+                    style_table={'marginBottom': '10px'},
+                ),
+            ], width=5, style={ 'marginTop': '40px'}),
 
         
-    ], class_name='p-3 d-flex justify-content-around'),
-
-    # fourth row
-    dbc.Row([
-
-        dbc.Col(width = 5),
-        # sixth widget 
-        dbc.Col([
-            html.H2("Recommended Universities", style={'color': 'white'}),
-            dash_table.DataTable(
-                id='top-university-table',
-                columns=[
-                        {"name": "University", "id": "Institute"},
-                        {"name": "Related Professor Count", "id": "Related Professor Count"},
-                        {"name": "Total Citation Score", "id": "Total Citation Score"}],
-                data=get_recommended_univ(),
-                sort_action="native",
-                sort_mode="multi",
-                page_size=10,
-                style_cell={'textAlign': 'left'},
-                style_header={
-                    'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
-                style_table={'marginBottom': '10px'},
-            ),
-        ], width=5)
+        ], class_name='p-3 d-flex justify-content-around'),
+
+        # fourth row
+        dbc.Row([
+
+            dbc.Col(width = 5),
+            # sixth widget 
+            dbc.Col([
+                html.H2("Recommended Universities", style={'color': 'white'}),
+                dash_table.DataTable(
+                    id='top-university-table',
+                    columns=[
+                            {"name": "University", "id": "Institute"},
+                            {"name": "Related Professor Count", "id": "Related Professor Count"},
+                            {"name": "Total Citation Score", "id": "Total Citation Score"}],
+                    data=[],
+                    sort_action="native",
+                    sort_mode="multi",
+                    page_size=10,
+                    style_cell={'textAlign': 'left'},
+                    style_header={
+                        'backgroundColor': 'rgb(8, 132, 204)', 'color': 'white', 'textAlign': 'center', 'fontWeight': 'bold'},
+                    style_table={'marginBottom': '10px'},
+                ),
+            ], width=5)
+
+        ], class_name='p-3 d-flex justify-content-around')
+    ], fluid=True)
+
+
+app.layout = serve_layout
+
+
+# type-ahead callbacks: options of the keyword and professor dropdowns are the top
+# matches of what the user has typed, plus the selected value
+def register_search(dropdown_id, index_name):
+    @app.callback(
+        Output(dropdown_id, 'options'),
+        Input(dropdown_id, 'search_value'),
+        State(dropdown_id, 'value')
+    )
+    def update_options(search_value, value):
+        if not search_value:
+            raise PreventUpdate
+        names = get_search_index(index_name).search(search_value, search_limit)
+        if value and value not in names:
+            names = [value] + names
+        return make_options(names)
+
 
-    ], class_name='p-3 d-flex justify-content-around')
-], fluid=True)
+for dropdown_id in ['keyword', 'keyword-dropdown', 'keyword-dropdown-2']:
+    register_search(dropdown_id, 'keywords')
+register_search('faculty-dropdown', 'professors')
 
 
 # first widget callbacks
@@ -230,12 +337,12 @@ app.layout = dbc.Container([
     [Input(component_id='keyword', component_property='value')]
 )
 def update_keyword_trend(keyword): 
-    df = get_keyword_trend(keyword)
+    df = call(get_keyword_trend, keyword)
     fig = {
         'data': [{
             
-            'x': df['year'],
-            'y': df['publication count'],
+            'x': df['year'].to_numpy(),
+            'y': df['publication count'].to_numpy(),
             'type': 'line',
             'marker': {'color': 'blue'}
         }],
@@ -255,9 +362,9 @@ def update_keyword_trend(keyword):
 )
 def update_results_table(keyword, year_range):
     start_year, end_year = year_range    
-    df = get_top_professor(keyword, start_year, end_year)
+    df = call(get_top_professor, keyword, start_year, end_year)
     # return the data for the dash_table component
-    return df.to_dict("records")
+    return to_records(df)
 
 # third widget callbacks
 @app.callback(
@@ -265,12 +372,12 @@ def update_results_table(keyword, year_range):
     [Input(component_id='university', component_property='value')]
 )
 def update_keyword_rank(university):
-    df = get_top_keywords_of_univ(university)
+    df = call(get_top_keywords_of_univ, university)
     df = df.sort_values('Professor Count', ascending=True)
     fig = {
         'data': [{
-            'x': df['Professor Count'],
-            'y': df['Keyword'],
+            'x': df['Professor Count'].to_numpy(),
+            'y': df['Keyword'].to_numpy(),
             'type': 'bar',
             'orientation': 'h',  # horizontal bar chart
             'marker': {'color': 'blue'}
@@ -290,9 +397,9 @@ def update_keyword_rank(university):
     Input('faculty-dropdown', 'value')
 )
 def update_table(prof):
-    df = get_top_keywords_of_prof(prof)
+    df = call(get_top_keywords_of_prof, prof)
     table = dash_table.DataTable(
-        data=df.to_dict('records'),
+        data=to_records(df),
         columns=[{'name': col, 'id': col} for col in df.columns],
         style_cell={'textAlign': 'left'},
          style_header={
@@ -303,69 +410,140 @@ def update_table(prof):
     return table
 
 # fifth & six widgets callbacks
+# the favorite keywords of the page live in 'fav-keywords-store'; the table is a view of
+# it, so deletions are found by diffing the table against the store, without reading MySQL.
+# The store is filled from the session's favorites once the session id is known.
 @app.callback(
-    [Output('fav-keywords-table', 'data', allow_duplicate=True),
+    [Output('fav-keywords-store', 'data'),
+     Output('fav-keywords-table', 'data'),
+     Output('top-faculty-table', 'data'),
+     Output('top-university-table', 'data')],
+    [Input('session-id', 'modified_timestamp')],
+    [State('session-id', 'data')]
+)
+def load_favorites(timestamp, session_id):
+    if timestamp is None or not session_id:
+        raise PreventUpdate
+    fav_keywords = call(fetch_all_fav_keywords, session_id)
+    top_faculty, top_university = call(get_recommendations, sorted(fav_keywords))
+    return fav_keywords, [{'keywords': k} for k in fav_keywords], top_faculty, top_university
+
+
+@app.callback(
+    [Output('fav-keywords-store', 'data', allow_duplicate=True),
+     Output('fav-keywords-table', 'data', allow_duplicate=True),
      Output('top-faculty-table', 'data', allow_duplicate=True),
      Output('top-university-table', 'data', allow_duplicate=True)],
     [Input('add-to-fav-button', 'n_clicks')],
     [State('keyword-dropdown-2', 'value'),
-     State('fav-keywords-table', 'data')],
+     State('fav-keywords-store', 'data'),
+     State('session-id', 'data')],
     prevent_initial_call=True
 )
-def update_favorite_table(n_clicks, selected_keyword, table_data):
-    if n_clicks is None:
-        print("no click")
-        # This means that the callback was triggered by something other than the button click
-        return table_data, [], []
-
-    if 'add-to-fav-button' == ctx.triggered_id and selected_keyword:
-        print("click btn")
-        if {'keywords': selected_keyword} not in table_data:
-            add_fav_keyword(selected_keyword)
-            table_data.append({'keywords': selected_keyword})
-            top_faculty = get_recommended_prof()
-            top_university = get_recommended_univ()
-            print("top faculty", top_faculty)
-            print("top university", top_university)
-            return table_data, top_faculty, top_university
-        
-    print('error return empty')
-    return table_data, [], []
-
-# callback to delete keyword from favorite table
+def update_favorite_table(n_clicks, selected_keyword, fav_keywords, session_id):
+    # nothing to add, or the keyword is already a favorite: the recommendations can't change
+    if not n_clicks or not selected_keyword or selected_keyword in fav_keywords:
+        raise PreventUpdate
+
+    fav_keywords = fav_keywords + [selected_keyword]
+    # the insert and the recommendations for the new keyword set run concurrently;
+    # if the recommendations time out the tables keep their current data, if the
+    # insert fails or times out nothing changes
+    results = fan_out({'write': (add_fav_keyword, (session_id, selected_keyword)),
+                       'recommendations': (get_recommendations, (sorted(fav_keywords),))},
+                      timeouts=query_timeouts,
+                      defaults={'write': False, 'recommendations': (no_update, no_update)})
+    if results['write'] is not True:
+        logging.warning(f"Favorite keyword {selected_keyword!r} was not saved")
+        raise PreventUpdate
+    top_faculty, top_university = results['recommendations']
+    return fav_keywords, [{'keywords': k} for k in fav_keywords], top_faculty, top_university
+
+
+# import a list of keywords (one per line, or separated by commas/semicolons): known
+# keywords are added in one batch and the recommendations are computed once
 @app.callback(
-    [Output('fav-keywords-table', 'data', allow_duplicate=True),
+    [Output('fav-keywords-store', 'data', allow_duplicate=True),
+     Output('fav-keywords-table', 'data', allow_duplicate=True),
+     Output('top-faculty-table', 'data', allow_duplicate=True),
+     Output('top-university-table', 'data', allow_duplicate=True),
+     Output('import-keywords-text', 'value')],
+    [Input('import-keywords-button', 'n_clicks')],
+    [State('import-keywords-text', 'value'),
+     State('fav-keywords-store', 'data'),
+     State('session-id', 'data')],
+    prevent_initial_call=True
+)
+def import_favorite_keywords(n_clicks, text, fav_keywords, session_id):
+    known = get_search_index('keywords')
+    names = [name.strip() for name in re.split(r'[\n,;]', text or '')]
+    new_keywords = [name for name in dict.fromkeys(names)
+                    if name and name not in fav_keywords and known.contains(name)]
+    if not new_keywords:
+        raise PreventUpdate
+
+    fav_keywords = fav_keywords + new_keywords
+    results = fan_out({'write': (add_fav_keywords, (session_id, new_keywords)),
+                       'recommendations': (get_recommendations, (sorted(fav_keywords),))},
+                      timeouts=query_timeouts,
+                      defaults={'write': False, 'recommendations': (no_update, no_update)})
+    # the import text is kept when the keywords were not saved, so it can be retried
+    if results['write'] is not True:
+        logging.warning(f"{len(new_keywords)} imported favorite keywords were not saved")
+        raise PreventUpdate
+    top_faculty, top_university = results['recommendations']
+    return fav_keywords, [{'keywords': k} for k in fav_keywords], top_faculty, top_university, ''
+
+
+# callback to delete keyword from favorite table. data_timestamp only changes when the
+# user edits the table, so the data written by the callbacks doesn't trigger it again
+@app.callback(
+    [Output('fav-keywords-store', 'data', allow_duplicate=True),
+     Output('fav-keywords-table', 'data', allow_duplicate=True),
      Output('top-faculty-table', 'data', allow_duplicate=True),
      Output('top-university-table', 'data', allow_duplicate=True)],
-    [Input('fav-keywords-table', 'data'),
-     Input('top-faculty-table', 'data'),
-     Input('top-university-table', 'data')],
+    [Input('fav-keywords-table', 'data_timestamp')],
+    [State('fav-keywords-table', 'data'),
+     State('fav-keywords-store', 'data'),
+     State('session-id', 'data')],
     prevent_initial_call=True
 )
-def delete_fav_keyword_callback(data, faculty_data, university_data):
-    # get list of keywords in the table before deletion
-    keywords_before_delete = fetch_all_fav_keywords()
-
-    # get list of keywords in the table after the row was deleted
-    keywords_after_delete = [row['keywords'] for row in data]
-
-    # find the keyword that was deleted
-    deleted_keyword = None
-    if len(set(keywords_before_delete).difference(set(keywords_after_delete))) > 0:
-        deleted_keyword = set(keywords_before_delete).difference(
-            set(keywords_after_delete)).pop()
-
-    # delete the keyword from the database, update recommended profs & univs
-    if deleted_keyword:
-        delete_fav_keyword(deleted_keyword)
-        top_faculty = get_recommended_prof()
-        top_university = get_recommended_univ()
-        return data, top_faculty, top_university
-
-    print('error return empty')
-    return data, faculty_data, university_data
+def delete_fav_keyword_callback(timestamp, data, fav_keywords, session_id):
+    # keywords still in the table after the row was deleted
+    remaining = {row['keywords'] for row in data or []}
+    deleted_keywords = [k for k in fav_keywords if k not in remaining]
+    kept = [k for k in fav_keywords if k in remaining]
+    # rows with edited cells are not favorites, show the store again
+    table_data = no_update if len(data or []) == len(kept) else [{'keywords': k} for k in kept]
+    if not deleted_keywords:
+        return no_update, table_data, no_update, no_update
+
+    # delete the keywords from the database, update recommended profs & univs
+    results = fan_out({'write': (delete_fav_keywords, (session_id, deleted_keywords)),
+                       'recommendations': (get_recommendations, (sorted(kept),))},
+                      timeouts=query_timeouts,
+                      defaults={'write': False, 'recommendations': (no_update, no_update)})
+    # the deleted rows come back when the delete was not saved
+    if results['write'] is not True:
+        logging.warning(f"{len(deleted_keywords)} favorite keywords were not deleted")
+        return no_update, [{'keywords': k} for k in fav_keywords], no_update, no_update
+    top_faculty, top_university = results['recommendations']
+    return kept, table_data, top_faculty, top_university
+
+
+# load the recommendation matrix and build the keyword trend table in the background
+# when a server process starts (the gunicorn workers call this from post_worker_init in
+# gunicorn.conf.py), instead of in the first requests; importing the app loads nothing
+def on_startup():
+    if snapshot_utils.use_snapshot:
+        return
+    if mysql_utils.use_krc_matrix:
+        mysql_utils.preload_krc_matrix()
+    if mongodb_utils.use_trend_table:
+        mongodb_utils.preload_trend_table()
 
 
 if __name__ == "__main__":
+    on_startup()
     app.run_server(debug=False)
 
@@ -0,0 +1,19 @@
+# ASGI entry point, for serving the app from an ASGI server with the async data layer:
+#
+#   pip install -r requirements-async.txt
+#   RFE_ASYNC=1 uvicorn asgi:application --workers 4
+#
+# Dash callbacks are synchronous, so a2wsgi's WSGIMiddleware runs the requests of a
+# worker on a pool of `threads` threads (RFE_ASGI_THREADS), like gunicorn's --threads.
+# With RFE_ASYNC=1 those threads only wait while the queries of all requests run
+# concurrently on the process's event loop (see async_utils). asgiref's WsgiToAsgi is
+# not used: it runs every request of a worker on one shared thread.
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import server
+
+threads = int(os.environ.get('RFE_ASGI_THREADS', '16'))
+
+application = WSGIMiddleware(server, workers=threads)
@@ -0,0 +1,142 @@
+import asyncio
+import inspect
+import os
+import threading
+
+import pandas as pd
+
+import async_utils
+import metrics_utils
+import mongodb_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
+
+# async variant of mongodb_utils for the shared event loop (see async_utils). It uses
+# pymongo's native async client when available (pymongo >= 4.9) and Motor otherwise;
+# connection settings, pipelines and the keyword trend table are mongodb_utils'. Every
+# operation goes through the mongodb circuit breaker and deadline (see resilience_utils).
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+# one client per event loop, async clients can't be shared between loops or forked processes
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    global _clients_pid
+    if AsyncMongoClient is None:
+        raise ImportError("the async MongoDB layer needs pymongo >= 4.9 or motor")
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = AsyncMongoClient(**mongodb_utils.config)
+    return client
+
+
+def get_collection(name):
+    return get_client()[mongodb_utils.database][name]
+
+
+async def close_client():
+    with _clients_lock:
+        client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        closed = client.close()
+        if inspect.isawaitable(closed):
+            await closed
+
+
+async_utils.add_shutdown(close_client)
+
+
+# Motor returns the cursor, pymongo's async client a coroutine that opens it
+async def _aggregate(collection, pipeline, **kwargs):
+    cursor = collection.aggregate(pipeline, **kwargs)
+    if inspect.isawaitable(cursor):
+        cursor = await cursor
+    return cursor
+
+
+# widget 1: from the snapshot or the trend table once it is built, otherwise aggregated
+# by MongoDB. A due table refresh runs in a background thread, off the event loop.
+@cached('mongodb')
+@resilience_utils.serve_stale(default=mongodb_utils.empty_keyword_trend)
+async def get_keyword_trend(keyword):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().keyword_trend(keyword)
+    if mongodb_utils.use_trend_table:
+        table = mongodb_utils.get_trend_table(wait=False)
+        if table.built_at is not None:
+            return table.lookup(keyword)
+    return await query_keyword_trend(keyword)
+
+
+async def query_keyword_trend(keyword):
+    publication = get_collection("publications")
+    query = mongodb_utils.keyword_trend_pipeline(keyword)
+
+    async def fetch():
+        cursor = await _aggregate(publication, query)
+        return await cursor.to_list(None)
+
+    with metrics_utils.timed('mongodb', 'keyword_trend', str(query)) as timer:
+        docs = await resilience_utils.call_async('mongodb', fetch())
+        timer.set_result(docs)
+    return pd.DataFrame({"year": [doc.get("year") for doc in docs],
+                         "publication count": [doc.get("n_publication") for doc in docs]})
+
+
+async def count_publications():
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().count('publications')
+    with metrics_utils.timed('mongodb', 'count_publications'):
+        return await resilience_utils.call_async('mongodb',
+                                                 get_collection("publications").estimated_document_count())
+
+
+# all distinct keyword names, one cursor batch at a time (see mongodb_utils.iter_keywords)
+async def iter_keywords(batch_size=None):
+    if snapshot_utils.use_snapshot:
+        for name in snapshot_utils.get_snapshot().keyword_list('mongo_keywords'):
+            yield name
+        return
+    batch_size = batch_size or mongodb_utils.keyword_batch_size
+    publication = get_collection("publications")
+    pipeline = mongodb_utils.keyword_names_pipeline
+    cursor = None
+    try:
+        while True:
+            with metrics_utils.timed('mongodb', 'keyword_list', str(pipeline)) as timer:
+                if cursor is None:
+                    cursor = await resilience_utils.call_async(
+                        'mongodb', _aggregate(publication, pipeline, allowDiskUse=True, batchSize=batch_size))
+                docs = await resilience_utils.call_async('mongodb', cursor.to_list(batch_size))
+                batch = [doc["_id"] for doc in docs]
+                timer.set_result(batch)
+            for name in batch:
+                yield name
+            if len(batch) < batch_size:
+                return
+    finally:
+        if cursor is not None:
+            closed = cursor.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+
+@cached('mongodb')
+@resilience_utils.serve_stale()
+async def get_keyword_list():
+    return [name async for name in iter_keywords()]
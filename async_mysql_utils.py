@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import async_utils
+import metrics_utils
+import mysql_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
+
+# async variant of mysql_utils for the shared event loop (see async_utils), on aiomysql
+# (optional dependency). Connection settings and queries are mysql_utils'.
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# errors that count as failures of the mysql circuit breaker, as mysql_utils.source_failures:
+# the server or the connection failing (PyMySQL raises max_execution_time interruptions as
+# OperationalError too), or a deadline hit
+source_failures = (aiomysql.OperationalError, aiomysql.InterfaceError, OSError, asyncio.TimeoutError) \
+    if aiomysql is not None else (OSError, asyncio.TimeoutError)
+
+# size of the aiomysql pool of each event loop; async queries don't hold a thread, so it
+# can be larger than mysql_utils.pool_config['pool_size']
+pool_config = {
+    'minsize': 1,
+    'maxsize': 32,
+    'pool_recycle': 3600,
+}
+
+# one pool per event loop, pools can't be shared between loops or forked processes
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+async def get_pool():
+    global _pools_pid
+    if aiomysql is None:
+        raise ImportError("the async MySQL layer needs aiomysql")
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(loop)
+    if pool is None:
+        config = mysql_utils.config
+        pool = await aiomysql.create_pool(host=config['host'], port=config.get('port', 3306), user=config['user'],
+                                          password=config['password'], db=config['database'], autocommit=True,
+                                          **pool_config)
+        with _pools_lock:
+            # another task may have created one meanwhile
+            existing = _pools.setdefault(loop, pool)
+        if existing is not pool:
+            pool.close()
+            await pool.wait_closed()
+            pool = existing
+    return pool
+
+
+async def close_pool():
+    with _pools_lock:
+        pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        pool.close()
+        await pool.wait_closed()
+
+
+async_utils.add_shutdown(close_pool)
+
+
+# async counterpart of MySQLDatabase: `async with AsyncMySQLDatabase() as db`. Each
+# context goes through the mysql circuit breaker, and statements are bounded by the
+# mysql deadline with asyncio.wait_for.
+class AsyncMySQLDatabase:
+    def __init__(self):
+        self.pool = None
+        self.connection = None
+        self.acquire_time = 0.0
+        self.breaker = None
+        self.failed = False
+
+    async def __aenter__(self):
+        self.breaker = resilience_utils.get_breaker('mysql')
+        if not self.breaker.allow():
+            raise resilience_utils.SourceUnavailable('mysql')
+        self.failed = False
+        try:
+            self.pool = await get_pool()
+            start = time.perf_counter()
+            self.connection = await self.pool.acquire()
+        except source_failures:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # MySQL wasn't reached (aiomysql missing, cancelled): let the next probe through
+            self.breaker.release()
+            raise
+        self.acquire_time = time.perf_counter() - start
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type and not issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            logging.exception("Exception occurred")
+        if exc_type is not None:
+            # the connection may be mid-result, don't hand it to another query
+            self.connection.close()
+        self.pool.release(self.connection)
+        if self.failed or (exc_type is not None and issubclass(exc_type, source_failures)):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    @staticmethod
+    async def _execute(cursor, query, values):
+        await asyncio.wait_for(cursor.execute(query, values), resilience_utils.deadline('mysql'))
+
+    def _charge_acquire(self, timer):
+        timer.acquire, self.acquire_time = self.acquire_time, 0.0
+
+    async def execute_query(self, query, values=None, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            self._charge_acquire(timer)
+            try:
+                async with self.connection.cursor() as cursor:
+                    await self._execute(cursor, query, values)
+                    timer.rows = max(cursor.rowcount, 0)
+                return True
+            except aiomysql.Error as error:
+                timer.error = True
+                self.failed = self.failed or isinstance(error, source_failures)
+                logging.exception(f"Failed to execute query: {error}")
+                return False
+
+    # run the query for every set of values in one transaction
+    async def execute_many(self, query, values, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            self._charge_acquire(timer)
+            try:
+                await self.connection.begin()
+                async with self.connection.cursor() as cursor:
+                    await cursor.executemany(query, values)
+                    timer.rows = max(cursor.rowcount, 0)
+                await self.connection.commit()
+                timer.bytes = metrics_utils.measure(values)[1]
+                return True
+            except aiomysql.Error as error:
+                timer.error = True
+                self.failed = self.failed or isinstance(error, source_failures)
+                logging.exception(f"Failed to execute query: {error}")
+                await self.connection.rollback()
+                return False
+
+    async def fetch_data(self, query, values=None, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            self._charge_acquire(timer)
+            async with self.connection.cursor() as cursor:
+                await self._execute(cursor, query, values)
+                rows = await cursor.fetchall()
+            timer.set_result(rows)
+        return rows
+
+    # stream the rows through a server-side cursor, batch_size rows at a time (see
+    # MySQLDatabase.iter_rows)
+    async def iter_rows(self, query, values=None, batch_size=1000, name=None):
+        cursor = None
+        try:
+            while True:
+                with metrics_utils.timed('mysql', name, query) as timer:
+                    if cursor is None:
+                        self._charge_acquire(timer)
+                        cursor = await self.connection.cursor(aiomysql.SSCursor)
+                        await self._execute(cursor, query, values)
+                    rows = await cursor.fetchmany(batch_size)
+                    timer.set_result(rows)
+                for row in rows:
+                    yield row
+                if len(rows) < batch_size:
+                    return
+        finally:
+            if cursor is not None:
+                # SSCursor.close reads the rest of an abandoned result
+                await cursor.close()
+
+
+async def iter_all_keywords(batch_size=None):
+    if snapshot_utils.use_snapshot:
+        for name in snapshot_utils.get_snapshot().keyword_list('mysql_keywords'):
+            yield name
+        return
+    async with AsyncMySQLDatabase() as db:
+        query = "SELECT name FROM keyword"
+        async for row in db.iter_rows(query, batch_size=batch_size or mysql_utils.fetch_batch_size,
+                                      name='fetch_all_keywords'):
+            yield row[0]
+
+
+@cached('mysql')
+@resilience_utils.serve_stale()
+async def fetch_all_keywords():
+    return [name async for name in iter_all_keywords()]
+
+
+# the fav_keywords table is created or upgraded once per process, by mysql_utils
+_fav_keywords_ready = False
+
+
+async def ensure_fav_keywords_table():
+    global _fav_keywords_ready
+    if not _fav_keywords_ready:
+        await asyncio.to_thread(mysql_utils.ensure_fav_keywords_table)
+        _fav_keywords_ready = True
+
+
+@resilience_utils.serve_stale()
+async def fetch_all_fav_keywords(session_id):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.fetch_favorites(session_id)
+    await ensure_fav_keywords_table()
+    async with AsyncMySQLDatabase() as db:
+        query = "SELECT name FROM fav_keywords WHERE session_id = %s"
+        result = await db.fetch_data(query, (session_id, ), name='fetch_all_fav_keywords')
+    return [row[0] for row in result]
+
+
+async def add_fav_keyword(session_id, keyword):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.add_favorites(session_id, [keyword])
+    await ensure_fav_keywords_table()
+    async with AsyncMySQLDatabase() as db:
+        query = ("INSERT INTO fav_keywords (session_id, name) VALUES (%s, %s) "
+                 "ON DUPLICATE KEY UPDATE name = name")
+        if not await db.execute_query(query, (session_id, keyword), name='add_fav_keyword'):
+            return False
+    logging.info("Favorite keyword added")
+    return True
+
+
+async def delete_fav_keyword(session_id, keyword):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.delete_favorites(session_id, [keyword])
+    await ensure_fav_keywords_table()
+    async with AsyncMySQLDatabase() as db:
+        query = "DELETE FROM fav_keywords WHERE session_id = %s AND name = %s"
+        if not await db.execute_query(query, (session_id, keyword), name='delete_fav_keyword'):
+            return False
+    logging.info("Favorite keyword deleted")
+    return True
+
+
+async def add_fav_keywords(session_id, keywords):
+    values = [(session_id, keyword) for keyword in dict.fromkeys(keywords)]
+    if not values:
+        return True
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.add_favorites(session_id, [keyword for _, keyword in values])
+    await ensure_fav_keywords_table()
+    async with AsyncMySQLDatabase() as db:
+        query = ("INSERT INTO fav_keywords (session_id, name) VALUES (%s, %s) "
+                 "ON DUPLICATE KEY UPDATE name = name")
+        if not await db.execute_many(query, values, name='add_fav_keywords'):
+            return False
+    logging.info(f"{len(values)} favorite keywords added")
+    return True
+
+
+async def delete_fav_keywords(session_id, keywords):
+    values = [(session_id, keyword) for keyword in dict.fromkeys(keywords)]
+    if not values:
+        return True
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.delete_favorites(session_id, [keyword for _, keyword in values])
+    await ensure_fav_keywords_table()
+    async with AsyncMySQLDatabase() as db:
+        query = "DELETE FROM fav_keywords WHERE session_id = %s AND name = %s"
+        if not await db.execute_many(query, values, name='delete_fav_keywords'):
+            return False
+    logging.info(f"{len(values)} favorite keywords deleted")
+    return True
+
+
+# widgets 5 & 6: scoring against the KRC matrix is CPU work, so it runs in a thread;
+# without the matrix the recommendation query runs on the async pool
+@cached('recommendations')
+@resilience_utils.serve_stale()
+async def get_recommendations(keywords):
+    if snapshot_utils.use_snapshot or mysql_utils.use_krc_matrix:
+        return await asyncio.to_thread(mysql_utils.recommend, keywords)
+    return await query_recommendations(keywords)
+
+
+async def query_recommendations(keywords):
+    query, values = mysql_utils.recommendations_query(keywords)
+    async with AsyncMySQLDatabase() as db:
+        result = await db.fetch_data(query, values, name='recommendations')
+
+    result = sorted(result, key=lambda row: row[5], reverse=True)
+    recommended_prof = [{"Professor": row[1], "Institute": row[2], "Total Citation Score": row[4]}
+                        for row in result if row[0] == 'prof']
+    recommended_univ = [{"Institute": row[1], "Related Professor Count": row[3], "Total Citation Score": row[4]}
+                        for row in result if row[0] == 'univ']
+    return recommended_prof, recommended_univ
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from neo4j import AsyncGraphDatabase, unit_of_work
+
+import async_utils
+import metrics_utils
+import neo4j_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
+
+# async variant of neo4j_utils for the shared event loop (see async_utils), on the
+# driver's asyncio API. Queries, settings and the in-memory widget tables (KRC prefix
+# sums, institute keywords) are neo4j_utils'.
+
+
+async def _records(result):
+    return [record async for record in result]
+
+
+async def _to_df(result):
+    return await result.to_df()
+
+
+async def _single(result):
+    return await result.single()
+
+
+# one driver per event loop, async drivers can't be shared between loops or forked processes
+class AsyncNeo4jConnection:
+    def __init__(self, uri, user, pwd, **config):
+        self.__uri = uri
+        self.__auth = (user, pwd)
+        self.__config = config
+        self.__drivers = {}
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    def __get_driver(self):
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__drivers.clear()
+                self.__pid = os.getpid()
+            driver = self.__drivers.get(loop)
+            if driver is None:
+                driver = self.__drivers[loop] = AsyncGraphDatabase.driver(self.__uri, auth=self.__auth,
+                                                                           **self.__config)
+        return driver
+
+    async def close(self):
+        with self.__lock:
+            driver = self.__drivers.pop(asyncio.get_running_loop(), None)
+        if driver is not None:
+            await driver.close()
+
+    # as Neo4jConnection.query, with an async transformer
+    async def query(self, query, parameters=None, db=None, transformer=_records, write=False, name=None):
+        driver = self.__get_driver()
+        with resilience_utils.protect('neo4j'), metrics_utils.timed('neo4j', name, query) as timer:
+            async def instrumented(result):
+                waited = time.perf_counter() - timer.start
+                value = await transformer(result)
+                summary = await result.consume()
+                timer.acquire = max(0.0, waited - summary.result_available_after / 1000)
+                timer.set_result(value)
+                return value
+
+            @unit_of_work(timeout=resilience_utils.deadline('neo4j'))
+            async def work(tx):
+                return await instrumented(await tx.run(query, parameters))
+
+            try:
+                async with driver.session(database=db) as session:
+                    if write:
+                        return await session.execute_write(work)
+                    return await session.execute_read(work)
+            except Exception as e:
+                timer.error = True
+                logging.error(f"Query failed: {e}")
+                raise
+
+
+conn = AsyncNeo4jConnection(uri=neo4j_utils.uri, user=neo4j_utils.user, pwd=neo4j_utils.pwd,
+                            **neo4j_utils.driver_config)
+async_utils.add_shutdown(conn.close)
+
+
+# widget 2: prefix sums from neo4j_utils' LRU, built with one async query on a miss
+@resilience_utils.serve_stale(default=neo4j_utils.empty_top_professor)
+async def get_top_professor(keyword, start_year, end_year):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_professors(keyword, int(start_year), int(end_year))
+    if neo4j_utils.use_krc_prefix_sums:
+        return (await get_keyword_krc(keyword)).top(int(start_year), int(end_year))
+    return await query_top_professor(keyword, start_year, end_year)
+
+
+async def get_keyword_krc(keyword):
+    table = neo4j_utils.cached_keyword_krc(keyword)
+    if table is not None:
+        return table
+    records = await conn.query(neo4j_utils.keyword_krc_by_year_query, {'keyword': keyword},
+                               db=neo4j_utils.database, name='keyword_krc_by_year')
+    return neo4j_utils.store_keyword_krc(keyword, neo4j_utils.KeywordKRC.from_records(records))
+
+
+@cached('neo4j')
+async def query_top_professor(keyword, start_year, end_year):
+    parameters = {'keyword': keyword, 'start_year': int(start_year), 'end_year': int(end_year)}
+    df = await conn.query(neo4j_utils.top_professor_query, parameters, db=neo4j_utils.database,
+                          transformer=_to_df, name='top_professor')
+    return df.rename(columns={'f.name': 'Professor', 'institute': 'Institute', 'citation_score': 'Citation Score'})
+
+
+# widget 3: the institute keyword table; its first build and periodic checks run in a
+# thread, off the event loop
+@resilience_utils.serve_stale(default=neo4j_utils.empty_top_keywords_of_univ)
+async def get_top_keywords_of_univ(univ):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_keywords_of_univ(univ)
+    if neo4j_utils.use_institute_keywords:
+        table = neo4j_utils.get_fresh_institute_keywords() or \
+            await asyncio.to_thread(neo4j_utils.get_institute_keywords)
+        if table.version is not None:
+            return table.lookup(univ)
+    return await query_top_keywords_of_univ(univ)
+
+
+@cached('neo4j')
+async def query_top_keywords_of_univ(univ):
+    df = await conn.query(neo4j_utils.top_keywords_of_univ_query, {'univ': univ}, db=neo4j_utils.database,
+                          transformer=_to_df, name='top_keywords_of_univ')
+    return df.rename(columns={'k.name': 'Keyword', 'n_prof': 'Professor Count'})
+
+
+# widget 4
+@cached('neo4j')
+@resilience_utils.serve_stale(default=neo4j_utils.empty_top_keywords_of_prof)
+async def get_top_keywords_of_prof(prof):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_keywords_of_prof(prof)
+    df = await conn.query(neo4j_utils.top_keywords_of_prof_query, {'prof': prof}, db=neo4j_utils.database,
+                          transformer=_to_df, name='top_keywords_of_prof')
+    return df.rename(columns={'k.name': 'Keyword', 'citation_score': 'Citation Score'})
+
+
+async def count_nodes():
+    if snapshot_utils.use_snapshot:
+        return neo4j_utils.count_nodes()
+    query = '''
+        MATCH (i:INSTITUTE)
+        WITH count(i) AS institutes
+        MATCH (f:FACULTY)
+        RETURN institutes, count(f) AS faculty
+    '''
+    record = await conn.query(query, db=neo4j_utils.database, transformer=_single, name='count_nodes')
+    return {'institutes': record['institutes'], 'faculty': record['faculty']}
+
+
+# names of all nodes with the label in name order, one keyset page at a time (see neo4j_utils.iter_names)
+async def iter_names(label, page_size=None):
+    query = neo4j_utils.names_page_query.format(label=label)
+    parameters = {'name': '', 'id': '', 'limit': page_size or neo4j_utils.list_page_size}
+    while True:
+        records = await conn.query(query, parameters, db=neo4j_utils.database, name=f'{label.lower()}_names_page')
+        for record in records:
+            yield record['name']
+        if len(records) < parameters['limit']:
+            return
+        parameters['name'], parameters['id'] = records[-1]['name'], records[-1]['id']
+
+
+@cached('neo4j')
+@resilience_utils.serve_stale()
+async def get_univ_list():
+    if snapshot_utils.use_snapshot:
+        return neo4j_utils.get_univ_list.uncached()
+    return [name async for name in iter_names('INSTITUTE')]
+
+
+@cached('neo4j')
+@resilience_utils.serve_stale()
+async def get_prof_list():
+    if snapshot_utils.use_snapshot:
+        return neo4j_utils.get_prof_list.uncached()
+    return [name async for name in iter_names('FACULTY')]
@@ -0,0 +1,98 @@
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import inspect
+import logging
+import os
+import threading
+
+# one asyncio event loop per process, running in a daemon thread. The async data layer
+# (async_mongodb_utils, async_neo4j_utils, async_mysql_utils) runs on it, so any number
+# of widget queries can be in flight at once while the Dash worker threads only wait
+# for their results. The loop (and the clients bound to it) is re-created after fork.
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop():
+    global _loop, _loop_pid
+    if _loop_pid != os.getpid():
+        with _loop_lock:
+            if _loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=_run_loop, args=(loop, ), name='async-queries', daemon=True).start()
+                _loop, _loop_pid = loop, os.getpid()
+    return _loop
+
+
+# schedule a coroutine on the shared loop, returns a concurrent.futures.Future
+def submit(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, get_loop())
+
+
+# run a coroutine on the shared loop and wait for its result; on timeout the
+# coroutine is cancelled and TimeoutError raised
+def run(coroutine, timeout=None):
+    future = submit(coroutine)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+# synchronous function running the coroutine function on the shared loop, for code
+# that calls the data layer from threads (the Dash callbacks)
+def blocking(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return run(func(*args, **kwargs))
+    return wrapper
+
+
+# call a data layer function, synchronous or async, from a thread
+def call(func, *args):
+    if inspect.iscoroutinefunction(func):
+        return run(func(*args))
+    return func(*args)
+
+
+# run the callbacks registered with add_shutdown (closing clients and pools) on the
+# loop, then stop it
+_shutdown_callbacks = []
+
+
+def add_shutdown(callback):
+    _shutdown_callbacks.append(callback)
+
+
+def shutdown(timeout=5):
+    global _loop, _loop_pid
+    with _loop_lock:
+        loop = _loop if _loop_pid == os.getpid() else None
+        _loop = _loop_pid = None
+    if loop is None:
+        return
+
+    async def close():
+        for callback in _shutdown_callbacks:
+            try:
+                await callback()
+            except Exception as e:
+                logging.warning(f"Async shutdown failed: {e}")
+
+    try:
+        asyncio.run_coroutine_threadsafe(close(), loop).result(timeout)
+    except Exception as e:
+        logging.warning(f"Async shutdown failed: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(shutdown)
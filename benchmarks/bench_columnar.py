@@ -0,0 +1,107 @@
+# Row-oriented vs. columnar conversion of large results:
+#   * neo4j: the full professor list as Record objects, Result.to_df and Result.value
+#   * mongodb: the trend table aggregation as a list of dicts vs. aggregate_columns
+#     (pymongoarrow when installed)
+#   * mysql: the KRC matrix entries as tuples vs. NumPy columns
+#   * callbacks: DataTable rows from DataFrame.to_dict('records') vs. to_records
+#
+#   python -m benchmarks.bench_columnar -n 20
+#   python -m benchmarks.bench_columnar --local --rows 100000   # callback serialisation only
+import argparse
+import json
+import random
+
+import numpy as np
+import pandas as pd
+from neo4j import Result
+
+import mongodb_utils
+import mysql_utils
+import neo4j_utils
+from app import to_records
+from benchmarks.common import column, time_calls, print_stats
+from benchmarks.synthetic import make_names
+
+
+def bench_serialisation(rows, n):
+    rng = random.Random(0)
+    names = make_names(rng, rows, words=(2, 2))
+    df = pd.DataFrame({'Professor': names,
+                       'Institute': [f"University {rng.randint(1, 500)}" for _ in range(rows)],
+                       'Citation Score': np.round(np.random.default_rng(0).uniform(0, 1000, rows), 2)})
+    print_stats(f"to_dict('records') + json ({rows} rows)", time_calls(lambda: json.dumps(df.to_dict('records')), n=n))
+    print_stats(f"to_records + json ({rows} rows)", time_calls(lambda: json.dumps(to_records(df)), n=n))
+
+
+def bench_neo4j(n):
+    query = '''
+        MATCH (f:FACULTY)
+        RETURN f.name as name
+        ORDER BY name
+    '''
+
+    def run(transformer):
+        return neo4j_utils.conn.query(query, db=neo4j_utils.database, transformer=transformer)
+
+    print_stats("neo4j professor list, records", time_calls(lambda: [r['name'] for r in run(list)], n=n))
+    print_stats("neo4j professor list, to_df", time_calls(lambda: run(Result.to_df)['name'], n=n))
+    print_stats("neo4j professor list, value", time_calls(lambda: run(column('name')), n=n))
+
+
+def bench_mongo(n):
+    publication = mongodb_utils.get_collection("publications")
+    query = [
+        {"$match": {"year": {"$gte": mongodb_utils.start_year, "$lte": mongodb_utils.end_year}}},
+        {"$project": {"year": 1, "keyword": {"$setUnion": ["$keywords.name", []]}}},
+        {"$unwind": "$keyword"},
+        {"$group": {"_id": {"keyword": "$keyword", "year": "$year"}, "n_publication": {"$sum": 1}}},
+        {"$project": {"_id": 0, "keyword": "$_id.keyword", "year": "$_id.year", "n_publication": 1}},
+    ]
+    fields = {"keyword": str, "year": int, "n_publication": int}
+
+    def documents():
+        return pd.DataFrame(list(publication.aggregate(query, allowDiskUse=True)))
+
+    def columns():
+        return pd.DataFrame(mongodb_utils.aggregate_columns(publication, query, fields, allowDiskUse=True))
+
+    use_arrow = mongodb_utils.use_arrow
+    print_stats("mongodb keyword x year counts, documents", time_calls(documents, n=n, warmup=1))
+    mongodb_utils.use_arrow = False
+    print_stats("mongodb keyword x year counts, columns", time_calls(columns, n=n, warmup=1))
+    if mongodb_utils.aggregate_arrow_all is not None:
+        mongodb_utils.use_arrow = True
+        print_stats("mongodb keyword x year counts, arrow", time_calls(columns, n=n, warmup=1))
+    mongodb_utils.use_arrow = use_arrow
+
+
+def bench_mysql(n):
+    def rows():
+        with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+            return np.array([float(row[2] or 0) for row in db.fetch_data(mysql_utils.krc_entries_query)])
+
+    def columns():
+        with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+            return db.fetch_columns(mysql_utils.krc_entries_query,
+                                    dtypes=[np.int64, np.int64, np.float64, np.int64])[2]
+
+    print_stats("mysql KRC entries, tuples", time_calls(rows, n=n, warmup=1))
+    print_stats("mysql KRC entries, columns", time_calls(columns, n=n, warmup=1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=50000, help="rows of the serialisation benchmark")
+    parser.add_argument("--local", action="store_true", help="skip the database benchmarks")
+    args = parser.parse_args()
+
+    bench_serialisation(args.rows, args.n)
+    if not args.local:
+        bench_neo4j(args.n)
+        bench_mongo(args.n)
+        bench_mysql(args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Throughput of adding and deleting favorite keywords one at a time (one
+# connection checkout and commit per keyword) versus add_fav_keywords /
+# delete_fav_keywords (executemany in one transaction). Runs in its own session,
+# so it doesn't touch the favorites of real users.
+#
+#   python -m benchmarks.bench_fav_batch --batch 50 --rounds 10
+import argparse
+import time
+import uuid
+
+import mysql_utils
+
+
+def throughput(func, keywords, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(keywords)
+    return len(keywords) * rounds / (time.perf_counter() - start)
+
+
+session_id = 'bench-' + uuid.uuid4().hex[:16]
+
+
+def add_one_by_one(keywords):
+    for keyword in keywords:
+        mysql_utils.add_fav_keyword(session_id, keyword)
+
+
+def delete_one_by_one(keywords):
+    for keyword in keywords:
+        mysql_utils.delete_fav_keyword(session_id, keyword)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    keywords = list(dict.fromkeys(mysql_utils.fetch_all_keywords()))[:args.batch]
+
+    def single(keywords):
+        add_one_by_one(keywords)
+        delete_one_by_one(keywords)
+
+    def batched(keywords):
+        mysql_utils.add_fav_keywords(session_id, keywords)
+        mysql_utils.delete_fav_keywords(session_id, keywords)
+
+    # each round adds and deletes every keyword, so count both operations
+    print(f"one by one: {2 * throughput(single, keywords, args.rounds):,.0f} keywords/sec")
+    print(f"batched:    {2 * throughput(batched, keywords, args.rounds):,.0f} keywords/sec")
+    print(mysql_utils.get_pool_stats())
+
+
+if __name__ == "__main__":
+    main()
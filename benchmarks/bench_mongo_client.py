@@ -0,0 +1,45 @@
+# Per-call latency of the trend widget with a new MongoClient per call (the old
+# behaviour) versus the shared client from mongodb_utils.get_client().
+#
+#   python -m benchmarks.bench_mongo_client --keyword "machine learning" -n 200
+import argparse
+
+from pymongo import MongoClient
+
+import mongodb_utils
+from benchmarks.common import time_calls, print_stats
+
+
+def trend_with_new_client(keyword):
+    client = MongoClient(**mongodb_utils.config)
+    try:
+        publication = client[mongodb_utils.database]["publications"]
+        return list(publication.aggregate([
+            {"$match": {"keywords.name": keyword}},
+            {"$group": {"_id": "$year", "n_publication": {"$sum": 1}}},
+        ]))
+    finally:
+        client.close()
+
+
+def trend_with_shared_client(keyword):
+    publication = mongodb_utils.get_collection("publications")
+    return list(publication.aggregate([
+        {"$match": {"keywords.name": keyword}},
+        {"$group": {"_id": "$year", "n_publication": {"$sum": 1}}},
+    ]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keyword", default="machine learning")
+    parser.add_argument("-n", type=int, default=100)
+    args = parser.parse_args()
+
+    print_stats("new client per call", time_calls(trend_with_new_client, (args.keyword,), args.n))
+    print_stats("shared client", time_calls(trend_with_shared_client, (args.keyword,), args.n))
+    mongodb_utils.close_client()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Latency of the neo4j widget queries with f-string Cypher (one query text, and
+# so one plan, per distinct argument) versus $parameters (one cached plan per
+# widget). distinct_query_texts is the number of texts the run sent, i.e. the
+# number of plans the server had to compile at most; the server's own query cache
+# hit counters are in its metrics (cypher.cache.*), not measured here.
+#
+#   python -m benchmarks.bench_neo4j_queries -n 200
+import argparse
+import random
+import time
+
+from neo4j import Result
+
+import neo4j_utils
+from benchmarks.common import column, summarize, print_stats
+
+TOP_PROFESSOR = '''
+    MATCH (f1:FACULTY)-[:PUBLISH]-(p:PUBLICATION)-[l:LABEL_BY]-(k:KEYWORD),
+    (f2:FACULTY)-[:AFFILIATION_WITH]-(i:INSTITUTE)
+    WHERE k.name = {keyword} AND p.year >= {start_year} AND p.year <= {end_year}  AND f1.id = f2.id
+    WITH f1, SUM(p.numCitations * l.score) AS krc, i
+    RETURN f1.name, i.name as institute, ROUND(krc, 2) AS citation_score
+    ORDER BY citation_score DESC
+    LIMIT 10
+'''
+TOP_KEYWORDS_OF_UNIV = '''
+    MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) -[i:INTERESTED_IN] -> (k:KEYWORD)
+    WHERE i1.name = {univ}
+    RETURN k.name, count(DISTINCT f1.id) AS n_prof
+    ORDER BY n_prof DESC
+    LIMIT 10
+'''
+TOP_KEYWORDS_OF_PROF = '''
+    MATCH (k1:KEYWORD) <- [i:INTERESTED_IN]- (f1:FACULTY) -[:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k2:KEYWORD)
+    WHERE f1.name = {prof} AND k2.name = k1.name
+    RETURN k2.name, ROUND(SUM(l.score * p.numCitations),2) AS citation_score
+    ORDER BY citation_score DESC
+    LIMIT 10
+'''
+
+
+def quote(value):
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def run(template, params, inline):
+    if inline:
+        text = template.format(**{k: quote(v) if isinstance(v, str) else v for k, v in params.items()})
+        parameters = None
+    else:
+        text = template.format(**{k: '$' + k for k in params})
+        parameters = params
+    t0 = time.perf_counter()
+    neo4j_utils.conn.query(text, parameters, db=neo4j_utils.database, transformer=Result.to_df)
+    return text, (time.perf_counter() - t0) * 1000
+
+
+def bench(name, template, arg_samples, inline):
+    texts = set()
+    samples = []
+    for params in arg_samples:
+        text, ms = run(template, params, inline)
+        texts.add(text)
+        samples.append(ms)
+    stats = summarize(samples)
+    stats["distinct_query_texts"] = len(texts)
+    print_stats(f"{name} ({'f-string' if inline else 'parameters'})", stats)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    keywords = neo4j_utils.conn.query("MATCH (k:KEYWORD) RETURN k.name AS name LIMIT 1000",
+                                      db=neo4j_utils.database, transformer=column('name'))
+    univs = neo4j_utils.get_univ_list()
+    profs = neo4j_utils.get_prof_list()
+
+    widgets = {
+        "get_top_professor": (TOP_PROFESSOR, lambda: (lambda s: {
+            "keyword": rng.choice(keywords), "start_year": s, "end_year": rng.randint(s, 2020)})(rng.randint(1980, 2020))),
+        "get_top_keywords_of_univ": (TOP_KEYWORDS_OF_UNIV, lambda: {"univ": rng.choice(univs)}),
+        "get_top_keywords_of_prof": (TOP_KEYWORDS_OF_PROF, lambda: {"prof": rng.choice(profs)}),
+    }
+    for name, (template, sample) in widgets.items():
+        arg_samples = [sample() for _ in range(args.n)]
+        neo4j_utils.conn.query("CALL db.clearQueryCaches()", db=neo4j_utils.database)
+        bench(name, template, arg_samples, inline=True)
+        neo4j_utils.conn.query("CALL db.clearQueryCaches()", db=neo4j_utils.database)
+        bench(name, template, arg_samples, inline=False)
+    neo4j_utils.conn.close()
+
+
+if __name__ == "__main__":
+    main()
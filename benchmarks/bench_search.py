@@ -0,0 +1,76 @@
+# Initial layout payload of the keyword/professor dropdowns with every name in
+# their options (the old layout) versus the type-ahead layout, and per-keystroke
+# latency of search_utils.NameIndex on a synthetic corpus.
+#
+#   python -m benchmarks.bench_search --keywords 100000 --professors 20000
+import argparse
+import json
+import random
+import time
+
+from search_utils import NameIndex
+from benchmarks.common import summarize, print_stats
+
+SYLLABLES = ["ma", "chi", "ne", "lear", "ning", "da", "ta", "vi", "sion", "gra", "ph", "ro", "bo", "tic",
+             "neu", "ral", "com", "pu", "ter", "sys", "tem", "net", "work", "qua", "ntum", "bio", "info"]
+
+
+def make_names(rng, n, words=(1, 3)):
+    names = set()
+    while len(names) < n:
+        names.add(" ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+                           for _ in range(rng.randint(*words))))
+    return sorted(names)
+
+
+def options_size(options):
+    return len(json.dumps(options).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keywords", type=int, default=100000)
+    parser.add_argument("--professors", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    keywords = make_names(rng, args.keywords)
+    professors = make_names(rng, args.professors, words=(2, 2))
+
+    def make_options(names):
+        return [{'label': name, 'value': name} for name in names]
+
+    # keyword, keyword-dropdown, keyword-dropdown-2 and faculty-dropdown
+    full = options_size([make_options(keywords)] * 3 + [make_options(professors)])
+    typeahead = options_size([make_options(keywords[:1])] * 2 + [[]] + [make_options(professors[2:3])])
+    print(f"dropdown options in the initial layout: {full / 1e6:.2f} MB -> {typeahead} bytes")
+
+    start = time.perf_counter()
+    keyword_index = NameIndex(keywords)
+    print(f"index build over {len(keyword_index)} keywords: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # type each sampled name one character at a time, as the dropdown does
+    samples = []
+    for name in rng.sample(keywords, args.queries):
+        typed = name[rng.randint(0, len(name) // 2):]
+        for end in range(1, min(len(typed), 8) + 1):
+            t0 = time.perf_counter()
+            keyword_index.search(typed[:end], args.limit)
+            samples.append((time.perf_counter() - t0) * 1000)
+    print_stats("keystroke latency (keywords)", summarize(samples))
+
+    professor_index = NameIndex(professors)
+    samples = []
+    for name in rng.sample(professors, min(args.queries, len(professors))):
+        for end in range(1, min(len(name), 8) + 1):
+            t0 = time.perf_counter()
+            professor_index.search(name[:end], args.limit)
+            samples.append((time.perf_counter() - t0) * 1000)
+    print_stats("keystroke latency (professors)", summarize(samples))
+
+
+if __name__ == "__main__":
+    main()
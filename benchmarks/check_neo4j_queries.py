@@ -0,0 +1,99 @@
+# Regression check of the rewritten widget 2 and 4 Cypher queries: the directed,
+# anchored traversals in neo4j_utils must return the same rows as the original
+# cartesian/undirected queries, and PROFILE shows the db hits of both.
+#
+#   python -m benchmarks.check_neo4j_queries --load --scale tiny   # on a generated graph
+#   python -m benchmarks.check_neo4j_queries --neo4j-db neo4j -n 50
+#
+# Exits with status 1 if any result differs.
+import argparse
+import random
+import sys
+
+from neo4j import Result
+
+import migrations
+import neo4j_utils
+from benchmarks import synthetic
+from benchmarks.common import column
+
+# the queries before the rewrite
+legacy_top_professor_query = '''
+    MATCH (f1:FACULTY)-[:PUBLISH]-(p:PUBLICATION)-[l:LABEL_BY]-(k:KEYWORD),
+    (f2:FACULTY)-[:AFFILIATION_WITH]-(i:INSTITUTE)
+    WHERE k.name = $keyword AND p.year >= $start_year AND p.year <= $end_year  AND f1.id = f2.id
+    WITH f1, SUM(p.numCitations * l.score) AS krc, i
+    RETURN f1.name, i.name as institute, ROUND(krc, 2) AS citation_score
+    ORDER BY citation_score DESC
+    LIMIT 10
+'''
+legacy_top_keywords_of_prof_query = '''
+    MATCH (k1:KEYWORD) <- [i:INTERESTED_IN]- (f1:FACULTY) -[:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k2:KEYWORD)
+    WHERE f1.name = $prof AND k2.name = k1.name
+    RETURN k2.name, ROUND(SUM(l.score * p.numCitations),2) AS citation_score
+    ORDER BY citation_score DESC
+    LIMIT 10
+'''
+
+
+def rows(query, parameters):
+    df = neo4j_utils.conn.query(query, parameters, db=neo4j_utils.database, transformer=Result.to_df)
+    return [tuple(row) for row in df.itertuples(index=False)]
+
+
+# equal top-10 lists: same scores, and the same rows above the lowest score (rows
+# tied at the cut-off may be picked in any order by LIMIT)
+def same_top(expected, actual):
+    if sorted(row[-1] for row in expected) != sorted(row[-1] for row in actual):
+        return False
+    if not expected:
+        return True
+    cutoff = min(row[-1] for row in expected)
+    return sorted(row for row in expected if row[-1] > cutoff) == sorted(row for row in actual if row[-1] > cutoff)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    synthetic.add_arguments(parser)
+    parser.add_argument("--load", action="store_true", help="generate and load a synthetic graph first")
+    parser.add_argument("-n", type=int, default=50, help="sample arguments per query")
+    parser.add_argument("--profiles", type=int, default=5, help="samples to PROFILE per query")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    synthetic.configure(args.mysql_db, args.mongo_db, args.neo4j_db)
+    if args.load:
+        synthetic.load_neo4j(synthetic.generate(**synthetic.scales[args.scale], seed=args.seed))
+
+    keywords = neo4j_utils.conn.query("MATCH (k:KEYWORD) RETURN k.name AS name LIMIT 1000",
+                                      db=neo4j_utils.database, transformer=column('name'))
+    profs = neo4j_utils.get_prof_list.uncached()
+
+    def year_range():
+        start = rng.randint(1980, 2020)
+        return {'keyword': rng.choice(keywords), 'start_year': start, 'end_year': rng.randint(start, 2020)}
+
+    checks = {
+        'top_professor': (legacy_top_professor_query, neo4j_utils.top_professor_query, year_range),
+        'top_keywords_of_prof': (legacy_top_keywords_of_prof_query, neo4j_utils.top_keywords_of_prof_query,
+                                 lambda: {'prof': rng.choice(profs)}),
+    }
+    failed = False
+    for name, (legacy, query, sample) in checks.items():
+        samples = [sample() for _ in range(args.n)]
+        mismatches = [parameters for parameters in samples
+                      if not same_top(rows(legacy, parameters), rows(query, parameters))]
+        legacy_hits = [migrations._neo4j_profile(legacy, p)['db_hits'] for p in samples[:args.profiles]]
+        hits = [migrations._neo4j_profile(query, p)['db_hits'] for p in samples[:args.profiles]]
+        print(f"{name}: {len(samples) - len(mismatches)}/{len(samples)} identical, "
+              f"db hits {sum(legacy_hits)} -> {sum(hits)} "
+              f"({sum(legacy_hits) / max(sum(hits), 1):.1f}x fewer) over {len(hits)} profiled calls")
+        for parameters in mismatches[:5]:
+            print(f"  differs for {parameters}")
+        failed = failed or bool(mismatches)
+    neo4j_utils.conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
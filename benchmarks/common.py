@@ -0,0 +1,56 @@
+import json
+import statistics
+import subprocess
+import time
+
+
+# neo4j result transformer: the value of one column for all records, without building
+# Record objects for the caller
+def column(key):
+    return lambda result: result.value(key)
+
+
+# call fn(*args) n times and return latency percentiles in milliseconds
+def time_calls(fn, args=(), n=100, warmup=3):
+    for _ in range(warmup):
+        fn(*args)
+    samples = []
+    start = time.perf_counter()
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - start
+    return summarize(samples, elapsed)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(samples, elapsed=None):
+    stats = {
+        "n": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p95_ms": round(percentile(samples, 95), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+    }
+    if elapsed:
+        stats["throughput_per_s"] = round(len(samples) / elapsed, 1)
+    return stats
+
+
+def print_stats(name, stats):
+    print(f"{name:<40} " + json.dumps(stats))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
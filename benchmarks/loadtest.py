@@ -0,0 +1,371 @@
+# Headless load test of the Dash callbacks. Every virtual user loads the page and
+# replays a session against /_dash-update-component the way the browser would:
+# keyword and professor changes, type-ahead searches, year slider drags and favorite
+# keyword adds/imports/deletes. Callbacks whose inputs are changed by a response are
+# fired in turn, so a feedback loop between callbacks shows up as chained calls.
+#
+# Against a running server:
+#   python -m benchmarks.loadtest --url http://127.0.0.1:8050 --users 20 --duration 60
+# Sweep gunicorn workers x threads (needs gunicorn), on the stubbed or synthetic data layer:
+#   python -m benchmarks.loadtest --workers 1,2,4 --threads 1,4,8 --data stub --out results/load.json
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+from benchmarks.common import summarize, print_stats, git_commit
+from benchmarks.synthetic import SYLLABLES
+
+# relative frequency of the user actions in a session
+actions = {
+    'keyword': 4,
+    'search': 4,
+    'slider_drag': 3,
+    'university': 2,
+    'professor': 2,
+    'add_favorite': 3,
+    'import_favorites': 1,
+    'delete_favorite': 2,
+}
+
+max_chain_depth = 5
+
+
+# latencies and errors per callback, shared by all virtual users
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.chained = {}
+        self.lock = threading.Lock()
+
+    def add(self, label, ms, error, chained):
+        with self.lock:
+            self.samples.setdefault(label, []).append(ms)
+            self.errors[label] = self.errors.get(label, 0) + error
+            self.chained[label] = self.chained.get(label, 0) + chained
+
+    def report(self, elapsed):
+        with self.lock:
+            report = {}
+            for label, samples in sorted(self.samples.items()):
+                stats = summarize(samples, elapsed)
+                stats['errors'] = self.errors[label]
+                stats['error_rate'] = round(self.errors[label] / len(samples), 4)
+                stats['chained'] = self.chained[label]
+                report[label] = stats
+            return report
+
+
+def _split(key):
+    component_id, prop = key.rsplit('.', 1)
+    return component_id, prop
+
+
+# outputs of a dependency as the renderer sends them: a dict for one output, a list for many
+def _outputs(output):
+    if output.startswith('..'):
+        return [dict(zip(('id', 'property'), _split(part))) for part in output[2:-2].split('...')]
+    return dict(zip(('id', 'property'), _split(output)))
+
+
+def _label(dep, trigger):
+    outputs = _outputs(dep['output'])
+    first = outputs[0] if isinstance(outputs, list) else outputs
+    return f"{first['id']}.{first['property'].split('@')[0]} <- {trigger[0]}.{trigger[1]}"
+
+
+def _walk(component, props):
+    if isinstance(component, list):
+        for child in component:
+            _walk(child, props)
+    elif isinstance(component, dict) and 'props' in component:
+        component_props = component['props']
+        if 'id' in component_props:
+            for prop, value in component_props.items():
+                props[(component_props['id'], prop)] = value
+        for value in component_props.values():
+            _walk(value, props)
+
+
+# one browser tab: the component props of the page and the callbacks between them
+class Page:
+    def __init__(self, url, recorder, timeout=30):
+        self.url = url.rstrip('/')
+        self.recorder = recorder
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.props = {}
+        self.dependencies = []
+
+    def load(self):
+        start = time.perf_counter()
+        error = False
+        try:
+            layout = self.http.get(self.url + '/_dash-layout', timeout=self.timeout)
+            layout.raise_for_status()
+            if not self.dependencies:
+                dependencies = self.http.get(self.url + '/_dash-dependencies', timeout=self.timeout)
+                dependencies.raise_for_status()
+                self.dependencies = dependencies.json()
+            self.props = {}
+            _walk(layout.json(), self.props)
+        except requests.RequestException:
+            error = True
+            raise
+        finally:
+            self.recorder.add('page load', (time.perf_counter() - start) * 1000, error, 0)
+        # local storage of a first visit: a new session id
+        self.props[('session-id', 'data')] = uuid.uuid4().hex
+        self.props[('session-id', 'modified_timestamp')] = int(time.time() * 1000)
+        initial = [dep for dep in self.dependencies if not dep.get('prevent_initial_call')]
+        for dep in initial:
+            trigger = dep['inputs'][0]
+            self.fire(dep, (trigger['id'], trigger['property']))
+
+    def _value(self, item):
+        return {'id': item['id'], 'property': item['property'],
+                'value': self.props.get((item['id'], item['property']))}
+
+    def fire(self, dep, trigger, depth=0):
+        body = {
+            'output': dep['output'],
+            'outputs': _outputs(dep['output']),
+            'inputs': [self._value(item) for item in dep['inputs']],
+            'changedPropIds': [f"{trigger[0]}.{trigger[1]}"],
+            'state': [self._value(item) for item in dep.get('state', [])],
+        }
+        label = _label(dep, trigger)
+        start = time.perf_counter()
+        try:
+            response = self.http.post(self.url + '/_dash-update-component', json=body, timeout=self.timeout)
+            error = response.status_code >= 400
+        except requests.RequestException:
+            response, error = None, True
+        self.recorder.add(label, (time.perf_counter() - start) * 1000, error, depth > 0)
+        # 204 is PreventUpdate
+        if error or response.status_code != 200:
+            return {}
+
+        changed = {}
+        for component_id, values in response.json().get('response', {}).items():
+            for prop, value in values.items():
+                self.props[(component_id, prop)] = value
+                changed[(component_id, prop)] = value
+        if depth < max_chain_depth:
+            for key in changed:
+                for chained in self.dependents(key):
+                    self.fire(chained, key, depth + 1)
+        return changed
+
+    def dependents(self, key):
+        return [dep for dep in self.dependencies
+                if any((item['id'], item['property']) == key for item in dep['inputs'])]
+
+    # a user action: set a prop and run the callbacks that take it as input
+    def set(self, component_id, prop, value):
+        key = (component_id, prop)
+        self.props[key] = value
+        changed = {}
+        for dep in self.dependents(key):
+            changed.update(self.fire(dep, key))
+        return changed
+
+    # option values returned by the type-ahead callback of a dropdown
+    def search(self, component_id, text):
+        options = self.set(component_id, 'search_value', text).get((component_id, 'options')) or []
+        return [option['value'] for option in options]
+
+
+# keyword and professor names, found through the type-ahead callbacks
+def discover_names(url, recorder, rng, searches=20):
+    page = Page(url, recorder)
+    page.load()
+    keywords, professors = set(), set()
+    for _ in range(searches):
+        prefix = rng.choice(SYLLABLES)
+        keywords.update(page.search('keyword', prefix))
+        professors.update(page.search('faculty-dropdown', prefix.title()))
+    universities = [option['value'] for option in page.props.get(('university', 'options')) or []]
+    return sorted(keywords), sorted(professors), universities
+
+
+def run_session(page, rng, names, n_actions, drag_ticks):
+    keywords, professors, universities = names
+    page.load()
+    for action in rng.choices(list(actions), weights=list(actions.values()), k=n_actions):
+        if action == 'keyword':
+            page.set(rng.choice(['keyword', 'keyword-dropdown']), 'value', rng.choice(keywords))
+        elif action == 'search':
+            keyword = rng.choice(keywords)
+            for n in range(1, min(len(keyword), 4) + 1):
+                page.search('keyword', keyword[:n])
+        elif action == 'slider_drag':
+            start_year = rng.randint(1980, 2015)
+            end_years = sorted(rng.sample(range(start_year, 2021), min(drag_ticks, 2021 - start_year)))
+            # a mouseup slider only reports where the drag ended
+            if page.props.get(('year-range-slider', 'updatemode')) == 'mouseup':
+                end_years = end_years[-1:]
+            for end_year in end_years:
+                page.set('year-range-slider', 'value', [start_year, end_year])
+        elif action == 'university' and universities:
+            page.set('university', 'value', rng.choice(universities))
+        elif action == 'professor' and professors:
+            page.set('faculty-dropdown', 'value', rng.choice(professors))
+        elif action == 'add_favorite':
+            page.props[('keyword-dropdown-2', 'value')] = rng.choice(keywords)
+            n_clicks = page.props.get(('add-to-fav-button', 'n_clicks')) or 0
+            page.set('add-to-fav-button', 'n_clicks', n_clicks + 1)
+        elif action == 'import_favorites':
+            page.props[('import-keywords-text', 'value')] = '\n'.join(rng.sample(keywords, 3))
+            n_clicks = page.props.get(('import-keywords-button', 'n_clicks')) or 0
+            page.set('import-keywords-button', 'n_clicks', n_clicks + 1)
+        elif action == 'delete_favorite':
+            rows = page.props.get(('fav-keywords-table', 'data')) or []
+            if rows:
+                rows = list(rows)
+                rows.pop(rng.randrange(len(rows)))
+                page.props[('fav-keywords-table', 'data')] = rows
+                page.set('fav-keywords-table', 'data_timestamp', int(time.time() * 1000))
+
+
+def run_load(url, users, duration, n_actions=20, drag_ticks=8, seed=0):
+    recorder = Recorder()
+    names = discover_names(url, Recorder(), random.Random(seed))
+    if not names[0]:
+        raise RuntimeError("no keywords found through the type-ahead callback")
+    deadline = time.monotonic() + duration
+    sessions = [0] * users
+
+    def user(i):
+        rng = random.Random(seed * 1000 + i)
+        page = Page(url, recorder)
+        while time.monotonic() < deadline:
+            try:
+                run_session(page, rng, names, n_actions, drag_ticks)
+                sessions[i] += 1
+            except requests.RequestException:
+                time.sleep(0.1)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(i, ), daemon=True) for i in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    callbacks = recorder.report(elapsed)
+    total = sum(stats['n'] for stats in callbacks.values())
+    errors = sum(stats['errors'] for stats in callbacks.values())
+    return {
+        'users': users,
+        'duration_s': round(elapsed, 1),
+        'sessions': sum(sessions),
+        'requests': total,
+        'throughput_per_s': round(total / elapsed, 1),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'chained_calls': sum(stats['chained'] for stats in callbacks.values()),
+        'callbacks': callbacks,
+    }
+
+
+def wait_ready(url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            if requests.get(url + '/_dash-dependencies', timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+# start gunicorn with the given workers and threads, run the load, stop it
+def run_gunicorn(args, workers, threads):
+    env = dict(os.environ, RFE_LOADTEST_DATA=args.data, RFE_STUB_LATENCY_MS=str(args.stub_latency_ms),
+               RFE_MYSQL_DB=args.mysql_db, RFE_MONGO_DB=args.mongo_db, RFE_NEO4J_DB=args.neo4j_db,
+               RFE_ASYNC='1' if args.async_queries else '0')
+    bind = f"127.0.0.1:{args.port}"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads), "-b", bind,
+         "--timeout", "120", "benchmarks.loadtest_app:server"],
+        env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    url = f"http://{bind}"
+    try:
+        wait_ready(url, process)
+        return run_load(url, args.users, args.duration, args.actions, args.drag_ticks, args.seed)
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def _ints(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="load an already running server instead of starting gunicorn")
+    parser.add_argument("--workers", type=_ints, default=[1, 2, 4])
+    parser.add_argument("--threads", type=_ints, default=[1, 4])
+    parser.add_argument("--port", type=int, default=8060)
+    parser.add_argument("--data", choices=['stub', 'synthetic'], default='stub')
+    parser.add_argument("--stub-latency-ms", type=float, default=5)
+    parser.add_argument("--async-queries", action="store_true",
+                        help="serve the callbacks from the async data layer (synthetic data only)")
+    parser.add_argument("--mysql-db", default='academicworld_bench')
+    parser.add_argument("--mongo-db", default='academicworld_bench')
+    parser.add_argument("--neo4j-db", default='neo4j')
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per configuration")
+    parser.add_argument("--actions", type=int, default=20, help="user actions per session")
+    parser.add_argument("--drag-ticks", type=int, default=8, help="slider values sent per drag")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="JSON results file")
+    args = parser.parse_args()
+    if args.async_queries and args.data == 'stub':
+        parser.error("--async-queries needs --data synthetic, the stubs replace the synchronous functions")
+
+    runs = []
+    if args.url:
+        configurations = [(None, None)]
+    else:
+        configurations = [(w, t) for w in args.workers for t in args.threads]
+    for workers, threads in configurations:
+        if args.url:
+            result = run_load(args.url, args.users, args.duration, args.actions, args.drag_ticks, args.seed)
+        else:
+            result = run_gunicorn(args, workers, threads)
+        result.update(workers=workers, threads=threads)
+        runs.append(result)
+        print(f"workers={workers} threads={threads}: {result['throughput_per_s']} req/s, "
+              f"error rate {result['error_rate']}, {result['chained_calls']} chained calls")
+        for label, stats in result['callbacks'].items():
+            print_stats(f"  {label}", stats)
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'data': 'external' if args.url else args.data,
+        'async_queries': args.async_queries,
+        'runs': runs,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# gunicorn entry point for the load test (benchmarks.loadtest_app:server). The data
+# layer is picked by environment variables, since gunicorn workers import this module:
+#   RFE_LOADTEST_DATA=stub        in-memory stubs (benchmarks/stub_data.py)
+#   RFE_LOADTEST_DATA=synthetic   the synthetic benchmark databases (benchmarks/synthetic.py)
+#   RFE_STUB_LATENCY_MS           simulated latency of each stubbed query
+#   RFE_MYSQL_DB, RFE_MONGO_DB, RFE_NEO4J_DB   benchmark database names
+#   RFE_ASYNC=1                   callbacks use the async data layer (see app.py)
+import os
+
+from benchmarks import stub_data, synthetic
+
+if os.environ.get('RFE_LOADTEST_DATA', 'stub') == 'stub':
+    stub_data.latency = float(os.environ.get('RFE_STUB_LATENCY_MS', 5)) / 1000
+    stub_data.install()
+else:
+    synthetic.configure(os.environ.get('RFE_MYSQL_DB', 'academicworld_bench'),
+                        os.environ.get('RFE_MONGO_DB', 'academicworld_bench'),
+                        os.environ.get('RFE_NEO4J_DB', 'neo4j'))
+
+from app import server
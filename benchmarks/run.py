@@ -0,0 +1,141 @@
+# Benchmark harness: optionally generates and loads synthetic academicworld data
+# (see benchmarks/synthetic.py), then measures p50/p95/p99 latency and throughput
+# of the six widget functions and of app startup, and writes the results as JSON.
+#
+#   docker compose -f benchmarks/docker-compose.yml up -d
+#   python -m benchmarks.run --scale small --load --out results/small.json
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import cache_utils
+import mongodb_utils
+import mysql_utils
+import neo4j_utils
+from benchmarks import synthetic
+from benchmarks.common import summarize, print_stats, git_commit
+
+# app startup in a fresh interpreter, against the benchmark databases. The files the app
+# derives from them (see synthetic.bench_dir) are deleted before each run, so every run
+# is a cold start.
+startup_script = '''
+import time
+start = time.perf_counter()
+from benchmarks import synthetic
+synthetic.configure({mysql_db!r}, {mongo_db!r}, {neo4j_db!r})
+import app
+imported = time.perf_counter()
+app.serve_layout()
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+def measure_startup(args, runs):
+    script = startup_script.format(mysql_db=args.mysql_db, mongo_db=args.mongo_db, neo4j_db=args.neo4j_db)
+    imports, layouts = [], []
+    for _ in range(runs):
+        shutil.rmtree(synthetic.bench_dir(args.mysql_db), ignore_errors=True)
+        output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        imported, served = map(float, output.stdout.split()[-2:])
+        imports.append(imported * 1000)
+        layouts.append(served * 1000)
+    return {'import': summarize(imports), 'first_layout': summarize(layouts)}
+
+
+# call fn with a fresh random argument tuple each time
+def measure(fn, sample, n):
+    samples = []
+    start = time.perf_counter()
+    for _ in range(n):
+        call_args = sample()
+        t0 = time.perf_counter()
+        fn(*call_args)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    synthetic.add_arguments(parser)
+    parser.add_argument("--load", action="store_true", help="generate and load the synthetic data first")
+    parser.add_argument("-n", type=int, default=200, help="calls per widget function")
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--out", default=None, help="JSON results file")
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    synthetic.configure(args.mysql_db, args.mongo_db, args.neo4j_db)
+    # measure the queries, not the result cache
+    cache_utils.config['backend'] = 'memory'
+    cache_utils.config['maxsize'] = 0
+
+    scale = synthetic.scales[args.scale]
+    if args.load:
+        data = synthetic.generate(**scale, seed=args.seed)
+        synthetic.load(data)
+        keywords = [name for _, name in data['keyword']]
+        universities = [name for _, name in data['university']]
+        professors = [name for _, name, _ in data['faculty']]
+    else:
+        keywords = mysql_utils.fetch_all_keywords()
+        universities = neo4j_utils.get_univ_list()
+        professors = neo4j_utils.get_prof_list()
+    mysql_utils.rebuild_krc_matrix()
+    mongodb_utils.reset_trend_table()
+    mongodb_utils.get_trend_table()
+    neo4j_utils.reset_keyword_krc()
+    neo4j_utils.reset_institute_keywords()
+
+    def year_range():
+        start = rng.randint(1980, 2020)
+        return start, rng.randint(start, 2020)
+
+    def keyword_set():
+        return [sorted(rng.sample(keywords, rng.randint(1, 5)))]
+
+    widgets = {
+        'get_keyword_trend': (mongodb_utils.get_keyword_trend, lambda: (rng.choice(keywords), )),
+        'query_keyword_trend': (mongodb_utils.query_keyword_trend, lambda: (rng.choice(keywords), )),
+        'get_top_professor': (neo4j_utils.get_top_professor, lambda: (rng.choice(keywords), *year_range())),
+        'query_top_professor': (neo4j_utils.query_top_professor, lambda: (rng.choice(keywords), *year_range())),
+        'get_top_keywords_of_univ': (neo4j_utils.get_top_keywords_of_univ, lambda: (rng.choice(universities), )),
+        'query_top_keywords_of_univ': (neo4j_utils.query_top_keywords_of_univ,
+                                       lambda: (rng.choice(universities), )),
+        'get_top_keywords_of_prof': (neo4j_utils.get_top_keywords_of_prof, lambda: (rng.choice(professors), )),
+        'get_recommended_prof': (mysql_utils.get_recommended_prof, keyword_set),
+        'get_recommended_univ': (mysql_utils.get_recommended_univ, keyword_set),
+        'query_recommendations': (mysql_utils.query_recommendations, keyword_set),
+    }
+    results = {}
+    for name, (fn, sample) in widgets.items():
+        fn(*sample())  # warm up connections and in-process tables
+        results[name] = measure(fn, sample, args.n)
+        print_stats(name, results[name])
+
+    results['app_startup'] = measure_startup(args, args.startup_runs)
+    print_stats('app_startup', results['app_startup'])
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'scale': {'name': args.scale, **scale, 'seed': args.seed},
+        'calls_per_widget': args.n,
+        'results': results,
+    }
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# In-memory stand-ins for the widget and favorite keyword functions, with a fixed
+# simulated latency, so the load test can measure Dash/gunicorn overhead without
+# databases. install() has to run before app is imported.
+import random
+import threading
+import time
+
+import pandas as pd
+
+from benchmarks import synthetic
+
+latency = 0.005  # seconds per stubbed query
+
+_favorites = {}
+_favorites_lock = threading.Lock()
+
+
+def _sleep():
+    if latency:
+        time.sleep(latency)
+
+
+def make_options(keywords=2000, universities=100, professors=2000, seed=0):
+    rng = random.Random(seed)
+    return {
+        'keywords': synthetic.make_names(rng, keywords),
+        'universities': [f"University of {name.title()}"
+                         for name in synthetic.make_names(rng, universities, words=(1, 2))],
+        'professors': [name.title() for name in synthetic.make_names(rng, professors, words=(2, 2))],
+    }
+
+
+def install(options=None):
+    import mongodb_utils
+    import mysql_utils
+    import neo4j_utils
+    import option_utils
+
+    options = options or make_options()
+    rng = random.Random(0)
+    professors = options['professors']
+    universities = options['universities']
+    keywords = options['keywords']
+
+    def get_keyword_trend(keyword):
+        _sleep()
+        return pd.DataFrame({'year': list(range(1980, 2021)),
+                             'publication count': [rng.randint(0, 50) for _ in range(1980, 2021)]})
+
+    def get_top_professor(keyword, start_year, end_year):
+        _sleep()
+        return pd.DataFrame({'Professor': rng.sample(professors, 10),
+                             'Institute': rng.choices(universities, k=10),
+                             'Citation Score': sorted((round(rng.uniform(0, 1000), 2) for _ in range(10)),
+                                                      reverse=True)})
+
+    def get_top_keywords_of_univ(univ):
+        _sleep()
+        return pd.DataFrame({'Keyword': rng.sample(keywords, 10),
+                             'Professor Count': sorted(rng.choices(range(1, 30), k=10), reverse=True)})
+
+    def get_top_keywords_of_prof(prof):
+        _sleep()
+        return pd.DataFrame({'Keyword': rng.sample(keywords, 10),
+                             'Citation Score': sorted((round(rng.uniform(0, 500), 2) for _ in range(10)),
+                                                      reverse=True)})
+
+    def fetch_all_fav_keywords(session_id):
+        _sleep()
+        with _favorites_lock:
+            return list(_favorites.get(session_id, []))
+
+    def add_fav_keywords(session_id, new_keywords):
+        _sleep()
+        with _favorites_lock:
+            favorites = _favorites.setdefault(session_id, [])
+            favorites.extend(k for k in new_keywords if k not in favorites)
+        return True
+
+    def add_fav_keyword(session_id, keyword):
+        return add_fav_keywords(session_id, [keyword])
+
+    def delete_fav_keywords(session_id, deleted):
+        _sleep()
+        with _favorites_lock:
+            _favorites[session_id] = [k for k in _favorites.get(session_id, []) if k not in deleted]
+        return True
+
+    def get_recommendations(fav_keywords):
+        _sleep()
+        if not fav_keywords:
+            return [], []
+        recommended_prof = [{"Professor": name, "Institute": rng.choice(universities),
+                             "Total Citation Score": round(rng.uniform(0, 1000), 2)}
+                            for name in rng.sample(professors, 5)]
+        recommended_univ = [{"Institute": name, "Related Professor Count": rng.randint(1, 20),
+                             "Total Citation Score": round(rng.uniform(0, 5000), 2)}
+                            for name in rng.sample(universities, 5)]
+        return recommended_prof, recommended_univ
+
+    mongodb_utils.get_keyword_trend = get_keyword_trend
+    neo4j_utils.get_top_professor = get_top_professor
+    neo4j_utils.get_top_keywords_of_univ = get_top_keywords_of_univ
+    neo4j_utils.get_top_keywords_of_prof = get_top_keywords_of_prof
+    mysql_utils.fetch_all_fav_keywords = fetch_all_fav_keywords
+    mysql_utils.add_fav_keyword = add_fav_keyword
+    mysql_utils.add_fav_keywords = add_fav_keywords
+    mysql_utils.delete_fav_keywords = delete_fav_keywords
+    mysql_utils.get_recommendations = get_recommendations
+    # no KRC matrix or trend table to load or build: the stubs never touch the databases
+    mysql_utils.use_krc_matrix = False
+    mongodb_utils.use_trend_table = False
+    option_utils.get_options = lambda: options
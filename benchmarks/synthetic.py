@@ -0,0 +1,209 @@
+# Synthetic academicworld data at a configurable scale, and loaders for the
+# local MySQL, MongoDB and Neo4j instances of benchmarks/docker-compose.yml.
+#
+#   python -m benchmarks.synthetic --scale small
+#
+# The data goes into the databases named by --mysql-db / --mongo-db / --neo4j-db
+# (academicworld_bench / academicworld_bench / neo4j by default), never into the
+# real academicworld databases.
+import argparse
+import itertools
+import logging
+import os
+import random
+import tempfile
+import time
+
+import mongodb_utils
+import mysql_utils
+import neo4j_utils
+import option_utils
+import resilience_utils
+import snapshot_utils
+
+SYLLABLES = ["ma", "chi", "ne", "lear", "ning", "da", "ta", "vi", "sion", "gra", "ph", "ro", "bo", "tic",
+             "neu", "ral", "com", "pu", "ter", "sys", "tem", "net", "work", "qua", "ntum", "bio", "info"]
+
+# number of keywords, universities, faculty and publications, and edges per node
+scales = {
+    'tiny': dict(keywords=500, universities=20, faculty=500, publications=5000),
+    'small': dict(keywords=5000, universities=100, faculty=5000, publications=50000),
+    'medium': dict(keywords=20000, universities=300, faculty=20000, publications=300000),
+    'large': dict(keywords=100000, universities=1000, faculty=80000, publications=2000000),
+}
+edges = dict(keywords_per_publication=(2, 8), authors_per_publication=(1, 4), interests_per_faculty=(3, 12))
+
+reserved_databases = {'academicworld'}
+
+
+def make_names(rng, n, words=(1, 3)):
+    names = set()
+    while len(names) < n:
+        names.add(" ".join("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+                           for _ in range(rng.randint(*words))))
+    return sorted(names)
+
+
+# the academicworld tables as lists of tuples; popularity of keywords and
+# faculty is skewed, as in the real data
+def generate(keywords, universities, faculty, publications, seed=0):
+    rng = random.Random(seed)
+    data = {}
+    data['keyword'] = list(enumerate(make_names(rng, keywords), start=1))
+    data['university'] = [(i, f"University of {name.title()}")
+                          for i, name in enumerate(make_names(rng, universities, words=(1, 2)), start=1)]
+    faculty_names = make_names(rng, faculty, words=(2, 2))
+    data['faculty'] = [(i, name.title(), rng.randint(1, universities))
+                       for i, name in enumerate(faculty_names, start=1)]
+    data['publication'] = [(i, f"Publication {i}", rng.randint(1975, 2022), int(rng.paretovariate(1.2)) - 1)
+                           for i in range(1, publications + 1)]
+
+    keyword_weights = list(itertools.accumulate(1 / (rank ** 0.8) for rank in range(1, keywords + 1)))
+    faculty_weights = list(itertools.accumulate(1 / (rank ** 0.5) for rank in range(1, faculty + 1)))
+    data['publication_keyword'] = []
+    data['faculty_publication'] = []
+    for publication_id, *_ in data['publication']:
+        n = rng.randint(*edges['keywords_per_publication'])
+        for keyword_id in set(rng.choices(range(1, keywords + 1), cum_weights=keyword_weights, k=n)):
+            data['publication_keyword'].append((publication_id, keyword_id, round(rng.random(), 4)))
+        n = rng.randint(*edges['authors_per_publication'])
+        for faculty_id in set(rng.choices(range(1, faculty + 1), cum_weights=faculty_weights, k=n)):
+            data['faculty_publication'].append((faculty_id, publication_id))
+    data['faculty_keyword'] = []
+    for faculty_id, *_ in data['faculty']:
+        n = rng.randint(*edges['interests_per_faculty'])
+        for keyword_id in set(rng.choices(range(1, keywords + 1), cum_weights=keyword_weights, k=n)):
+            data['faculty_keyword'].append((faculty_id, keyword_id, round(rng.random(), 4)))
+    return data
+
+
+# directory of the files the app derives from the benchmark databases (KRC matrix,
+# option list cache, snapshots), so benchmarks never overwrite the app's own
+def bench_dir(mysql_db='academicworld_bench'):
+    return os.path.join(tempfile.gettempdir(), f'rfe-bench-{mysql_db}')
+
+
+# point the utils modules at the benchmark databases and at bench_dir(); returns the directory
+def configure(mysql_db='academicworld_bench', mongo_db='academicworld_bench', neo4j_db='neo4j'):
+    for name in (mysql_db, mongo_db, neo4j_db):
+        if name in reserved_databases:
+            raise ValueError(f"refusing to use the {name} database for benchmarks")
+    mysql_utils.config['database'] = mysql_db
+    mongodb_utils.database = mongo_db
+    neo4j_utils.database = neo4j_db
+    directory = bench_dir(mysql_db)
+    os.makedirs(directory, exist_ok=True)
+    mysql_utils.krc_matrix_path = os.path.join(directory, 'krc_matrix.npz')
+    option_utils.cache_path = os.path.join(directory, 'options_cache.json')
+    snapshot_utils.snapshot_path = os.path.join(directory, 'snapshot')
+    snapshot_utils.favorites_path = os.path.join(directory, 'favorites.sqlite3')
+    return directory
+
+
+def _batches(rows, size):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+mysql_schema = [
+    "CREATE TABLE keyword (id int PRIMARY KEY, name varchar(512))",
+    "CREATE TABLE university (id int PRIMARY KEY, name varchar(512))",
+    "CREATE TABLE faculty (id int PRIMARY KEY, name varchar(512), university_id int)",
+    "CREATE TABLE publication (id int PRIMARY KEY, title varchar(512), year int, num_citations int)",
+    "CREATE TABLE publication_keyword (publication_id int, keyword_id int, score float, "
+    "PRIMARY KEY (publication_id, keyword_id))",
+    "CREATE TABLE faculty_publication (faculty_id int, publication_id int, "
+    "PRIMARY KEY (faculty_id, publication_id))",
+    "CREATE TABLE faculty_keyword (faculty_id int, keyword_id int, score float, "
+    "PRIMARY KEY (faculty_id, keyword_id))",
+]
+
+
+def load_mysql(data):
+    server_config = {k: v for k, v in mysql_utils.config.items() if k != 'database'}
+    server_config['raise_on_warnings'] = False
+    with mysql_utils.MySQLDatabase(server_config) as db:
+        db.execute_query(f"DROP DATABASE IF EXISTS `{mysql_utils.config['database']}`")
+        db.execute_query(f"CREATE DATABASE `{mysql_utils.config['database']}`")
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        for statement in mysql_schema:
+            db.execute_query(statement)
+        for table, rows in data.items():
+            placeholders = ", ".join(["%s"] * len(rows[0]))
+            for batch in _batches(rows, 5000):
+                db.execute_many(f"INSERT INTO {table} VALUES ({placeholders})", batch)
+
+
+def load_mongo(data):
+    keywords = dict(data['keyword'])
+    labels = {}
+    for publication_id, keyword_id, score in data['publication_keyword']:
+        labels.setdefault(publication_id, []).append(
+            {'id': keyword_id, 'name': keywords[keyword_id], 'score': score})
+    publication = mongodb_utils.get_collection('publications')
+    publication.drop()
+    for batch in _batches(data['publication'], 5000):
+        publication.insert_many([
+            {'id': i, 'title': title, 'year': year, 'numCitations': citations, 'keywords': labels.get(i, [])}
+            for i, title, year, citations in batch], ordered=False)
+
+
+def load_neo4j(data):
+    def run(query, rows):
+        for batch in _batches(rows, 10000):
+            neo4j_utils.conn.query(query, {'rows': batch}, db=neo4j_utils.database, write=True)
+
+    # empty the database in batches
+    while neo4j_utils.conn.query("MATCH (n) WITH n LIMIT 10000 DETACH DELETE n RETURN count(*) AS n",
+                                 db=neo4j_utils.database, write=True,
+                                 transformer=lambda result: result.single()['n']):
+        pass
+    for label in ('KEYWORD', 'INSTITUTE', 'FACULTY', 'PUBLICATION'):
+        neo4j_utils.conn.query(f"CREATE INDEX {label.lower()}_id IF NOT EXISTS FOR (n:{label}) ON (n.id)",
+                               db=neo4j_utils.database, write=True)
+
+    run("UNWIND $rows AS r CREATE (:KEYWORD {id: r[0], name: r[1]})", data['keyword'])
+    run("UNWIND $rows AS r CREATE (:INSTITUTE {id: r[0], name: r[1]})", data['university'])
+    run("UNWIND $rows AS r CREATE (:FACULTY {id: r[0], name: r[1]})", data['faculty'])
+    run("UNWIND $rows AS r CREATE (:PUBLICATION {id: r[0], title: r[1], year: r[2], numCitations: r[3]})",
+        data['publication'])
+    run("""UNWIND $rows AS r MATCH (f:FACULTY {id: r[0]}), (i:INSTITUTE {id: r[2]})
+           CREATE (f)-[:AFFILIATION_WITH]->(i)""", data['faculty'])
+    run("""UNWIND $rows AS r MATCH (f:FACULTY {id: r[0]}), (p:PUBLICATION {id: r[1]})
+           CREATE (f)-[:PUBLISH]->(p)""", data['faculty_publication'])
+    run("""UNWIND $rows AS r MATCH (p:PUBLICATION {id: r[0]}), (k:KEYWORD {id: r[1]})
+           CREATE (p)-[:LABEL_BY {score: r[2]}]->(k)""", data['publication_keyword'])
+    run("""UNWIND $rows AS r MATCH (f:FACULTY {id: r[0]}), (k:KEYWORD {id: r[1]})
+           CREATE (f)-[:INTERESTED_IN {score: r[2]}]->(k)""", data['faculty_keyword'])
+
+
+def load(data):
+    for name, loader in (('mysql', load_mysql), ('mongodb', load_mongo), ('neo4j', load_neo4j)):
+        start = time.perf_counter()
+        # bulk writes, not bound by the per-query deadlines
+        with resilience_utils.no_deadline():
+            loader(data)
+        logging.info(f"{name} loaded in {time.perf_counter() - start:.1f}s")
+
+
+def add_arguments(parser):
+    parser.add_argument("--scale", choices=sorted(scales), default='small')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mysql-db", default='academicworld_bench')
+    parser.add_argument("--mongo-db", default='academicworld_bench')
+    parser.add_argument("--neo4j-db", default='neo4j')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    configure(args.mysql_db, args.mongo_db, args.neo4j_db)
+    data = generate(**scales[args.scale], seed=args.seed)
+    logging.info(", ".join(f"{table}: {len(rows)}" for table, rows in data.items()))
+    load(data)
+
+
+if __name__ == "__main__":
+    main()
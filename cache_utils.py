@@ -0,0 +1,232 @@
+import collections
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import pickle
+import threading
+import time
+
+# cache configuration. backend is 'memory' (per-process LRU) or 'redis', which
+# shares entries between gunicorn workers through a local Redis-compatible server
+config = {
+    'backend': 'memory',
+    'maxsize': 1024,          # entries per process for the memory backend
+    'ttl': 600,               # default time to live in seconds
+    'redis_url': 'redis://localhost:6379/0',
+    'key_prefix': 'rfe:',
+}
+
+
+# in-process LRU with a size bound and per-entry expiry
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Redis-compatible backend, values are pickled and expire server-side
+class RedisCache:
+    def __init__(self, url, key_prefix):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        value = self.client.get(self.key_prefix + key)
+        if value is None:
+            return False, None
+        return True, pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.key_prefix + key, pickle.dumps(value), ex=max(1, int(ttl)))
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=self.key_prefix + prefix + '*', count=1000))
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix('')
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if config['backend'] == 'redis':
+                    try:
+                        _backend = RedisCache(config['redis_url'], config['key_prefix'])
+                    except ImportError:
+                        logging.warning("redis is not installed, falling back to the in-process cache")
+                if _backend is None:
+                    _backend = LRUCache(config['maxsize'])
+    return _backend
+
+
+# hit/miss counters per namespace
+_stats = collections.defaultdict(lambda: {'hits': 0, 'misses': 0, 'errors': 0})
+_stats_lock = threading.Lock()
+
+
+def _count(namespace, field):
+    with _stats_lock:
+        _stats[namespace][field] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        return {namespace: dict(counts) for namespace, counts in _stats.items()}
+
+
+# JSON-serialisable form of an argument; strings are kept as they are, since the
+# function is called with them unchanged
+def _normalize(value):
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(_normalize(v) for v in value)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in sorted(value.items())}
+    if hasattr(value, 'item'):
+        # numpy scalars
+        return value.item()
+    return value
+
+
+# cache key from the namespace, function and normalised arguments
+def make_key(namespace, func_name, args, kwargs):
+    payload = json.dumps([_normalize(list(args)), _normalize(kwargs)], sort_keys=True, default=str)
+    return f"{namespace}:{func_name}:{hashlib.sha1(payload.encode()).hexdigest()}"
+
+
+# set by skip_store() while a cached function runs: its result is a fallback (see
+# resilience_utils) and is returned without being cached
+_skip_store = contextvars.ContextVar('skip_store', default=False)
+
+
+def skip_store():
+    _skip_store.set(True)
+
+
+# run func with a fresh skip flag; returns (value, skip). A skipped inner result also
+# skips the caching functions around it.
+def _call(func, args, kwargs):
+    token = _skip_store.set(False)
+    try:
+        value = func(*args, **kwargs)
+        skip = _skip_store.get()
+    finally:
+        _skip_store.reset(token)
+    if skip:
+        skip_store()
+    return value, skip
+
+
+async def _call_async(func, args, kwargs):
+    token = _skip_store.set(False)
+    try:
+        value = await func(*args, **kwargs)
+        skip = _skip_store.get()
+    finally:
+        _skip_store.reset(token)
+    if skip:
+        skip_store()
+    return value, skip
+
+
+# cache the results of a query function; entries of a namespace can be dropped
+# together with invalidate(namespace). Coroutine functions (the async_*_utils
+# modules) are cached too, under the same keys as their synchronous namesakes.
+def cached(namespace, ttl=None):
+    def decorator(func):
+        def lookup(key):
+            try:
+                return get_backend().get(key)
+            except Exception as e:
+                logging.warning(f"Cache read failed: {e}")
+                _count(namespace, 'errors')
+                return False, None
+
+        def store(key, value):
+            if value is None:
+                return
+            try:
+                get_backend().set(key, value, ttl if ttl is not None else config['ttl'])
+            except Exception as e:
+                logging.warning(f"Cache write failed: {e}")
+                _count(namespace, 'errors')
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = make_key(namespace, func.__qualname__, args, kwargs)
+                hit, value = lookup(key)
+                if hit:
+                    _count(namespace, 'hits')
+                    return value
+                _count(namespace, 'misses')
+                value, skip = await _call_async(func, args, kwargs)
+                if not skip:
+                    store(key, value)
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = make_key(namespace, func.__qualname__, args, kwargs)
+                hit, value = lookup(key)
+                if hit:
+                    _count(namespace, 'hits')
+                    return value
+                _count(namespace, 'misses')
+                value, skip = _call(func, args, kwargs)
+                if not skip:
+                    store(key, value)
+                return value
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def invalidate(namespace):
+    get_backend().delete_prefix(namespace + ':')
+
+
+def clear():
+    get_backend().clear()
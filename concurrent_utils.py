@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import atexit
+import inspect
+import logging
+import threading
+import time
+
+import async_utils
+
+# shared, bounded pool for running the independent queries of a callback concurrently
+config = {
+    'max_workers': 16,
+    'timeout': 10,   # default per-query timeout in seconds
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=config['max_workers'],
+                                               thread_name_prefix='query')
+    return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown)
+
+
+# coroutine functions (the async data layer) run on the shared event loop, the
+# others on the thread pool
+def submit(func, args):
+    if inspect.iscoroutinefunction(func):
+        return async_utils.submit(func(*args))
+    return get_executor().submit(func, *args)
+
+
+# run calls = {name: (func, args)} concurrently and return {name: result}. Each call
+# has its own timeout (timeouts[name], else config['timeout']); a call that fails or
+# times out gets defaults[name] instead, so the other results are still returned.
+# Timed out calls are cancelled if they are coroutines, otherwise they keep running
+# in the pool until they finish.
+def fan_out(calls, timeouts=None, defaults=None):
+    timeouts = timeouts or {}
+    defaults = defaults or {}
+    start = time.monotonic()
+    futures = {name: submit(func, args) for name, (func, args) in calls.items()}
+
+    results = {}
+    for name, future in futures.items():
+        deadline = start + timeouts.get(name, config['timeout'])
+        try:
+            results[name] = future.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            logging.warning(f"{name} timed out after {timeouts.get(name, config['timeout'])}s")
+            future.cancel()
+            results[name] = defaults.get(name)
+        except Exception:
+            logging.exception(f"{name} failed")
+            results[name] = defaults.get(name)
+    return results
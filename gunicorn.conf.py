@@ -0,0 +1,8 @@
+# gunicorn settings of the app, read from the working directory: gunicorn app:server
+
+
+# once a worker has loaded the app, start its background loads (see app.on_startup).
+# The load test's app module may stub the data layer, which disables them.
+def post_worker_init(worker):
+    import app
+    app.on_startup()
@@ -0,0 +1,125 @@
+# maintenance commands for the Research Field Explorer
+#
+#   python manage.py rebuild-krc
+#   python manage.py check-krc --samples 50
+#   python manage.py refresh-options
+#   python manage.py migrate --explain
+#   python manage.py export-snapshot
+import argparse
+import logging
+import os
+import sys
+import time
+
+import json
+
+import migrations
+import mysql_utils
+import option_utils
+import resilience_utils
+import snapshot_utils
+
+
+def rebuild_krc(args):
+    start = time.perf_counter()
+    matrix = mysql_utils.rebuild_krc_matrix()
+    print(f"KRC matrix: {matrix.krc.shape[0]} faculty x {matrix.krc.shape[1]} keywords, "
+          f"{matrix.krc.nnz} entries, written to {mysql_utils.krc_matrix_path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def check_krc(args):
+    mismatches = mysql_utils.check_krc_consistency(samples=args.samples, sample_size=args.sample_size)
+    if mismatches:
+        print(f"{len(mismatches)} keyword sets disagree with the SQL recommendations:")
+        for keywords in mismatches:
+            print("  ", keywords)
+        return 1
+    print("KRC matrix matches the SQL recommendations")
+    return 0
+
+
+def refresh_options(args):
+    start = time.perf_counter()
+    snapshot = {'format': option_utils.cache_format, 'version': option_utils.source_version(),
+                'checked_at': time.time(), **option_utils.fetch_options()}
+    option_utils.write_snapshot(snapshot)
+    print(f"{len(snapshot['keywords'])} keywords, {len(snapshot['universities'])} universities, "
+          f"{len(snapshot['professors'])} professors written to {option_utils.cache_path} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def export_snapshot(args):
+    start = time.perf_counter()
+    directory = snapshot_utils.export(args.path)
+    snapshot = snapshot_utils.Snapshot(directory)
+    size = sum(entry.stat().st_size for entry in os.scandir(directory))
+    print(f"Snapshot {snapshot.version}: {len(snapshot.keywords)} keywords, {len(snapshot.faculty)} faculty, "
+          f"{len(snapshot.institutes)} institutes, {size / 2**20:.1f} MiB written to {directory} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+def print_explain(title, report):
+    print(f"== {title}")
+    for widget, plan in report.items():
+        print(f"-- {widget}")
+        if isinstance(plan, list):
+            for row in plan:
+                print("   ", {key: row.get(key) for key in ('table', 'type', 'key', 'rows', 'Extra')})
+        else:
+            print("   ", json.dumps(plan, default=str))
+
+
+def migrate(args):
+    if args.explain:
+        arguments = migrations.sample_arguments()
+        print_explain("before", migrations.explain_widgets(arguments))
+    report = migrations.migrate(dry_run=args.dry_run)
+    for source, name, status in report:
+        print(f"{source:<8} {name:<60} {status}")
+    if args.explain and not args.dry_run:
+        print_explain("after", migrations.explain_widgets(arguments))
+    return 1 if any(status == 'failed' for _, _, status in report) else 0
+
+
+def explain(args):
+    print_explain("widget query plans", migrations.explain_widgets())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Research Field Explorer maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("rebuild-krc", help="rebuild the faculty x keyword KRC matrix")
+    command.set_defaults(func=rebuild_krc)
+
+    command = commands.add_parser("check-krc", help="compare the KRC matrix against the SQL recommendations")
+    command.add_argument("--samples", type=int, default=20)
+    command.add_argument("--sample-size", type=int, default=3)
+    command.set_defaults(func=check_krc)
+
+    command = commands.add_parser("refresh-options", help="reload the dropdown option lists snapshot")
+    command.set_defaults(func=refresh_options)
+
+    command = commands.add_parser("export-snapshot", help="export the widget data to an offline snapshot")
+    command.add_argument("--path", default=snapshot_utils.snapshot_path, help="snapshot directory")
+    command.set_defaults(func=export_snapshot)
+
+    command = commands.add_parser("migrate", help="create the missing indexes, constraints and triggers")
+    command.add_argument("--dry-run", action="store_true", help="only report what is missing")
+    command.add_argument("--explain", action="store_true", help="show widget query plans before and after")
+    command.set_defaults(func=migrate)
+
+    command = commands.add_parser("explain", help="show the EXPLAIN/PROFILE plan of each widget query")
+    command.set_defaults(func=explain)
+
+    logging.basicConfig(level=logging.INFO)
+    args = parser.parse_args()
+    # maintenance commands run bulk queries, the per-query deadlines are for serving
+    with resilience_utils.no_deadline():
+        status = args.func(args)
+    sys.exit(status or 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+
+import cache_utils
+
+# per-query instrumentation shared by mysql_utils, neo4j_utils and mongodb_utils.
+# Every named query records its latency, rows returned, approximate bytes returned
+# and the time spent waiting for a connection; queries slower than slow_query_ms
+# go to the slow query log. The counters are per process (one set per gunicorn worker).
+config = {
+    'enabled': True,
+    'slow_query_ms': 500,
+    'slow_query_log': None,     # file for the slow query log, None logs to the 'slow_query' logger only
+    'statement_chars': 300,     # characters of the statement kept in the slow query log
+    'buckets': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+}
+
+slow_query_logger = logging.getLogger('slow_query')
+_slow_query_handler = None
+
+
+# latency histogram and totals of one named query
+class QueryStats:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.slow = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.acquire_seconds = 0.0
+
+    def add(self, timer):
+        self.count += 1
+        self.seconds += timer.seconds
+        self.rows += timer.rows
+        self.bytes += timer.bytes
+        self.acquire_seconds += timer.acquire
+        self.errors += timer.error
+        self.slow += timer.slow
+        for i, bound in enumerate(self.buckets):
+            if timer.seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def copy(self):
+        stats = QueryStats(self.buckets)
+        stats.__dict__.update(self.__dict__, bucket_counts=list(self.bucket_counts))
+        return stats
+
+
+_queries = {}
+_queries_lock = threading.Lock()
+# the query running in this thread or asyncio task
+_current = contextvars.ContextVar('query_timer', default=None)
+
+# name -> function returning {metric: value}, e.g. connection pool gauges
+_gauges = {}
+
+
+# measurements of one query, filled in by the data layer while the query runs
+class QueryTimer:
+    def __init__(self, source, name, statement=None):
+        self.source = source
+        self.name = name
+        self.statement = statement
+        self.rows = 0
+        self.bytes = 0
+        self.acquire = 0.0
+        self.error = False
+        self.slow = False
+        self.seconds = 0.0
+        self.start = time.perf_counter()
+
+    def set_result(self, value):
+        self.rows, self.bytes = measure(value)
+
+
+def _size(value):
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode('utf-8', 'replace'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    if hasattr(value, 'values') and hasattr(value, 'keys'):
+        # neo4j records
+        return sum(_size(v) for v in value.values())
+    return 8
+
+
+# (rows, approximate bytes) of a query result; large lists are estimated from a sample
+def measure(value, sample=100):
+    if value is None:
+        return 0, 0
+    if hasattr(value, 'memory_usage') and hasattr(value, 'columns'):
+        # pandas DataFrame
+        return len(value), int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        n = len(value)
+        if n <= sample:
+            return n, _size(value)
+        return n, int(_size(value[:sample]) * n / sample)
+    return 1, _size(value)
+
+
+def _log_slow_query(timer):
+    global _slow_query_handler
+    if config['slow_query_log'] and _slow_query_handler is None:
+        _slow_query_handler = logging.FileHandler(config['slow_query_log'])
+        _slow_query_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_logger.addHandler(_slow_query_handler)
+    statement = ' '.join((timer.statement or '').split())[:config['statement_chars']]
+    slow_query_logger.warning(
+        f"{timer.source} {timer.name} {timer.seconds * 1000:.1f}ms rows={timer.rows} bytes={timer.bytes} "
+        f"acquire={timer.acquire * 1000:.1f}ms error={timer.error}: {statement}")
+
+
+def record(timer):
+    timer.seconds = time.perf_counter() - timer.start
+    timer.slow = timer.seconds * 1000 >= config['slow_query_ms']
+    if not config['enabled']:
+        return
+    key = (timer.source, timer.name)
+    with _queries_lock:
+        stats = _queries.get(key)
+        if stats is None:
+            stats = _queries[key] = QueryStats(config['buckets'])
+        stats.add(timer)
+    if timer.slow:
+        _log_slow_query(timer)
+
+
+# time a query: the data layer sets rows/bytes (set_result) and acquire on the
+# yielded timer. Exceptions are counted as errors and re-raised.
+@contextlib.contextmanager
+def timed(source, name, statement=None):
+    timer = QueryTimer(source, name or 'other', statement)
+    token = _current.set(timer)
+    try:
+        yield timer
+    except Exception:
+        timer.error = True
+        raise
+    finally:
+        _current.reset(token)
+        record(timer)
+
+
+# add connection wait time to the query running on this thread, for drivers that
+# report checkouts through callbacks instead of a return value
+def add_acquire(seconds):
+    timer = _current.get()
+    if timer is not None:
+        timer.acquire += seconds
+
+
+def add_gauges(name, fn):
+    _gauges[name] = fn
+
+
+def get_stats():
+    with _queries_lock:
+        return {f"{source}.{name}": {
+                    'count': stats.count, 'errors': stats.errors, 'slow': stats.slow,
+                    'seconds': round(stats.seconds, 6), 'rows': stats.rows, 'bytes': stats.bytes,
+                    'acquire_seconds': round(stats.acquire_seconds, 6)}
+                for (source, name), stats in _queries.items()}
+
+
+def reset():
+    with _queries_lock:
+        _queries.clear()
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+
+# all counters in the Prometheus text exposition format, served at /metrics
+def render_prometheus():
+    lines = []
+    with _queries_lock:
+        queries = sorted((key, stats.copy()) for key, stats in _queries.items())
+
+    lines.append('# HELP rfe_query_duration_seconds Query latency.')
+    lines.append('# TYPE rfe_query_duration_seconds histogram')
+    for (source, name), stats in queries:
+        cumulative = 0
+        for bound, count in zip(stats.buckets, stats.bucket_counts):
+            cumulative += count
+            lines.append(f'rfe_query_duration_seconds_bucket{_labels(source=source, query=name, le=bound)} '
+                         f'{cumulative}')
+        lines.append(f'rfe_query_duration_seconds_bucket{_labels(source=source, query=name, le="+Inf")} '
+                     f'{stats.count}')
+        lines.append(f'rfe_query_duration_seconds_sum{_labels(source=source, query=name)} {stats.seconds}')
+        lines.append(f'rfe_query_duration_seconds_count{_labels(source=source, query=name)} {stats.count}')
+
+    counters = [
+        ('rfe_query_errors_total', 'Failed queries.', 'errors'),
+        ('rfe_query_slow_total', 'Queries slower than the slow query threshold.', 'slow'),
+        ('rfe_query_rows_total', 'Rows returned.', 'rows'),
+        ('rfe_query_bytes_total', 'Approximate bytes returned.', 'bytes'),
+        ('rfe_query_acquire_seconds_total', 'Time spent waiting for a connection.', 'acquire_seconds'),
+    ]
+    for metric, help_text, field in counters:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for (source, name), stats in queries:
+            lines.append(f'{metric}{_labels(source=source, query=name)} {getattr(stats, field)}')
+
+    lines.append('# HELP rfe_cache_requests_total Result cache lookups.')
+    lines.append('# TYPE rfe_cache_requests_total counter')
+    for namespace, counts in sorted(cache_utils.get_stats().items()):
+        for result, count in sorted(counts.items()):
+            lines.append(f'rfe_cache_requests_total{_labels(namespace=namespace, result=result)} {count}')
+
+    for name, fn in sorted(_gauges.items()):
+        try:
+            values = fn()
+        except Exception as e:
+            logging.warning(f"Collecting {name} metrics failed: {e}")
+            continue
+        for key, value in sorted(values.items()):
+            lines.append(f'# TYPE rfe_{name}_{key} gauge')
+            lines.append(f'rfe_{name}_{key} {value}')
+    return '\n'.join(lines) + '\n'
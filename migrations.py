@@ -0,0 +1,227 @@
+import json
+import logging
+
+import mongodb_utils
+import mysql_utils
+import neo4j_utils
+
+# idempotent schema migrations for the academicworld databases: every migration
+# checks the current schema first, so running them again is a no-op
+
+# MySQL indexes used by the recommendation joins: (table, index name, columns)
+mysql_indexes = [
+    ('keyword', 'idx_keyword_name', ['name']),
+    ('publication_keyword', 'idx_publication_keyword_keyword', ['keyword_id', 'publication_id', 'score']),
+    ('faculty_publication', 'idx_faculty_publication_publication', ['publication_id', 'faculty_id']),
+    ('faculty', 'idx_faculty_university', ['university_id']),
+]
+
+# MongoDB indexes: (collection, index name, keys)
+mongo_indexes = [
+    ('publications', 'keywords_name_year', [('keywords.name', 1), ('year', 1)]),
+]
+
+# Neo4j indexes: (index name, label, property)
+neo4j_indexes = [
+    ('keyword_name', 'KEYWORD', 'name'),
+    ('faculty_name', 'FACULTY', 'name'),
+    ('institute_name', 'INSTITUTE', 'name'),
+]
+
+
+class Migration:
+    def __init__(self, source, name, check, apply):
+        self.source = source
+        self.name = name
+        self.check = check
+        self.apply = apply
+
+
+def _mysql_index_exists(table, index):
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        return mysql_utils.index_exists(db, table, index)
+
+
+def _mysql_constraint_exists(table, constraint):
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        return mysql_utils.constraint_exists(db, table, constraint)
+
+
+def _mysql_trigger_exists(trigger):
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        return mysql_utils.trigger_exists(db, trigger)
+
+
+def _mongo_index_exists(collection, name, keys):
+    for index in mongodb_utils.get_collection(collection).index_information().values():
+        if [(key, int(direction)) for key, direction in index['key']] == keys:
+            return True
+    return False
+
+
+def _fav_keywords_table_current():
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        return (mysql_utils.fav_keywords_exists(db)
+                and bool(db.fetch_data("SHOW COLUMNS FROM fav_keywords LIKE 'session_id'")))
+
+
+def _mongo_create_index(collection, name, keys):
+    mongodb_utils.get_collection(collection).create_index(keys, name=name)
+
+
+def _neo4j_index_exists(label, prop):
+    query = '''
+        SHOW INDEXES YIELD labelsOrTypes, properties
+        WHERE labelsOrTypes = [$label] AND properties = [$prop]
+        RETURN count(*) AS n
+    '''
+    n = neo4j_utils.conn.query(query, {'label': label, 'prop': prop}, db=neo4j_utils.database,
+                               transformer=lambda result: result.single()['n'])
+    return bool(n)
+
+
+def _neo4j_create_index(name, label, prop):
+    # labels and property names can't be parameters in schema commands
+    query = f'CREATE INDEX {name} IF NOT EXISTS FOR (n:`{label}`) ON (n.`{prop}`)'
+    neo4j_utils.conn.query(query, db=neo4j_utils.database, write=True)
+
+
+def get_migrations():
+    migrations = []
+    for table, index, columns in mysql_indexes:
+        migrations.append(Migration(
+            'mysql', f'index {table}.{index}',
+            check=lambda table=table, index=index: _mysql_index_exists(table, index),
+            apply=lambda table=table, index=index, columns=columns: mysql_utils.add_index(table, index, columns)))
+    migrations.append(Migration(
+        'mysql', 'foreign key faculty_keyword.fk_keyword_id',
+        check=lambda: _mysql_constraint_exists('faculty_keyword', 'fk_keyword_id'),
+        apply=mysql_utils.add_foreign_key_constraint))
+    migrations.append(Migration(
+        'mysql', 'trigger faculty_keyword_score_check',
+        check=lambda: _mysql_trigger_exists('faculty_keyword_score_check'),
+        apply=mysql_utils.add_trigger))
+    migrations.append(Migration(
+        'mysql', 'table fav_keywords',
+        check=_fav_keywords_table_current,
+        apply=mysql_utils.ensure_fav_keywords_table))
+
+    for collection, name, keys in mongo_indexes:
+        migrations.append(Migration(
+            'mongodb', f'index {collection}.{name}',
+            check=lambda collection=collection, name=name, keys=keys: _mongo_index_exists(collection, name, keys),
+            apply=lambda collection=collection, name=name, keys=keys: _mongo_create_index(collection, name, keys)))
+
+    for name, label, prop in neo4j_indexes:
+        migrations.append(Migration(
+            'neo4j', f'index {label}.{prop}',
+            check=lambda label=label, prop=prop: _neo4j_index_exists(label, prop),
+            apply=lambda name=name, label=label, prop=prop: _neo4j_create_index(name, label, prop)))
+    return migrations
+
+
+# apply the missing migrations (or only report them with dry_run).
+# Returns a list of (source, name, status), status is present, applied, missing or failed.
+def migrate(dry_run=False):
+    report = []
+    for migration in get_migrations():
+        try:
+            if migration.check():
+                status = 'present'
+            elif dry_run:
+                status = 'missing'
+            else:
+                migration.apply()
+                status = 'applied' if migration.check() else 'failed'
+        except Exception:
+            logging.exception(f"Migration {migration.name} failed")
+            status = 'failed'
+        report.append((migration.source, migration.name, status))
+    return report
+
+
+# sample arguments for the widget queries
+def sample_arguments():
+    with mysql_utils.MySQLDatabase(mysql_utils.config) as db:
+        keyword = db.fetch_data("select name from keyword limit 1")[0][0]
+    univ = neo4j_utils.conn.query("MATCH (i:INSTITUTE) RETURN i.name AS name LIMIT 1",
+                                  db=neo4j_utils.database, transformer=lambda result: result.single()['name'])
+    prof = neo4j_utils.conn.query("MATCH (f:FACULTY) RETURN f.name AS name LIMIT 1",
+                                  db=neo4j_utils.database, transformer=lambda result: result.single()['name'])
+    return {'keyword': keyword, 'univ': univ, 'prof': prof}
+
+
+# EXPLAIN SELECT always adds Note 1003 (the rewritten query), which mysql.connector
+# raises as an error with raise_on_warnings, so the plans are read without it
+def _mysql_explain(query, values=()):
+    explain_config = {**mysql_utils.config, 'raise_on_warnings': False}
+    with mysql_utils.MySQLDatabase(explain_config) as db:
+        rows = db.fetch_data("EXPLAIN " + query, values)
+        columns = db.cursor.column_names
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def _find(document, key):
+    if isinstance(document, dict):
+        if key in document:
+            yield document[key]
+        for value in document.values():
+            yield from _find(value, key)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _find(value, key)
+
+
+def _mongo_explain(collection, pipeline):
+    explain = mongodb_utils.get_client()[mongodb_utils.database].command({
+        'explain': {'aggregate': collection, 'pipeline': pipeline, 'cursor': {}},
+        'verbosity': 'executionStats'})
+    plan = json.dumps(next(_find(explain, 'winningPlan'), {}), default=str)
+    return {
+        'stages': sorted(set(_find(json.loads(plan), 'stage'))),
+        'indexes': sorted(set(_find(json.loads(plan), 'indexName'))),
+        'keys_examined': sum(_find(explain, 'totalKeysExamined')),
+        'docs_examined': sum(_find(explain, 'totalDocsExamined')),
+        'time_ms': sum(_find(explain, 'executionTimeMillis')),
+    }
+
+
+def _db_hits(plan):
+    return plan.get('dbHits', 0) + sum(_db_hits(child) for child in plan.get('children', []))
+
+
+def _operators(plan):
+    return [plan.get('operatorType')] + [op for child in plan.get('children', []) for op in _operators(child)]
+
+
+def _neo4j_profile(query, parameters):
+    summary = neo4j_utils.conn.query('PROFILE ' + query, parameters, db=neo4j_utils.database,
+                                     transformer=lambda result: result.consume())
+    return {
+        'db_hits': _db_hits(summary.profile),
+        'operators': _operators(summary.profile),
+        'time_ms': summary.result_available_after + summary.result_consumed_after,
+    }
+
+
+# EXPLAIN/PROFILE of the query behind each widget
+def explain_widgets(arguments=None):
+    arguments = arguments or sample_arguments()
+    query, values = mysql_utils.recommendations_query([arguments['keyword']])
+    return {
+        'widget 1 (mongodb keyword trend)': _mongo_explain(
+            'publications', mongodb_utils.keyword_trend_pipeline(arguments['keyword'])),
+        'widget 2 (neo4j top professors)': _neo4j_profile(
+            neo4j_utils.top_professor_query,
+            {'keyword': arguments['keyword'], 'start_year': 1980, 'end_year': 2020}),
+        'widget 2 (neo4j KRC prefix sums build)': _neo4j_profile(
+            neo4j_utils.keyword_krc_by_year_query, {'keyword': arguments['keyword']}),
+        'widget 3 (neo4j keywords of university)': _neo4j_profile(
+            neo4j_utils.top_keywords_of_univ_query, {'univ': arguments['univ']}),
+        'widget 3 (neo4j institute keywords refresh)': _neo4j_profile(
+            neo4j_utils.institute_keywords_for_query, {'institutes': [arguments['univ']], 'k': 10}),
+        'widget 4 (neo4j keywords of professor)': _neo4j_profile(
+            neo4j_utils.top_keywords_of_prof_query, {'prof': arguments['prof']}),
+        'widgets 5 & 6 (mysql recommendations)': _mysql_explain(query, values),
+        'widgets 5 & 6 (mysql KRC matrix build)': _mysql_explain(mysql_utils.krc_entries_query),
+    }
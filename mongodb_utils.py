@@ -1,41 +1,402 @@
-from pymongo import MongoClient
+import pymongo
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
 import pandas as pd
+import numpy as np
+import atexit
+import contextlib
+import itertools
+import logging
+import os
+import threading
+import time
+import metrics_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
+
+# pymongoarrow is optional: aggregations are decoded straight into Arrow columns when
+# it is installed, otherwise the documents are appended column by column
+try:
+    from pymongoarrow.api import Schema, aggregate_arrow_all
+except ImportError:
+    Schema = aggregate_arrow_all = None
+
+# configuration for connecting to mongodb database
+config = {
+    'host': 'mongodb://localhost:27017/',
+    'maxPoolSize': 50,
+    'minPoolSize': 0,
+    'maxIdleTimeMS': 60000,
+    'connectTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 5000,
+    'socketTimeoutMS': 30000,
+}
+database = 'academicworld'
+
+# charges the wait for a pooled connection to the query running on the same thread
+# (pymongo publishes the checkout events synchronously on the calling thread)
+class _CheckoutListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.start = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        start = getattr(self._local, 'start', None)
+        if start is not None:
+            metrics_utils.add_acquire(time.perf_counter() - start)
+            self._local.start = None
+
+    def connection_check_out_failed(self, event):
+        self.connection_checked_out(event)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+# process-wide client registry, keyed by pid. MongoClient is not fork-safe, so a
+# gunicorn worker that inherits the parent's client gets a fresh one on first use.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(pid)
+            if client is None:
+                # clients inherited from the parent are unusable after fork, just drop them
+                _clients.clear()
+                client = MongoClient(connect=False, event_listeners=[_CheckoutListener()], **config)
+                _clients[pid] = client
+    return client
+
+
+def get_collection(name):
+    return get_client()[database][name]
+
+
+# close the client of the current process, a new one is created on the next call
+def close_client():
+    with _clients_lock:
+        client = _clients.pop(os.getpid(), None)
+    if client is not None:
+        client.close()
+
+
+atexit.register(close_client)
+
+use_arrow = True
+
+
+# one MongoDB operation under the mongodb deadline (pymongo's client side operation
+# timeout, also sent to the server as maxTimeMS) and circuit breaker, see resilience_utils
+@contextlib.contextmanager
+def guarded():
+    with resilience_utils.protect('mongodb', failures=(PyMongoError, )), \
+            pymongo.timeout(resilience_utils.deadline('mongodb')):
+        yield
+
+
+# run an aggregation that returns flat documents and return {field: numpy array};
+# fields maps each field to its type (int, float or str)
+def aggregate_columns(collection, pipeline, fields, **kwargs):
+    if use_arrow and aggregate_arrow_all is not None:
+        table = aggregate_arrow_all(collection, pipeline, schema=Schema(fields), **kwargs)
+        return {name: table.column(name).to_numpy() for name in fields}
+    columns = {name: [] for name in fields}
+    for doc in collection.aggregate(pipeline, **kwargs):
+        for name, values in columns.items():
+            values.append(doc.get(name))
+    return {name: np.array(values, dtype=object if fields[name] is str else fields[name])
+            for name, values in columns.items()}
+
+
+def _set_columns(timer, columns):
+    timer.rows = len(next(iter(columns.values()), ()))
+    timer.bytes = sum(column.nbytes for column in columns.values())
+
+
+# year range shown by the trend widget
+start_year = 1980
+end_year = 2020
+
+# serve the trend widget from the in-process keyword x year table instead of
+# aggregating publications on every call
+use_trend_table = True
+trend_table_refresh_interval = 300  # seconds between incremental refreshes
+trend_table_rebuild_interval = 24 * 3600  # seconds between full rebuilds
+
+
+# dense keyword x year publication counts, built from all publications and then
+# refreshed incrementally from the publications inserted since the last refresh. An
+# incremental refresh can't see updated publications, so the table is rebuilt every
+# rebuild interval, and at once when the number of publications at or below the
+# watermark changed (deleted, or inserted with an older _id). The keyword index and
+# the counts are published together (rows), so a lookup during a refresh never finds
+# a keyword whose row isn't in the counts yet.
+class KeywordTrendTable:
+    def __init__(self, start_year, end_year):
+        self.years = np.arange(start_year, end_year + 1)
+        self.rows = self._empty()
+        self.watermark = None
+        self.count = 0
+        self.refreshed_at = None
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def _empty(self):
+        return {}, np.zeros((0, len(self.years)), dtype=np.int64)
+
+    # add the counts of publications with _id in (watermark, newest], or recount all
+    # publications when a rebuild is due
+    def refresh(self, rebuild=False):
+        with self._lock:
+            publication = get_collection("publications")
+            now = time.monotonic()
+            rebuild = rebuild or self.built_at is None or now - self.built_at > trend_table_rebuild_interval
+            # the counts scan the _id index; refreshes run off the request path, without a deadline
+            with resilience_utils.no_deadline(), guarded(), \
+                    metrics_utils.timed('mongodb', 'trend_table_watermark') as timer:
+                newest = publication.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                newest_id = None if newest is None else newest["_id"]
+                count = 0 if newest is None else publication.count_documents({"_id": {"$lte": newest_id}})
+                if not rebuild:
+                    if self.watermark == newest_id:
+                        counted = count
+                    elif self.watermark is None:
+                        counted = 0
+                    else:
+                        counted = publication.count_documents({"_id": {"$lte": self.watermark}})
+                    rebuild = counted != self.count
+                timer.set_result(newest)
+            if rebuild:
+                index, counts = self._empty()
+                watermark = None
+            else:
+                index, counts = self.rows
+                watermark = self.watermark
+            if newest_id is not None and newest_id != watermark:
+                index, counts = self._add(publication, index, counts, watermark, newest_id)
+            self.rows = (index, counts)
+            self.watermark = newest_id
+            self.count = count
+            self.refreshed_at = now
+            if rebuild:
+                self.built_at = now
+
+    # copies of index and counts with the publications with _id in (after, last] added
+    def _add(self, publication, index, counts, after, last):
+        id_range = {"$lte": last}
+        if after is not None:
+            id_range["$gt"] = after
+        query = [
+            {"$match": {"_id": id_range, "year": {"$gte": int(self.years[0]), "$lte": int(self.years[-1])}}},
+            # a publication counts once per keyword, even if the keyword is listed twice
+            {"$project": {"year": 1, "keyword": {"$setUnion": ["$keywords.name", []]}}},
+            {"$unwind": "$keyword"},
+            {"$group": {"_id": {"keyword": "$keyword", "year": "$year"}, "n_publication": {"$sum": 1}}},
+            {"$project": {"_id": 0, "keyword": "$_id.keyword", "year": "$_id.year", "n_publication": 1}},
+        ]
+        # a build aggregates every publication, it runs without a deadline
+        with resilience_utils.no_deadline(), guarded(), \
+                metrics_utils.timed('mongodb', 'trend_table_refresh', str(query)) as timer:
+            columns = aggregate_columns(publication, query, {"keyword": str, "year": int, "n_publication": int},
+                                        allowDiskUse=True)
+            _set_columns(timer, columns)
+        old_counts = counts
+        index = dict(index)
+        rows = []
+        for keyword in columns["keyword"]:
+            row = index.get(keyword)
+            if row is None:
+                row = index[keyword] = len(index)
+            rows.append(row)
+        cols = columns["year"].astype(np.int64) - self.years[0]
+        values = columns["n_publication"]
+
+        counts = np.zeros((len(index), len(self.years)), dtype=np.int64)
+        counts[:old_counts.shape[0]] = old_counts
+        np.add.at(counts, (np.asarray(rows, dtype=np.int64), cols), values.astype(np.int64))
+        return index, counts
+
+    def lookup(self, keyword):
+        index, counts = self.rows
+        row = index.get(keyword)
+        if row is None:
+            return empty_keyword_trend()
+        counts = counts[row]
+        mask = counts > 0
+        return pd.DataFrame({"year": self.years[mask], "publication count": counts[mask]})
+
+
+def empty_keyword_trend():
+    return pd.DataFrame({"year": pd.Series(dtype="int64"), "publication count": pd.Series(dtype="int64")})
+
+
+_trend_table = None
+_trend_table_lock = threading.Lock()
+_trend_table_refresh_lock = threading.Lock()
+
+
+# the shared table, refreshed when due. With wait=False a due refresh (or the first
+# build) runs in a background thread and the current table is returned at once;
+# callers check built_at before using it.
+def get_trend_table(wait=True):
+    global _trend_table
+    with _trend_table_lock:
+        if _trend_table is None:
+            _trend_table = KeywordTrendTable(start_year, end_year)
+        table = _trend_table
+    if _refresh_due(table) and _trend_table_refresh_lock.acquire(blocking=wait):
+        if wait:
+            _refresh_trend_table(table, wait)
+        else:
+            threading.Thread(target=_refresh_trend_table, args=(table, wait), name='trend-table-refresh',
+                             daemon=True).start()
+    return table
+
+
+# runs with _trend_table_refresh_lock held, and releases it
+def _refresh_trend_table(table, wait):
+    try:
+        if _refresh_due(table):
+            table.refresh()
+    except Exception as e:
+        # a built table keeps answering while MongoDB is down
+        if wait and table.built_at is None:
+            raise
+        logging.warning(f"Keyword trend table refresh failed: {e}")
+    finally:
+        _trend_table_refresh_lock.release()
+
+
+def _refresh_due(table):
+    return table.refreshed_at is None or time.monotonic() - table.refreshed_at > trend_table_refresh_interval
+
+
+# start building the table in the background (called at startup)
+def preload_trend_table():
+    get_trend_table(wait=False)
+
+
+# drop the table, the next call rebuilds it from scratch
+def reset_trend_table():
+    global _trend_table
+    with _trend_table_lock:
+        _trend_table = None
+
 
 # widget 1 - trend of keywords: for a given keyword, return the number of publications related to the keyword over time.
+# Until the trend table is built the trend is aggregated by MongoDB. While MongoDB fails, the last result (or an empty
+# trend) is served.
+@cached('mongodb')
+@resilience_utils.serve_stale(default=empty_keyword_trend)
 def get_keyword_trend(keyword):
-    # Making Connection
-    myclient = MongoClient("mongodb://localhost:27017/")
-    # database
-    db = myclient["academicworld"]   
-    # collection
-    publication = db["publications"]
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().keyword_trend(keyword)
+    if use_trend_table:
+        table = get_trend_table(wait=False)
+        if table.built_at is not None:
+            return table.lookup(keyword)
+    return query_keyword_trend(keyword)
 
-    query = [
-        {"$match": {"keywords.name": keyword}},
+
+def keyword_trend_pipeline(keyword):
+    return [
+        {"$match": {"keywords.name": keyword, "year": {"$gte": start_year, "$lte": end_year}}},
         {"$group": {"_id": "$year", "n_publication": {"$sum": 1}}},
-        {"$sort": {"_id": 1}}
+        {"$sort": {"_id": 1}},
+        {"$project": {"_id": 0, "year": "$_id", "n_publication": 1}},
     ]
-    result = publication.aggregate(query)
-    result_query = pd.DataFrame(list(result)).rename(
-        columns={"_id": "year", "n_publication": "publication count"})
-    
-    # Filter data for years between 1980 and 2020
-    filtered_data = result_query[(result_query['year'] >= 1980) & (result_query['year'] <= 2020)]
-    
-    return filtered_data
-
 
 
-# get a list of all keywords
-def get_keyword_list():
-    # Making Connection
-    myclient = MongoClient("mongodb://localhost:27017/")
-    # database
-    db = myclient["academicworld"]   
+# uncached path of widget 1, aggregated by mongodb for the selected years only
+def query_keyword_trend(keyword):
     # collection
-    publication = db["publications"]
-    keyword_list = publication.distinct("keywords.name")
+    publication = get_collection("publications")
+
+    query = keyword_trend_pipeline(keyword)
+    with guarded(), metrics_utils.timed('mongodb', 'keyword_trend', str(query)) as timer:
+        columns = aggregate_columns(publication, query, {"year": int, "n_publication": int})
+        _set_columns(timer, columns)
+    result_query = pd.DataFrame({"year": columns["year"], "publication count": columns["n_publication"]})
+
+    return result_query
 
-    return keyword_list
 
 
+# number of publications, from the collection metadata (used to version cached option lists)
+def count_publications():
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().count('publications')
+    with guarded(), metrics_utils.timed('mongodb', 'count_publications'):
+        return get_collection("publications").estimated_document_count()
+
+
+# keyword names are grouped by an aggregation and streamed in cursor batches of
+# keyword_batch_size, instead of `distinct`, whose single result document is capped at 16 MB
+keyword_batch_size = 10000
+
+keyword_names_pipeline = [
+    {"$project": {"_id": 0, "keywords.name": 1}},
+    {"$unwind": "$keywords"},
+    {"$match": {"keywords.name": {"$type": "string"}}},
+    {"$group": {"_id": "$keywords.name"}},
+]
+
+
+# all distinct keyword names, one cursor batch at a time
+def iter_keywords(batch_size=None):
+    if snapshot_utils.use_snapshot:
+        yield from snapshot_utils.get_snapshot().keyword_list('mongo_keywords')
+        return
+    batch_size = batch_size or keyword_batch_size
+    publication = get_collection("publications")
+    cursor = None
+    try:
+        # each batch is timed on its own, the consumer's work between batches is not
+        while True:
+            with guarded(), metrics_utils.timed('mongodb', 'keyword_list', str(keyword_names_pipeline)) as timer:
+                if cursor is None:
+                    cursor = publication.aggregate(keyword_names_pipeline, allowDiskUse=True, batchSize=batch_size)
+                batch = [doc["_id"] for doc in itertools.islice(cursor, batch_size)]
+                timer.set_result(batch)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+    finally:
+        if cursor is not None:
+            cursor.close()
+
+
+# get a list of all keywords
+@cached('mongodb')
+@resilience_utils.serve_stale()
+def get_keyword_list():
+    return list(iter_keywords())
@@ -1,5 +1,24 @@
 import mysql.connector
 import logging
+import atexit
+import collections
+import contextlib
+import os
+import queue
+import random
+import threading
+import time
+import numpy as np
+from scipy import sparse
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import cache_utils
+import metrics_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
 
 # configuration for connecting to mysql database
 config = {
@@ -10,95 +29,856 @@ config = {
     'raise_on_warnings': True
 }
 
+# configuration of the connection pool behind MySQLDatabase
+pool_config = {
+    'pool_size': 8,                # max open connections per process
+    'acquire_timeout': 10,         # seconds to wait for a free connection
+    'health_check_interval': 30,   # ping connections idle for longer than this (seconds)
+}
+
+# server-side prepared statements kept open per pooled connection; the least recently
+# used one is deallocated beyond this (the server caps them at max_prepared_stmt_count)
+prepared_cache_size = 16
+
+
+# a statement interrupted by max_execution_time (ER_QUERY_TIMEOUT, which mysql.connector
+# would raise as a plain DatabaseError)
+class QueryTimeout(mysql.connector.errors.DatabaseError):
+    pass
+
+
+mysql.connector.custom_error_exception({3024: QueryTimeout})
+
+# errors that count as failures of the mysql circuit breaker: the server or the
+# connection failing, or a deadline hit. Errors of one statement (duplicate keys,
+# syntax, ...) don't.
+source_failures = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError, QueryTimeout)
+
+
+# a pooled connection, with the server-side prepared statements opened on it
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.prepared = collections.OrderedDict()
+        self.last_used = time.monotonic()
+        # the session's max_execution_time in ms, None until set (see MySQLDatabase)
+        self.max_execution_time = None
+
+    def prepared_cursor(self, query):
+        cursor = self.prepared.get(query)
+        if cursor is not None:
+            self.prepared.move_to_end(query)
+            return cursor
+        cursor = self.connection.cursor(prepared=True)
+        self.prepared[query] = cursor
+        if len(self.prepared) > prepared_cache_size:
+            # closing a prepared cursor deallocates its statement on the server
+            _, evicted = self.prepared.popitem(last=False)
+            try:
+                evicted.close()
+            except mysql.connector.Error:
+                pass
+        return cursor
+
+    def close(self):
+        for cursor in self.prepared.values():
+            try:
+                cursor.close()
+            except mysql.connector.Error:
+                pass
+        self.prepared.clear()
+        try:
+            self.connection.close()
+        except mysql.connector.Error:
+            pass
+
+
+# bounded connection pool: at most pool_size connections, callers wait up to
+# acquire_timeout for one to be released
+class ConnectionPool:
+    def __init__(self, config, pool_size=8, acquire_timeout=10, health_check_interval=30):
+        self.config = config
+        self.pool_size = pool_size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._checkouts = 0
+        self._in_use = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        # autocommit so that a reused connection never reads from a stale snapshot
+        connection = mysql.connector.connect(autocommit=True, **self.config)
+        return PooledConnection(connection)
+
+    def _check_health(self, pooled):
+        if time.monotonic() - pooled.last_used < self.health_check_interval:
+            return pooled
+        try:
+            pooled.connection.ping(reconnect=False)
+            return pooled
+        except mysql.connector.Error:
+            logging.warning("Discarding broken MySQL connection")
+            pooled.close()
+            with self._lock:
+                self._reconnects += 1
+            return self._connect()
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            pooled = self._idle.get_nowait()
+        except queue.Empty:
+            pooled = None
+            with self._lock:
+                create = self._created < self.pool_size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    pooled = self._connect()
+                except mysql.connector.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    pooled = self._idle.get(timeout=self.acquire_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise mysql.connector.errors.PoolError(
+                        f"No MySQL connection available within {self.acquire_timeout}s")
+        try:
+            pooled = self._check_health(pooled)
+        except mysql.connector.Error:
+            with self._lock:
+                self._created -= 1
+            raise
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return pooled
+
+    def release(self, pooled, broken=False):
+        with self._lock:
+            self._in_use -= 1
+        if broken:
+            pooled.close()
+            with self._lock:
+                self._created -= 1
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.put(pooled)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+                'wait_time_total': round(self._wait_total, 6),
+                'wait_time_avg': round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0,
+                'wait_time_max': round(self._wait_max, 6),
+            }
+
+
+# one pool per config per process; pools inherited across fork are dropped
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+
+def get_pool(config):
+    global _pools_pid
+    key = tuple(sorted(config.items()))
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(config, **pool_config)
+            _pools[key] = pool
+    return pool
+
+
+# pool wait times and checkout counts, used to size pool_config['pool_size']
+def get_pool_stats():
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+    return [pool.stats() for pool in pools]
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+atexit.register(close_pools)
+
+
+def _pool_gauges():
+    totals = {'open': 0, 'in_use': 0, 'idle': 0, 'checkouts': 0, 'timeouts': 0, 'reconnects': 0}
+    for stats in get_pool_stats():
+        for key in totals:
+            totals[key] += stats[key]
+    return totals
+
+
+metrics_utils.add_gauges('mysql_pool', _pool_gauges)
+
+
 class MySQLDatabase:
     def __init__(self, config):
         self.config = config
+        self.pool = None
+        self.pooled = None
         self.connection = None
         self.cursor = None
+        self.acquire_time = 0.0
+        self.breaker = None
+        self.failed = False
 
+    # each context is one call through the mysql circuit breaker: it fails fast with
+    # SourceUnavailable while the breaker is open, and source_failures count as failures
     def __enter__(self):
-        self.connection = mysql.connector.connect(**self.config)
-        self.cursor = self.connection.cursor(buffered=True)
+        self.breaker = resilience_utils.get_breaker('mysql')
+        if not self.breaker.allow():
+            raise resilience_utils.SourceUnavailable('mysql')
+        self.failed = False
+        self.pool = get_pool(self.config)
+        start = time.perf_counter()
+        try:
+            self.pooled = self.pool.acquire()
+        except source_failures:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # e.g. no free connection within acquire_timeout: MySQL wasn't reached
+            self.breaker.release()
+            raise
+        self.acquire_time = time.perf_counter() - start
+        self.connection = self.pooled.connection
+        try:
+            self._set_deadline()
+            self.cursor = self.connection.cursor(buffered=True)
+        except BaseException:
+            # __exit__ won't run: give the connection back and settle the breaker here
+            self.pool.release(self.pooled, broken=True)
+            self.breaker.record_failure()
+            raise
         return self
 
+    # the mysql deadline is the session's max_execution_time (it bounds SELECT
+    # statements), set when it differs from the one the pooled connection has
+    def _set_deadline(self):
+        seconds = resilience_utils.deadline('mysql')
+        ms = int(seconds * 1000) if seconds else 0
+        if self.pooled.max_execution_time == ms:
+            return
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute("SET SESSION max_execution_time = %s", (ms, ))
+            cursor.close()
+        except mysql.connector.Error as error:
+            # e.g. MariaDB, which has max_statement_time instead: run without a deadline
+            logging.warning(f"Failed to set max_execution_time: {error}")
+        self.pooled.max_execution_time = ms
+
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type:
+        # GeneratorExit is a streaming consumer stopping early (see iter_rows), not an error
+        if exc_type and not issubclass(exc_type, GeneratorExit):
             logging.exception("Exception occurred")
-        self.cursor.close()
-        self.connection.close()
-
-    def execute_query(self, query, values=None):
+        broken = False
         try:
+            self.cursor.close()
+        except mysql.connector.Error:
+            broken = True
+        if exc_type is not None and issubclass(exc_type, (mysql.connector.errors.OperationalError,
+                                                          mysql.connector.errors.InterfaceError)):
+            broken = True
+        self.pool.release(self.pooled, broken=broken)
+        if self.failed or (exc_type is not None and issubclass(exc_type, source_failures)):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    # every query is timed under its name (see metrics_utils); the connection wait
+    # of this context is charged to its first query
+    def execute_query(self, query, values=None, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            timer.acquire, self.acquire_time = self.acquire_time, 0.0
+            try:
+                self.cursor.execute(query, values)
+                self.connection.commit()
+                timer.rows = max(self.cursor.rowcount, 0)
+                return True
+            except mysql.connector.Error as error:
+                timer.error = True
+                self.failed = self.failed or isinstance(error, source_failures)
+                logging.exception(f"Failed to execute query: {error}")
+                self.connection.rollback()
+                return False
+
+    # run the query for every set of values in one transaction
+    def execute_many(self, query, values, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            timer.acquire, self.acquire_time = self.acquire_time, 0.0
+            try:
+                self.connection.start_transaction()
+                self.cursor.executemany(query, values)
+                self.connection.commit()
+                timer.rows = max(self.cursor.rowcount, 0)
+                timer.bytes = metrics_utils.measure(values)[1]
+                return True
+            except mysql.connector.Error as error:
+                timer.error = True
+                self.failed = self.failed or isinstance(error, source_failures)
+                logging.exception(f"Failed to execute query: {error}")
+                self.connection.rollback()
+                return False
+
+    def fetch_data(self, query, values=None, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            timer.acquire, self.acquire_time = self.acquire_time, 0.0
             self.cursor.execute(query, values)
-            self.connection.commit()
-            return True
-        except mysql.connector.Error as error:
-            logging.exception(f"Failed to execute query: {error}")
-            self.connection.rollback()
-            return False
+            rows = self.cursor.fetchall()
+            timer.set_result(rows)
+        return rows
 
-    def fetch_data(self, query, values=None):
-        self.cursor.execute(query, values)
-        return self.cursor.fetchall()
-    
-def fetch_all_keywords():
+    # the result as one NumPy array per column (dtypes gives the dtype of each column),
+    # for results that are processed as arrays rather than row by row
+    def fetch_columns(self, query, values=None, dtypes=None, name=None):
+        rows = self.fetch_data(query, values, name=name)
+        n = len(self.cursor.column_names)
+        columns = list(zip(*rows)) if rows else [()] * n
+        return [np.array(column, dtype=dtype) for column, dtype in zip(columns, dtypes or [None] * n)]
+
+    # stream the rows through an unbuffered cursor, batch_size rows at a time, so the
+    # client holds one batch instead of the whole result. Each batch is timed on its
+    # own; the connection can't run other queries until the generator is exhausted
+    # or closed.
+    def iter_rows(self, query, values=None, batch_size=1000, name=None):
+        cursor = None
+        try:
+            while True:
+                with metrics_utils.timed('mysql', name, query) as timer:
+                    if cursor is None:
+                        timer.acquire, self.acquire_time = self.acquire_time, 0.0
+                        cursor = self.connection.cursor(buffered=False)
+                        cursor.execute(query, values)
+                    rows = cursor.fetchmany(batch_size)
+                    timer.set_result(rows)
+                yield from rows
+                if len(rows) < batch_size:
+                    return
+        finally:
+            if cursor is not None:
+                # drop the rest of an abandoned result, so the connection can go back to the pool
+                self.connection.consume_results()
+                cursor.close()
+
+    # run a query as a server-side prepared statement, prepared once per pooled connection
+    def fetch_prepared(self, query, values=None, name=None):
+        with metrics_utils.timed('mysql', name, query) as timer:
+            timer.acquire, self.acquire_time = self.acquire_time, 0.0
+            cursor = self.pooled.prepared_cursor(query)
+            cursor.execute(query, values)
+            rows = cursor.fetchall()
+            timer.set_result(rows)
+        return rows
+
+
+fetch_batch_size = 5000
+
+
+# all keyword names, streamed from a server-side cursor
+def iter_all_keywords(batch_size=None):
+    if snapshot_utils.use_snapshot:
+        yield from snapshot_utils.get_snapshot().keyword_list('mysql_keywords')
+        return
     with MySQLDatabase(config) as db:
         query = "SELECT name FROM keyword"
-        result = db.fetch_data(query)
-        keywords = [row[0] for row in result]
+        for row in db.iter_rows(query, batch_size=batch_size or fetch_batch_size, name='fetch_all_keywords'):
+            yield row[0]
 
-    return keywords
+
+@cached('mysql')
+@resilience_utils.serve_stale()
+def fetch_all_keywords():
+    return list(iter_all_keywords())
 
 def fav_keywords_exists(db):
     query = "SHOW TABLES LIKE 'fav_keywords'"
     return bool(db.fetch_data(query))
 
+# favorite keywords are kept per session: (session_id, name) is the primary key, so
+# concurrent users only touch their own rows
 def create_fav_keywords_table(db):
     query = ("""
              CREATE TABLE `fav_keywords` (
+             `session_id` varchar(64) NOT NULL DEFAULT '',
              `name` varchar(512) NOT NULL,
-             PRIMARY KEY (`name`))
+             PRIMARY KEY (`session_id`, `name`))
              """)
     if db.execute_query(query):
         logging.info("fav_keywords table created successfully")
 
-def fetch_all_fav_keywords():
-    with MySQLDatabase(config) as db:
-        if not fav_keywords_exists(db):
-            create_fav_keywords_table(db)
+# the fav_keywords table of older versions has no session_id, its rows become session ''
+def add_session_to_fav_keywords_table(db):
+    query = "SHOW COLUMNS FROM fav_keywords LIKE 'session_id'"
+    if db.fetch_data(query):
+        return
+    query = ("""
+             ALTER TABLE `fav_keywords`
+             ADD COLUMN `session_id` varchar(64) NOT NULL DEFAULT '' FIRST,
+             DROP PRIMARY KEY,
+             ADD PRIMARY KEY (`session_id`, `name`)
+             """)
+    if db.execute_query(query):
+        logging.info("session_id added to fav_keywords table")
 
-        query = "SELECT name FROM fav_keywords"
-        result = db.fetch_data(query)
+_fav_keywords_ready = False
+_fav_keywords_lock = threading.Lock()
+
+# create or upgrade the fav_keywords table, checked once per process
+def ensure_fav_keywords_table():
+    global _fav_keywords_ready
+    if _fav_keywords_ready:
+        return
+    with _fav_keywords_lock:
+        if _fav_keywords_ready:
+            return
+        with MySQLDatabase(config) as db:
+            if not fav_keywords_exists(db):
+                create_fav_keywords_table(db)
+            else:
+                add_session_to_fav_keywords_table(db)
+        _fav_keywords_ready = True
+
+# in snapshot mode favorite keywords are kept in a local SQLite file (see snapshot_utils)
+@resilience_utils.serve_stale()
+def fetch_all_fav_keywords(session_id):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.fetch_favorites(session_id)
+    ensure_fav_keywords_table()
+    with MySQLDatabase(config) as db:
+        query = "SELECT name FROM fav_keywords WHERE session_id = %s"
+        result = db.fetch_data(query, (session_id, ), name='fetch_all_fav_keywords')
         fav_keywords = [row[0] for row in result]
 
     return fav_keywords
 
-def add_fav_keyword(keyword):
+def add_fav_keyword(session_id, keyword):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.add_favorites(session_id, [keyword])
+    ensure_fav_keywords_table()
     with MySQLDatabase(config) as db:
-        query = "INSERT INTO fav_keywords (name) VALUES (%s)"
-        values = (keyword, )
-        if db.execute_query(query, values):
-            logging.info("Favorite keyword added")
+        query = ("INSERT INTO fav_keywords (session_id, name) VALUES (%s, %s) "
+                 "ON DUPLICATE KEY UPDATE name = name")
+        values = (session_id, keyword)
+        if not db.execute_query(query, values, name='add_fav_keyword'):
+            return False
+    logging.info("Favorite keyword added")
+    return True
 
 
-def delete_fav_keyword(keyword):
+def delete_fav_keyword(session_id, keyword):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.delete_favorites(session_id, [keyword])
+    ensure_fav_keywords_table()
     with MySQLDatabase(config) as db:
-        if not fav_keywords_exists(db):
-            logging.error("Error: fav_keywords table does not exist")
-            return
-        query = "DELETE FROM fav_keywords WHERE name = %s"
-        values = (keyword, )
-        if db.execute_query(query, values):
-            logging.info("Favorite keyword deleted")
+        query = "DELETE FROM fav_keywords WHERE session_id = %s AND name = %s"
+        values = (session_id, keyword)
+        if not db.execute_query(query, values, name='delete_fav_keyword'):
+            return False
+    logging.info("Favorite keyword deleted")
+    return True
+
+
+# add many favorite keywords in one transaction, keywords that are already favorites are
+# skipped. The write functions return whether the write succeeded.
+def add_fav_keywords(session_id, keywords):
+    values = [(session_id, keyword) for keyword in dict.fromkeys(keywords)]
+    if not values:
+        return True
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.add_favorites(session_id, [keyword for _, keyword in values])
+    ensure_fav_keywords_table()
+    with MySQLDatabase(config) as db:
+        query = ("INSERT INTO fav_keywords (session_id, name) VALUES (%s, %s) "
+                 "ON DUPLICATE KEY UPDATE name = name")
+        if not db.execute_many(query, values, name='add_fav_keywords'):
+            return False
+    logging.info(f"{len(values)} favorite keywords added")
+    return True
+
+
+# delete many favorite keywords in one transaction
+def delete_fav_keywords(session_id, keywords):
+    values = [(session_id, keyword) for keyword in dict.fromkeys(keywords)]
+    if not values:
+        return True
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.delete_favorites(session_id, [keyword for _, keyword in values])
+    ensure_fav_keywords_table()
+    with MySQLDatabase(config) as db:
+        query = "DELETE FROM fav_keywords WHERE session_id = %s AND name = %s"
+        if not db.execute_many(query, values, name='delete_fav_keywords'):
+            return False
+    logging.info(f"{len(values)} favorite keywords deleted")
+    return True
+
+
+# precomputed faculty x keyword KRC matrix (see KRCMatrix), used by widgets 5 & 6
+use_krc_matrix = True
+krc_matrix_path = 'krc_matrix.npz'
+
+
+krc_entries_query = """
+                select b.faculty_id, d.keyword_id, sum(c.num_citations*d.score), count(*)
+                from faculty_publication b
+                join publication c
+                on b.publication_id = c.id
+                join publication_keyword d
+                on c.id = d.publication_id
+                group by b.faculty_id, d.keyword_id
+                """
+
+
+# sparse faculty x keyword matrix of SUM(num_citations*score), with the university
+# of each faculty for the rollup. A set of favorite keywords is scored by summing
+# its columns, so a recommendation no longer touches the publication tables.
+class KRCMatrix:
+    def __init__(self, faculty_names, faculty_univ, univ_names, keyword_ids, keyword_names,
+                 krc, hits):
+        self.faculty_names = faculty_names
+        self.faculty_univ = faculty_univ
+        self.univ_names = univ_names
+        self.keyword_ids = keyword_ids
+        self.keyword_names = keyword_names
+        # CSC, so summing the columns of a few keywords only touches their entries
+        self.krc = krc.tocsc()
+        self.hits = hits.tocsc()
+        self.columns = {}
+        for col, name in enumerate(keyword_names):
+            self.columns.setdefault(name, []).append(col)
+
+    @classmethod
+    def build(cls):
+        with resilience_utils.no_deadline(), MySQLDatabase(config) as db:
+            faculty_ids, faculty_names, univ_ids, univ_names = db.fetch_columns("""
+                select a.id, a.name, u.id, u.name
+                from faculty a
+                join university u
+                on a.university_id = u.id
+                """, dtypes=[np.int64, str, np.int64, str], name='krc_faculty')
+            keyword_ids, keyword_names = db.fetch_columns(
+                "select id, name from keyword", dtypes=[np.int64, str], name='krc_keywords')
+            entry_faculty, entry_keyword, krc, hits = db.fetch_columns(
+                krc_entries_query, dtypes=[np.int64, np.int64, np.float64, np.int64], name='krc_entries')
+
+        # universities numbered in order of first appearance
+        _, first, inverse = np.unique(univ_ids, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+
+        rows, faculty_found = _positions(faculty_ids, entry_faculty)
+        cols, keyword_found = _positions(keyword_ids, entry_keyword)
+        found = faculty_found & keyword_found
+        rows, cols = rows[found], cols[found]
+        shape = (len(faculty_ids), len(keyword_ids))
+        return cls(
+            faculty_names=faculty_names,
+            faculty_univ=rank[inverse].astype(np.int64),
+            univ_names=univ_names[first[order]],
+            keyword_ids=keyword_ids,
+            keyword_names=keyword_names,
+            krc=sparse.csc_matrix((np.nan_to_num(krc[found]), (rows, cols)), shape=shape),
+            hits=sparse.csc_matrix((hits[found], (rows, cols)), shape=shape),
+        )
+
+    def save(self, path):
+        np.savez(path, faculty_names=self.faculty_names, faculty_univ=self.faculty_univ,
+                 univ_names=self.univ_names, keyword_ids=self.keyword_ids,
+                 keyword_names=self.keyword_names, shape=np.array(self.krc.shape),
+                 indices=self.krc.indices, indptr=self.krc.indptr,
+                 krc=self.krc.data, hits=self.hits.data)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            shape = tuple(f['shape'])
+            structure = (f['indices'], f['indptr'])
+            return cls(
+                faculty_names=f['faculty_names'], faculty_univ=f['faculty_univ'],
+                univ_names=f['univ_names'], keyword_ids=f['keyword_ids'],
+                keyword_names=f['keyword_names'],
+                krc=sparse.csc_matrix((f['krc'], *structure), shape=shape),
+                hits=sparse.csc_matrix((f['hits'], *structure), shape=shape),
+            )
+
+    # per-faculty total KRC over the keywords, and whether the faculty matched any of them
+    def score(self, keywords):
+        cols = [col for name in set(keywords) for col in self.columns.get(name, ())]
+        if not cols:
+            n = len(self.faculty_names)
+            return np.zeros(n), np.zeros(n, dtype=bool)
+        total = np.asarray(self.krc[:, cols].sum(axis=1)).ravel()
+        matched = np.asarray(self.hits[:, cols].sum(axis=1)).ravel() > 0
+        return total, matched
+
+    # widgets 5 & 6 from one scoring pass: top-k professors and top-k universities
+    def recommend(self, keywords, k=5):
+        total, matched = self.score(keywords)
+        candidates = np.flatnonzero(matched)
+        top = candidates[_top_k(total[candidates], k)]
+        recommended_prof = [{"Professor": str(self.faculty_names[i]),
+                             "Institute": str(self.univ_names[self.faculty_univ[i]]),
+                             "Total Citation Score": round(float(total[i]), 2)} for i in top]
+
+        univ = self.faculty_univ[candidates]
+        n_univ = len(self.univ_names)
+        univ_total = np.bincount(univ, weights=total[candidates], minlength=n_univ)
+        univ_count = np.bincount(univ, minlength=n_univ)
+        univ_candidates = np.flatnonzero(univ_count)
+        top = univ_candidates[_top_k(univ_total[univ_candidates], k)]
+        recommended_univ = [{"Institute": str(self.univ_names[i]),
+                             "Related Professor Count": int(univ_count[i]),
+                             "Total Citation Score": round(float(univ_total[i]), 2)} for i in top]
+        return recommended_prof, recommended_univ
+
+
+# the KRC matrix of an offline snapshot: its columns are the snapshot's keyword
+# dictionary and its arrays are memory-mapped, so nothing is copied per process
+class SnapshotKRCMatrix(KRCMatrix):
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.faculty_names = snapshot.strings('rec_faculty')
+        self.faculty_univ = snapshot['rec_faculty_univ']
+        self.univ_names = snapshot.strings('rec_university')
+        self.keyword_ids = None
+        self.keyword_names = snapshot.keywords
+        shape = (len(self.faculty_names), len(snapshot.keywords))
+        structure = (snapshot['rec_indices'], snapshot['rec_indptr'])
+        self.krc = sparse.csc_matrix((snapshot['rec_krc'], *structure), shape=shape)
+        self.hits = sparse.csc_matrix((snapshot['rec_hits'], *structure), shape=shape)
+        self.columns = snapshot.keywords
+
+
+_snapshot_krc_matrix = None
+
+
+def get_snapshot_krc_matrix():
+    global _snapshot_krc_matrix
+    snapshot = snapshot_utils.get_snapshot()
+    matrix = _snapshot_krc_matrix
+    if matrix is None or matrix.version != snapshot.version:
+        matrix = _snapshot_krc_matrix = SnapshotKRCMatrix(snapshot)
+    return matrix
+
+
+# index of each value in ids, and whether it was found
+def _positions(ids, values):
+    if not len(ids):
+        return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+    sorter = np.argsort(ids, kind='stable')
+    positions = np.minimum(np.searchsorted(ids, values, sorter=sorter), len(ids) - 1)
+    index = sorter[positions]
+    return index, ids[index] == values
+
+
+# indices of the k largest values, largest first, without sorting the whole array
+def _top_k(values, k):
+    if len(values) > k:
+        part = np.argpartition(-values, k - 1)[:k]
+    else:
+        part = np.arange(len(values))
+    return part[np.argsort(-values[part], kind='stable')]
+
+
+_krc_matrix = None
+_krc_matrix_mtime = None
+_krc_matrix_lock = threading.Lock()
+
+
+# held while a process builds the matrix, so the workers of a cold start build it once:
+# the others wait and then load the file it wrote (no cross-process lock without fcntl)
+@contextlib.contextmanager
+def _krc_build_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(krc_matrix_path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# the KRC matrix of this process, loaded from krc_matrix_path (and reloaded when
+# another process rebuilds it) or built from MySQL on first use
+def get_krc_matrix():
+    global _krc_matrix, _krc_matrix_mtime
+    try:
+        mtime = os.stat(krc_matrix_path).st_mtime
+    except OSError:
+        mtime = None
+    if _krc_matrix is not None and mtime == _krc_matrix_mtime:
+        return _krc_matrix
+    with _krc_matrix_lock:
+        if _krc_matrix is None or mtime != _krc_matrix_mtime:
+            if mtime is not None:
+                _krc_matrix = KRCMatrix.load(krc_matrix_path)
+                _krc_matrix_mtime = mtime
+            elif _krc_matrix is None:
+                with _krc_build_lock():
+                    if os.path.exists(krc_matrix_path):
+                        _krc_matrix = KRCMatrix.load(krc_matrix_path)
+                        _krc_matrix_mtime = os.stat(krc_matrix_path).st_mtime
+                    else:
+                        rebuild_krc_matrix()
+    return _krc_matrix
+
+
+# load (or build) the matrix in a background thread when a worker starts, so the
+# first recommendation request doesn't pay for it
+def preload_krc_matrix():
+    def load():
+        try:
+            get_krc_matrix()
+        except Exception:
+            logging.exception("Failed to preload the KRC matrix")
+
+    threading.Thread(target=load, name='krc-matrix-preload', daemon=True).start()
+
+
+# rebuild the KRC matrix from MySQL and write it to krc_matrix_path
+def rebuild_krc_matrix():
+    global _krc_matrix, _krc_matrix_mtime
+    matrix = KRCMatrix.build()
+    # per-process temporary file, np.savez adds .npz to other names
+    tmp_path = f"{krc_matrix_path}.{os.getpid()}.tmp.npz"
+    matrix.save(tmp_path)
+    os.replace(tmp_path, krc_matrix_path)
+    _krc_matrix = matrix
+    _krc_matrix_mtime = os.stat(krc_matrix_path).st_mtime
+    cache_utils.invalidate('recommendations')
+    logging.info(f"KRC matrix rebuilt: {matrix.krc.shape[0]} faculty x {matrix.krc.shape[1]} keywords, "
+                 f"{matrix.krc.nnz} entries")
+    return matrix
+
+
+# the IN list of the recommendation queries. Its length is rounded up to a power of two
+# and padded with NULL (which matches nothing), so the prepared statements of a
+# connection are one per size class rather than one per number of favorite keywords.
+def _keyword_filter(keywords):
+    keywords = list(keywords)
+    if not keywords:
+        return "null", ()
+    size = 1 << (len(keywords) - 1).bit_length()
+    return ", ".join(["%s"] * size), tuple(keywords) + (None, ) * (size - len(keywords))
+
+
+# widgets 5 & 6 - recommended professors and universities for a set of favorite
+# keywords, computed together: the per-faculty KRC aggregate is evaluated once and
+# both top-5 lists are derived from it. Returns (recommended_prof, recommended_univ).
+# While MySQL fails, the last result for the keywords is served.
+@cached('recommendations')
+@resilience_utils.serve_stale()
+def get_recommendations(keywords):
+    return recommend(keywords)
+
+
+def recommend(keywords):
+    if snapshot_utils.use_snapshot:
+        return get_snapshot_krc_matrix().recommend(keywords)
+    if use_krc_matrix:
+        return get_krc_matrix().recommend(keywords)
+    return query_recommendations(keywords)
+
+
+# widgets 5 & 6 computed by MySQL in one round trip: the per-faculty aggregate is a
+# CTE that both the professor and the university ranking read from
+def recommendations_query(keywords):
+    keyword_filter, values = _keyword_filter(keywords)
+    query = (f"""
+                with fac as (
+                    select a.id, a.name, u.id as univ_id, u.name as univ_name, sum(c.num_citations*d.score) as krc
+                    from faculty a
+                    join faculty_publication b
+                    on a.id = b.faculty_id
+                    join publication c
+                    on b.publication_id = c.id
+                    join publication_keyword d
+                    on c.id = d.publication_id
+                    join university u
+                    on a.university_id = u.id
+                    where d.keyword_id in (select id from keyword where name in ({keyword_filter}))
+                    group by a.id
+                )
+                (select 'prof' as kind, name, univ_name, 1 as n_prof, round(krc,2) as total_KRC, krc
+                 from fac
+                 order by krc desc
+                 limit 5)
+                union all
+                (select 'univ' as kind, univ_name, null, count(*), round(sum(krc),2), sum(krc)
+                 from fac
+                 group by univ_id, univ_name
+                 order by sum(krc) desc
+                 limit 5)
+                """)
+    return query, values
+
+
+def query_recommendations(keywords):
+    query, values = recommendations_query(keywords)
+    with MySQLDatabase(config) as db:
+        result = db.fetch_prepared(query, values, name='recommendations')
+
+    result = sorted(result, key=lambda row: row[5], reverse=True)
+    recommended_prof = [{"Professor": row[1], "Institute": row[2], "Total Citation Score": row[4]}
+                        for row in result if row[0] == 'prof']
+    recommended_univ = [{"Institute": row[1], "Related Professor Count": row[3], "Total Citation Score": row[4]}
+                        for row in result if row[0] == 'univ']
+    return recommended_prof, recommended_univ
 
 
 # widget 5 - recommended professors: given a list of favorite keywords, recommend top profs related to the keywords based on total KRC.
-def get_recommended_prof():
+def get_recommended_prof(keywords):
+    return get_recommendations(keywords)[0]
+
+
+# widget 5 computed by MySQL
+def query_recommended_prof(keywords):
+    keyword_filter, values = _keyword_filter(keywords)
     with MySQLDatabase(config) as db:
-        if not fav_keywords_exists(db):
-            logging.error("Error: fav_keywords table does not exist")
-            return
-        query = ("""
+        query = (f"""
                     select a.name as professor, u.name as institute, round(sum(c.num_citations*d.score),2) as total_KRC
                     from faculty a
                     join faculty_publication b
@@ -109,25 +889,28 @@ def get_recommended_prof():
                     on c.id = d.publication_id
                     join university u
                     on a.university_id = u.id
-                    where d.keyword_id in (select id from keyword where name in (select name from fav_keywords))
+                    where d.keyword_id in (select id from keyword where name in ({keyword_filter}))
                     group by a.id
                     order by sum(c.num_citations*d.score) desc
-                    limit 5;
+                    limit 5
                 """)
         
-        result = db.fetch_data(query)
+        result = db.fetch_prepared(query, values, name='recommended_prof')
         recommended_prof = [{"Professor": row[0], "Institute": row[1], "Total Citation Score": row[2]} for row in result]
 
     return recommended_prof
 
 # widget 6 - recommended universities: given a list of favorite keywords, recommend top universities related to the keywords, based on the sum of total KRC of the faculty. 
 
-def get_recommended_univ():
+def get_recommended_univ(keywords):
+    return get_recommendations(keywords)[1]
+
+
+# widget 6 computed by MySQL
+def query_recommended_univ(keywords):
+    keyword_filter, values = _keyword_filter(keywords)
     with MySQLDatabase(config) as db:
-        if not fav_keywords_exists(db):
-            logging.error("Error: fav_keywords table does not exist")
-            return
-        query = ("""
+        query = (f"""
                 select u.name as institute, count(distinct a.id) as related_prof_count, round(sum(c.num_citations*d.score),2) as total_KRC
                 from faculty a
                 join faculty_publication b
@@ -138,37 +921,95 @@ def get_recommended_univ():
                 on c.id = d.publication_id
                 join university u
                 on a.university_id = u.id
-                where d.keyword_id in (select id from keyword where name in (select name from fav_keywords))
+                where d.keyword_id in (select id from keyword where name in ({keyword_filter}))
                 group by u.id
                 order by sum(c.num_citations*d.score) desc
                 limit 5
                 """)
-        result = db.fetch_data(query)
+        result = db.fetch_prepared(query, values, name='recommended_univ')
         recommended_univ = [{"Institute": row[0], "Related Professor Count": row[1], "Total Citation Score": row[2]} for row in result]
 
     return recommended_univ
 
 
-# added index to the keyword table
-def add_index_to_keyword_table():
+# compare the KRC matrix against the SQL recommendations for random samples of
+# keywords. Returns the keyword sets that disagree.
+def check_krc_consistency(samples=20, sample_size=3, seed=0):
+    matrix = get_krc_matrix()
+    rng = random.Random(seed)
+    names = sorted(matrix.columns)
+    keyword_sets = [rng.sample(names, min(sample_size, len(names))) for _ in range(samples)]
+
+    def totals(rows, key):
+        return sorted((row[key], round(float(row["Total Citation Score"]), 2)) for row in rows)
+
+    mismatches = []
+    for keywords in keyword_sets:
+        recommended_prof, recommended_univ = matrix.recommend(keywords)
+        prof_ok = totals(recommended_prof, "Professor") == \
+            totals(query_recommended_prof(keywords), "Professor")
+        univ_ok = totals(recommended_univ, "Institute") == \
+            totals(query_recommended_univ(keywords), "Institute")
+        if not (prof_ok and univ_ok):
+            mismatches.append(keywords)
+            logging.warning(f"KRC matrix disagrees with SQL for {keywords}")
+    return mismatches
+
+
+def index_exists(db, table, index):
+    query = ("SELECT 1 FROM information_schema.statistics "
+             "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1")
+    return bool(db.fetch_data(query, (table, index)))
+
+
+def constraint_exists(db, table, constraint):
+    query = ("SELECT 1 FROM information_schema.table_constraints "
+             "WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s LIMIT 1")
+    return bool(db.fetch_data(query, (table, constraint)))
+
+
+def trigger_exists(db, trigger):
+    query = ("SELECT 1 FROM information_schema.triggers "
+             "WHERE trigger_schema = DATABASE() AND trigger_name = %s LIMIT 1")
+    return bool(db.fetch_data(query, (trigger, )))
+
+
+# add an index unless it already exists, returns True if it was added
+def add_index(table, index, columns):
     with MySQLDatabase(config) as db:
-        query = "ALTER TABLE keyword ADD INDEX idx_keyword_name (name);"
+        if index_exists(db, table, index):
+            return False
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        query = f"ALTER TABLE `{table}` ADD INDEX `{index}` ({column_list})"
         if db.execute_query(query):
-            logging.info("Index added to keyword table successfully")
+            logging.info(f"Index {index} added to {table} table successfully")
+            return True
+    return False
+
+
+# added index to the keyword table
+def add_index_to_keyword_table():
+    return add_index('keyword', 'idx_keyword_name', ['name'])
 
 
 # added foreign key constraint to the faculty_keyword table on keyword_id
 def add_foreign_key_constraint():
     with MySQLDatabase(config) as db:
+        if constraint_exists(db, 'faculty_keyword', 'fk_keyword_id'):
+            return False
         query = "ALTER TABLE faculty_keyword ADD CONSTRAINT fk_keyword_id FOREIGN KEY (keyword_id) REFERENCES keyword (id);"
         if db.execute_query(query):
             logging.info(
                 "Foreign key constraint added to faculty_keyword")
+            return True
+    return False
 
 
 # added trigger on faculty_keyword to check if score is non-negative
 def add_trigger():
     with MySQLDatabase(config) as db:
+        if trigger_exists(db, 'faculty_keyword_score_check'):
+            return False
         query = ("""
                  CREATE TRIGGER faculty_keyword_score_check BEFORE INSERT ON faculty_keyword 
                  FOR EACH ROW 
@@ -180,3 +1021,5 @@ def add_trigger():
                  """)
         if db.execute_query(query):
             logging.info("Trigger added to faculty_keyword")
+            return True
+    return False
@@ -1,105 +1,552 @@
-from neo4j import GraphDatabase
+from neo4j import GraphDatabase, Result, unit_of_work
 import pandas as pd
+import numpy as np
+import collections
+import logging
+import os
+import threading
+import time
+import metrics_utils
+import resilience_utils
+import snapshot_utils
+from cache_utils import cached
+
+# driver settings, connections are pooled by the driver and shared by all queries
+driver_config = {
+    'max_connection_pool_size': 50,
+    'connection_acquisition_timeout': 10,
+    'max_connection_lifetime': 3600,
+    'keep_alive': True,
+}
 
 class Neo4jConnection:
-    def __init__(self, uri, user, pwd):
+    def __init__(self, uri, user, pwd, **config):
         self.__uri = uri
         self.__user = user
         self.__pwd = pwd
+        self.__config = config
         self.__driver = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.__connect()
+
+    def __connect(self):
         try:
             self.__driver = GraphDatabase.driver(
-                self.__uri, auth=(self.__user, self.__pwd))
+                self.__uri, auth=(self.__user, self.__pwd), **self.__config)
+            self.__pid = os.getpid()
         except Exception as e:
-            print("Failed to create the driver:", e)
+            logging.exception(f"Failed to create the driver: {e}")
+
+    # the driver's sockets can't be shared with a forked worker, so each process gets its own driver
+    def __get_driver(self):
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__connect()
+        return self.__driver
 
     def close(self):
         if self.__driver is not None:
             self.__driver.close()
 
-    def query(self, query, db=None):
-        assert self.__driver is not None, "Driver not initialized!"
-        session = None
-        response = None
-        try:
-            session = self.__driver.session(
-                database=db) if db is not None else self.__driver.session()
-            response = list(session.run(query))
-        except Exception as e:
-            print("Query failed:", e)
-        finally:
-            if session is not None:
-                session.close()
-        return response
+    # run a query with $parameters; the transformer consumes the result stream
+    # directly (e.g. Result.to_df), the default returns the list of records.
+    # The query is timed under name (see metrics_utils), runs in a managed
+    # transaction with the source's deadline as its timeout and goes through the
+    # neo4j circuit breaker (see resilience_utils). Failures are logged and raised.
+    def query(self, query, parameters=None, db=None, transformer=list, write=False, name=None):
+        driver = self.__get_driver()
+        assert driver is not None, "Driver not initialized!"
+        with resilience_utils.protect('neo4j'), metrics_utils.timed('neo4j', name, query) as timer:
+            def instrumented(result):
+                # the driver doesn't report its pool wait, so estimate it as the time until
+                # the result arrived minus the server's own time (includes one round trip)
+                waited = time.perf_counter() - timer.start
+                value = transformer(result)
+                summary = result.consume()
+                timer.acquire = max(0.0, waited - summary.result_available_after / 1000)
+                timer.set_result(value)
+                return value
+
+            @unit_of_work(timeout=resilience_utils.deadline('neo4j'))
+            def work(tx):
+                return instrumented(tx.run(query, parameters))
+
+            try:
+                with driver.session(database=db) as session:
+                    return session.execute_write(work) if write else session.execute_read(work)
+            except Exception as e:
+                timer.error = True
+                logging.error(f"Query failed: {e}")
+                raise
 
 # connect to neo4j database, neo4j local server need to be open
-conn = Neo4jConnection(uri="bolt://localhost:7687",
-                       user="neo4j", pwd="12345678")
+uri = "bolt://localhost:7687"
+user, pwd = "neo4j", "12345678"
+conn = Neo4jConnection(uri=uri, user=user, pwd=pwd, **driver_config)
+database = 'academicworld'
 
 
 # widget 2 - top professors of keyword: for a given keyword and time period, return 10 top professors related to the keyword based on keyword-relevant citation (KRC).
-def get_top_professor(keyword, start_year, end_year):
-    query = f'''
-    MATCH (f1:FACULTY)-[:PUBLISH]-(p:PUBLICATION)-[l:LABEL_BY]-(k:KEYWORD),
-    (f2:FACULTY)-[:AFFILIATION_WITH]-(i:INSTITUTE)
-    WHERE k.name = "{keyword}" AND p.year >= {start_year} AND p.year <= {end_year}  AND f1.id = f2.id
-    WITH f1, SUM(p.numCitations * l.score) AS krc, i
-    RETURN f1.name, i.name as institute, ROUND(krc, 2) AS citation_score
+# The traversal starts from the keyword (index on KEYWORD.name) and follows the directed
+# relationships; the KRC is aggregated per faculty before the affiliations are expanded.
+top_professor_query = '''
+    MATCH (k:KEYWORD {name: $keyword})<-[l:LABEL_BY]-(p:PUBLICATION)<-[:PUBLISH]-(f:FACULTY)
+    WHERE $start_year <= p.year <= $end_year
+    WITH f, SUM(p.numCitations * l.score) AS krc
+    MATCH (f)-[:AFFILIATION_WITH]->(i:INSTITUTE)
+    RETURN f.name, i.name as institute, ROUND(krc, 2) AS citation_score
     ORDER BY citation_score DESC
     LIMIT 10
-    '''
-    result = conn.query(query, db='academicworld')
-    df = pd.DataFrame([dict(_) for _ in result]).rename(
-        columns={'f1.name': 'Professor','institute': 'Institute', 'citation_score': 'Citation Score'})
+'''
+
+# serve widget 2 from per-keyword KRC prefix sums (see KeywordKRC), so moving the year
+# range doesn't run a graph traversal
+use_krc_prefix_sums = True
+krc_prefix_cache_size = 64      # keywords kept in memory
+krc_prefix_max_age = 3600       # seconds before a keyword's sums are rebuilt
+
+# KRC of every (faculty, institute) per publication year for one keyword
+keyword_krc_by_year_query = '''
+    MATCH (k:KEYWORD {name: $keyword})<-[l:LABEL_BY]-(p:PUBLICATION)<-[:PUBLISH]-(f:FACULTY)
+    WHERE p.year IS NOT NULL
+    WITH f, p.year AS year, SUM(p.numCitations * l.score) AS krc, count(*) AS hits
+    MATCH (f)-[:AFFILIATION_WITH]->(i:INSTITUTE)
+    RETURN elementId(f) AS faculty, elementId(i) AS institute_id, f.name AS name, i.name AS institute,
+           year, krc, hits
+'''
+
+
+# year x (faculty, institute) prefix sums of KRC for one keyword: the KRC of any
+# year window is the difference of two rows, followed by a top-k selection
+class KeywordKRC:
+    def __init__(self, years, professors, institutes, krc, hits):
+        self.years = years
+        self.professors = professors
+        self.institutes = institutes
+        # row y holds the totals of the years before years[y]
+        self.krc = krc
+        self.hits = hits
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def from_records(cls, records):
+        years = np.unique(np.array([record['year'] for record in records], dtype=np.int64))
+        columns = {}
+        for record in records:
+            columns.setdefault((record['faculty'], record['institute_id']), (record['name'], record['institute']))
+        column = {key: i for i, key in enumerate(columns)}
+        krc = np.zeros((len(years) + 1, len(columns)))
+        hits = np.zeros((len(years) + 1, len(columns)), dtype=np.int64)
+        if records:
+            rows = np.searchsorted(years, [record['year'] for record in records]) + 1
+            cols = [column[(record['faculty'], record['institute_id'])] for record in records]
+            np.add.at(krc, (rows, cols), [float(record['krc'] or 0) for record in records])
+            np.add.at(hits, (rows, cols), [record['hits'] for record in records])
+        return cls(years,
+                   np.array([name for name, _ in columns.values()], dtype=object),
+                   np.array([institute for _, institute in columns.values()], dtype=object),
+                   np.cumsum(krc, axis=0), np.cumsum(hits, axis=0))
+
+    # top professors by KRC over publications of start_year..end_year
+    def top(self, start_year, end_year, k=10):
+        lo = np.searchsorted(self.years, start_year, side='left')
+        hi = np.searchsorted(self.years, end_year, side='right')
+        empty = empty_top_professor()
+        if hi <= lo:
+            return empty
+        candidates = np.flatnonzero(self.hits[hi] - self.hits[lo] > 0)
+        if not len(candidates):
+            return empty
+        # ranked by the rounded score, as the query does
+        scores = np.round(self.krc[hi, candidates] - self.krc[lo, candidates], 2)
+        if len(candidates) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+        else:
+            part = np.arange(len(candidates))
+        order = part[np.argsort(-scores[part], kind='stable')]
+        top = candidates[order]
+        return pd.DataFrame({'Professor': self.professors[top], 'Institute': self.institutes[top],
+                             'Citation Score': scores[order]})
+
+
+def empty_top_professor():
+    return pd.DataFrame({'Professor': pd.Series(dtype=object), 'Institute': pd.Series(dtype=object),
+                         'Citation Score': pd.Series(dtype='float64')})
+
+
+def empty_top_keywords_of_univ():
+    return pd.DataFrame({'Keyword': pd.Series(dtype=object), 'Professor Count': pd.Series(dtype='int64')})
+
+
+def empty_top_keywords_of_prof():
+    return pd.DataFrame({'Keyword': pd.Series(dtype=object), 'Citation Score': pd.Series(dtype='float64')})
+
+
+_keyword_krc = collections.OrderedDict()
+_keyword_krc_lock = threading.Lock()
+
+
+# the prefix sums of a keyword, built with one query on first use and kept in a bounded LRU
+def get_keyword_krc(keyword):
+    table = cached_keyword_krc(keyword)
+    if table is not None:
+        return table
+    records = conn.query(keyword_krc_by_year_query, {'keyword': keyword}, db=database,
+                         name='keyword_krc_by_year')
+    return store_keyword_krc(keyword, KeywordKRC.from_records(records))
+
+
+# the keyword's prefix sums if they are in the LRU and not too old
+def cached_keyword_krc(keyword):
+    with _keyword_krc_lock:
+        table = _keyword_krc.get(keyword)
+        if table is not None and time.monotonic() - table.built_at < krc_prefix_max_age:
+            _keyword_krc.move_to_end(keyword)
+            return table
+    return None
+
+
+def store_keyword_krc(keyword, table):
+    with _keyword_krc_lock:
+        _keyword_krc[keyword] = table
+        _keyword_krc.move_to_end(keyword)
+        while len(_keyword_krc) > krc_prefix_cache_size:
+            _keyword_krc.popitem(last=False)
+    return table
+
+
+def reset_keyword_krc():
+    with _keyword_krc_lock:
+        _keyword_krc.clear()
+
+
+# the prefix sums answer any year window in microseconds, so only the query path
+# goes through the result cache. While Neo4j fails, the last result (or an empty
+# table) is served.
+@resilience_utils.serve_stale(default=empty_top_professor)
+def get_top_professor(keyword, start_year, end_year):
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_professors(keyword, int(start_year), int(end_year))
+    if use_krc_prefix_sums:
+        return get_keyword_krc(keyword).top(int(start_year), int(end_year))
+    return query_top_professor(keyword, start_year, end_year)
+
+
+@cached('neo4j')
+def query_top_professor(keyword, start_year, end_year):
+    query = top_professor_query
+    parameters = {'keyword': keyword, 'start_year': int(start_year), 'end_year': int(end_year)}
+    df = conn.query(query, parameters, db=database, transformer=Result.to_df, name='top_professor').rename(
+        columns={'f.name': 'Professor','institute': 'Institute', 'citation_score': 'Citation Score'})
     return df
 
 # widget 3 - top keywords of univerisity: for a given university, return top keywords based on the number of professors insterested in the keyword.
+top_keywords_of_univ_query = '''
+    MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) -[i:INTERESTED_IN] -> (k:KEYWORD)
+    WHERE i1.name = $univ
+    RETURN k.name, count(DISTINCT f1.id) AS n_prof
+    ORDER BY n_prof DESC
+    LIMIT 10
+'''
+
+# serve widget 3 from the precomputed top keywords of every institute (see InstituteKeywords)
+use_institute_keywords = True
+institute_keywords_k = 10
+institute_keywords_check_interval = 300  # seconds between checks for changed interests
+# seconds after which the table is rebuilt in full: the checks only see changes of the
+# relationship counts, not e.g. an interest replaced by another or a professor moving
+institute_keywords_rebuild_interval = 24 * 3600
+
+# top keywords of institutes by number of interested faculty, in one pass over all
+# institutes (institute_keywords_query) or for the listed ones (_for_query)
+_institute_keywords_match = '''
+    MATCH (i:INSTITUTE)<-[:AFFILIATION_WITH]-(f:FACULTY)-[:INTERESTED_IN]->(k:KEYWORD)
+'''
+_institute_keywords_rank = '''
+    WITH i.name AS institute, k.name AS keyword, count(DISTINCT f.id) AS n_prof
+    ORDER BY institute, n_prof DESC, keyword
+    WITH institute, collect(keyword)[..$k] AS keywords, collect(n_prof)[..$k] AS counts
+    RETURN institute, keywords, counts
+'''
+institute_keywords_query = _institute_keywords_match + _institute_keywords_rank
+institute_keywords_for_query = _institute_keywords_match + '''
+    WHERE i.name IN $institutes
+''' + _institute_keywords_rank
+
+# number of interest and affiliation relationships, answered from the count store
+interest_counts_query = '''
+    CALL { MATCH ()-[r:INTERESTED_IN]->() RETURN count(r) AS interests }
+    CALL { MATCH ()-[a:AFFILIATION_WITH]->() RETURN count(a) AS affiliations }
+    RETURN interests, affiliations
+'''
+
+# interest relationships per institute, to find the institutes whose interests changed
+institute_interest_edges_query = '''
+    MATCH (i:INSTITUTE)<-[:AFFILIATION_WITH]-(:FACULTY)-[r:INTERESTED_IN]->()
+    RETURN i.name AS institute, count(r) AS edges
+'''
+
+
+# top-k keywords of every institute as two (institutes x k) arrays: keyword numbers
+# (-1 past the end of a short list) and professor counts. The institute index, keyword
+# names and arrays are published together (rows), so a lookup never sees a new index
+# with the old arrays.
+class InstituteKeywords:
+    def __init__(self, k):
+        self.k = k
+        self.rows = self._empty()
+        self.keyword_index = {}
+        self.edges = {}
+        self.version = None
+        self.checked_at = None
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def _empty(self):
+        return {}, [], np.full((0, self.k), -1, dtype=np.int32), np.zeros((0, self.k), dtype=np.int64)
+
+    # replace the rows of the institutes in records, and empty the rows of the other
+    # listed institutes (no interested faculty any more). With rebuild=True the table
+    # is replaced by the records.
+    def update(self, records, institutes=(), rebuild=False):
+        with self._lock:
+            rows = {institute: ([], []) for institute in institutes}
+            for record in records:
+                rows[record['institute']] = (record['keywords'], record['counts'])
+            if rebuild:
+                self.keyword_index = {}
+                index, keyword_names, keywords, counts = self._empty()
+            else:
+                index, keyword_names, keywords, counts = self.rows
+                index = dict(index)
+            new = [institute for institute in rows if institute not in index]
+            if new:
+                keywords = np.vstack([keywords, np.full((len(new), self.k), -1, dtype=np.int32)])
+                counts = np.vstack([counts, np.zeros((len(new), self.k), dtype=np.int64)])
+                for institute in new:
+                    index[institute] = len(index)
+            else:
+                keywords, counts = keywords.copy(), counts.copy()
+            for institute, (names, values) in rows.items():
+                row = index[institute]
+                keywords[row] = -1
+                counts[row] = 0
+                keywords[row, :len(names)] = [self._keyword(keyword_names, name) for name in names]
+                counts[row, :len(values)] = values
+            self.rows = (index, keyword_names, keywords, counts)
+
+    # keyword names are only appended, so a published list stays valid
+    def _keyword(self, keyword_names, name):
+        number = self.keyword_index.get(name)
+        if number is None:
+            number = self.keyword_index[name] = len(keyword_names)
+            keyword_names.append(name)
+        return number
+
+    def lookup(self, univ):
+        index, keyword_names, keywords, counts = self.rows
+        row = index.get(univ)
+        keywords = keywords[row] if row is not None else np.array([], dtype=np.int32)
+        n = int((keywords >= 0).sum())
+        return pd.DataFrame({'Keyword': [keyword_names[i] for i in keywords[:n]],
+                             'Professor Count': counts[row, :n] if n else np.array([], dtype=np.int64)})
+
+
+def _interest_counts():
+    record = conn.query(interest_counts_query, db=database, transformer=lambda result: result.single(),
+                        name='interest_counts')
+    return record['interests'], record['affiliations']
+
+
+def _institute_edges():
+    records = conn.query(institute_interest_edges_query, db=database, name='institute_interest_edges')
+    return {record['institute']: record['edges'] for record in records}
+
+
+# refresh the listed institutes only
+def refresh_institutes(table, institutes):
+    institutes = list(institutes)
+    if not institutes:
+        return
+    records = conn.query(institute_keywords_for_query, {'institutes': institutes, 'k': table.k},
+                         db=database, name='institute_keywords_refresh')
+    table.update(records, institutes)
+
+
+# the table is built in one pass on first use, and again every rebuild interval. Every
+# check interval the relationship counts are compared (count store, constant time); when
+# they changed, only the institutes whose number of interest edges changed are recomputed.
+def _check_institute_keywords(table):
+    table.checked_at = time.monotonic()
+    rebuild = table.version is None or \
+        table.checked_at - table.built_at > institute_keywords_rebuild_interval
+    version = _interest_counts()
+    if version == table.version and not rebuild:
+        return
+    edges = _institute_edges()
+    if rebuild:
+        with resilience_utils.no_deadline():
+            records = conn.query(institute_keywords_query, {'k': table.k}, db=database, name='institute_keywords')
+        table.update(records, rebuild=True)
+        table.built_at = table.checked_at
+    else:
+        changed = {institute for institute in set(edges) | set(table.edges)
+                   if edges.get(institute) != table.edges.get(institute)}
+        refresh_institutes(table, changed)
+    table.edges = edges
+    table.version = version
+
+
+_institute_keywords = None
+_institute_keywords_lock = threading.Lock()
+_institute_keywords_check_lock = threading.Lock()
+
+
+def _check_due(table):
+    return table.checked_at is None or time.monotonic() - table.checked_at > institute_keywords_check_interval
+
+
+# lookups keep using the current table while another thread checks it; only the
+# first build is waited for
+def get_institute_keywords():
+    global _institute_keywords
+    with _institute_keywords_lock:
+        if _institute_keywords is None:
+            _institute_keywords = InstituteKeywords(institute_keywords_k)
+        table = _institute_keywords
+    if _check_due(table) and _institute_keywords_check_lock.acquire(blocking=table.version is None):
+        try:
+            if _check_due(table):
+                _check_institute_keywords(table)
+        except Exception as e:
+            # a built table keeps answering while Neo4j is down
+            if table.version is None:
+                raise
+            logging.warning(f"Institute keywords check failed: {e}")
+        finally:
+            _institute_keywords_check_lock.release()
+    return table
+
+
+# the table if it is built and no check is due, else None (for callers that can't block)
+def get_fresh_institute_keywords():
+    table = _institute_keywords
+    return None if table is None or table.version is None or _check_due(table) else table
+
+
+def reset_institute_keywords():
+    global _institute_keywords
+    with _institute_keywords_lock:
+        _institute_keywords = None
+
+
+# a table lookup costs microseconds, so only the query path goes through the result cache
+@resilience_utils.serve_stale(default=empty_top_keywords_of_univ)
 def get_top_keywords_of_univ(univ):
-    query = f'''
-        MATCH (i1:INSTITUTE) <- [:AFFILIATION_WITH] - (f1:FACULTY) -[i:INTERESTED_IN] -> (k:KEYWORD)
-        WHERE i1.name = "{univ}"
-        RETURN k.name, count(DISTINCT f1.id) AS n_prof
-        ORDER BY n_prof DESC
-        LIMIT 10
-    '''
-    result = conn.query(query, db='academicworld')
-    df = pd.DataFrame([dict(_) for _ in result]).rename(
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_keywords_of_univ(univ)
+    if use_institute_keywords:
+        table = get_institute_keywords()
+        if table.version is not None:
+            return table.lookup(univ)
+    return query_top_keywords_of_univ(univ)
+
+
+@cached('neo4j')
+def query_top_keywords_of_univ(univ):
+    query = top_keywords_of_univ_query
+    df = conn.query(query, {'univ': univ}, db=database, transformer=Result.to_df,
+                    name='top_keywords_of_univ').rename(
         columns={'k.name': 'Keyword', 'n_prof': 'Professor Count'})
     return df
 
 
 # widget 4 - top keywords of professor: for a given professor, return top keywords based on KRC.
+# Starts from the professor (index on FACULTY.name); publications are matched against the
+# keyword nodes the professor is interested in, not against their names.
+top_keywords_of_prof_query = '''
+    MATCH (f:FACULTY {name: $prof})-[:INTERESTED_IN]->(k:KEYWORD)<-[l:LABEL_BY]-(p:PUBLICATION)<-[:PUBLISH]-(f)
+    RETURN k.name, ROUND(SUM(l.score * p.numCitations),2) AS citation_score
+    ORDER BY citation_score DESC
+    LIMIT 10
+'''
+
+@cached('neo4j')
+@resilience_utils.serve_stale(default=empty_top_keywords_of_prof)
 def get_top_keywords_of_prof(prof):
-    query = f'''
-        MATCH (k1:KEYWORD) <- [i:INTERESTED_IN]- (f1:FACULTY) -[:PUBLISH] -> (p:PUBLICATION) - [l:LABEL_BY] -> (k2:KEYWORD)
-        WHERE f1.name = "{prof}" AND k2.name = k1.name
-        RETURN k2.name, ROUND(SUM(l.score * p.numCitations),2) AS citation_score
-        ORDER BY citation_score DESC
-        LIMIT 10
-    '''
-    result = conn.query(query, db='academicworld')
-    df = pd.DataFrame([dict(_) for _ in result]).rename(
-        columns={'k2.name': 'Keyword', 'citation_score': 'Citation Score'})
+    if snapshot_utils.use_snapshot:
+        return snapshot_utils.get_snapshot().top_keywords_of_prof(prof)
+    query = top_keywords_of_prof_query
+    df = conn.query(query, {'prof': prof}, db=database, transformer=Result.to_df,
+                    name='top_keywords_of_prof').rename(
+        columns={'k.name': 'Keyword', 'citation_score': 'Citation Score'})
     return df
 
-# list of universities
-def get_univ_list():
+# number of institutes and faculty, answered from the count store (used to version cached option lists)
+def count_nodes():
+    if snapshot_utils.use_snapshot:
+        snapshot = snapshot_utils.get_snapshot()
+        return {'institutes': snapshot.count('institutes'), 'faculty': snapshot.count('faculty')}
     query = '''
         MATCH (i:INSTITUTE)
-        RETURN i.name as name
-        ORDER BY name
+        WITH count(i) AS institutes
+        MATCH (f:FACULTY)
+        RETURN institutes, count(f) AS faculty
     '''
-    result = conn.query(query, db='academicworld')
-    universities = [record['name'] for record in result]
-    return universities
+    record = conn.query(query, db=database, transformer=lambda result: result.single(), name='count_nodes')
+    return {'institutes': record['institutes'], 'faculty': record['faculty']}
+
+# the name lists are read in pages of list_page_size, ordered and resumed on
+# (name, elementId) so that each page is an index seek on the name index and
+# duplicate names are neither skipped nor repeated
+list_page_size = 5000
+
+names_page_query = '''
+    MATCH (n:{label})
+    WHERE n.name >= $name AND (n.name > $name OR elementId(n) > $id)
+    RETURN n.name AS name, elementId(n) AS id
+    ORDER BY name, id
+    LIMIT $limit
+'''
+
+
+# names of all nodes with the label, in name order, one page at a time
+def iter_names(label, page_size=None):
+    query = names_page_query.format(label=label)
+    parameters = {'name': '', 'id': '', 'limit': page_size or list_page_size}
+    while True:
+        records = conn.query(query, parameters, db=database, name=f'{label.lower()}_names_page')
+        for record in records:
+            yield record['name']
+        if len(records) < parameters['limit']:
+            return
+        parameters['name'], parameters['id'] = records[-1]['name'], records[-1]['id']
+
+
+def iter_univ_names(page_size=None):
+    if snapshot_utils.use_snapshot:
+        yield from snapshot_utils.get_snapshot().institutes
+        return
+    yield from iter_names('INSTITUTE', page_size)
+
+
+def iter_prof_names(page_size=None):
+    if snapshot_utils.use_snapshot:
+        yield from snapshot_utils.get_snapshot().faculty
+        return
+    yield from iter_names('FACULTY', page_size)
+
+
+# list of universities
+@cached('neo4j')
+@resilience_utils.serve_stale()
+def get_univ_list():
+    return list(iter_univ_names())
 
 # list of professors
+@cached('neo4j')
+@resilience_utils.serve_stale()
 def get_prof_list():
-    query = '''
-        MATCH (f:FACULTY)
-        RETURN f.name as name
-        ORDER BY name
-    '''
-    result = conn.query(query, db='academicworld')
-    profs = [record['name'] for record in result]
-    return profs
\ No newline at end of file
+    return list(iter_prof_names())
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+import time
+
+import mongodb_utils
+import neo4j_utils
+
+# on-disk snapshot of the dropdown option lists, shared by all workers and restarts
+cache_path = 'options_cache.json'
+# a snapshot younger than this is used without asking the databases for their version
+max_age = 3600
+cache_format = 1
+
+
+# cheap fingerprint of the source data behind the option lists (count stores only)
+def source_version():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        publications = executor.submit(mongodb_utils.count_publications)
+        nodes = executor.submit(neo4j_utils.count_nodes)
+        return {'publications': publications.result(), **nodes.result()}
+
+
+# query the three option lists concurrently
+def fetch_options():
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        keywords = executor.submit(mongodb_utils.get_keyword_list)
+        universities = executor.submit(neo4j_utils.get_univ_list)
+        professors = executor.submit(neo4j_utils.get_prof_list)
+        return {
+            'keywords': keywords.result(),
+            'universities': universities.result(),
+            'professors': professors.result(),
+        }
+
+
+def read_snapshot():
+    try:
+        with open(cache_path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get('format') != cache_format:
+        return None
+    return snapshot
+
+
+def write_snapshot(snapshot):
+    # write to a temporary file first, so concurrent workers never read a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, cache_path)
+
+
+# option lists from the snapshot file if it is fresh or still matches the source
+# data, otherwise from the databases (and the snapshot is rewritten)
+def load_options():
+    snapshot = read_snapshot()
+    if snapshot is not None and time.time() - snapshot['checked_at'] < max_age:
+        return snapshot
+
+    version = source_version()
+    if snapshot is not None and snapshot['version'] == version:
+        snapshot['checked_at'] = time.time()
+        write_snapshot(snapshot)
+        return snapshot
+
+    start = time.perf_counter()
+    snapshot = {'format': cache_format, 'version': version, 'checked_at': time.time(), **fetch_options()}
+    write_snapshot(snapshot)
+    logging.info(f"Option lists loaded from the databases in {time.perf_counter() - start:.1f}s")
+    return snapshot
+
+
+_options = None
+_options_lock = threading.Lock()
+
+
+# option lists of this process, loaded on first use
+def get_options():
+    global _options
+    if _options is None:
+        with _options_lock:
+            if _options is None:
+                _options = load_options()
+    return _options
@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+
+import cache_utils
+import metrics_utils
+
+# failure handling of the three data sources:
+#   * deadlines: every query of a source is bounded by deadlines[source] seconds,
+#     enforced by its driver (Neo4j transaction timeout, pymongo's timeout(),
+#     MySQL max_execution_time, asyncio.wait_for in the async modules). Bulk builds
+#     (trend table, KRC matrix, institute keywords, snapshot export, manage.py
+#     commands) run under no_deadline().
+#   * circuit breakers: after failure_threshold consecutive failures a source is
+#     considered down and its queries fail fast with SourceUnavailable for
+#     reset_timeout seconds; then one probe query is let through, and its result
+#     closes or re-opens the breaker
+#   * last-known-good results: the widget functions (@serve_stale) keep their last
+#     successful result per arguments and return it when the source fails, or a
+#     default (empty) result when there is none. Fallbacks are not written to the
+#     result cache.
+config = {
+    'deadlines': {'mongodb': 5, 'neo4j': 5, 'mysql': 5},  # seconds per query
+    'failure_threshold': 5,      # consecutive failures that open a breaker
+    'reset_timeout': 30,         # seconds an open breaker fails fast before a probe
+    'stale_maxsize': 2048,       # last-known-good results kept per process
+    'stale_ttl': 24 * 3600,      # seconds a last-known-good result may be served
+}
+
+
+class SourceUnavailable(Exception):
+    def __init__(self, source):
+        super().__init__(f"{source} is unavailable (circuit breaker open)")
+        self.source = source
+
+
+_no_deadline = contextvars.ContextVar('no_deadline', default=False)
+
+
+# deadline of one query of the source in seconds, None for no deadline
+def deadline(source):
+    if _no_deadline.get():
+        return None
+    return config['deadlines'].get(source)
+
+
+@contextlib.contextmanager
+def no_deadline():
+    token = _no_deadline.set(True)
+    try:
+        yield
+    finally:
+        _no_deadline.reset(token)
+
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+
+class CircuitBreaker:
+    def __init__(self, source):
+        self.source = source
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    # whether a query may run now; an open breaker lets one probe through after reset_timeout
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= config['reset_timeout']:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"{self.source} circuit breaker closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    # the call ended without telling whether the source works (cancelled, or failed
+    # before reaching it): an open breaker may let the next probe through
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= config['failure_threshold']):
+                if self.state == CLOSED:
+                    logging.warning(f"{self.source} circuit breaker opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.opened += 1
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(source):
+    breaker = _breakers.get(source)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(source, CircuitBreaker(source))
+    return breaker
+
+
+# run one query of a source through its breaker: fails fast with SourceUnavailable
+# while the breaker is open; exceptions of the given types count as failures, other
+# errors as answers of the source
+@contextlib.contextmanager
+def protect(source, failures=(Exception, )):
+    breaker = get_breaker(source)
+    if not breaker.allow():
+        raise SourceUnavailable(source)
+    try:
+        yield
+    except failures:
+        breaker.record_failure()
+        raise
+    except Exception:
+        breaker.record_success()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    else:
+        breaker.record_success()
+
+
+# await a query of the async data layer through the source's breaker and deadline
+async def call_async(source, awaitable):
+    try:
+        with protect(source):
+            return await asyncio.wait_for(awaitable, deadline(source))
+    except SourceUnavailable:
+        # failing fast, the coroutine was never awaited
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+
+
+# last-known-good results per function and arguments, and the fallback counters
+_stale = cache_utils.LRUCache(config['stale_maxsize'])
+_fallbacks = {}
+_fallbacks_lock = threading.Lock()
+
+
+def _count_fallback(name, kind):
+    with _fallbacks_lock:
+        counts = _fallbacks.setdefault(name, {'stale': 0, 'default': 0, 'failed': 0})
+        counts[kind] += 1
+
+
+def _fallback(name, key, default, error):
+    hit, value = _stale.get(key)
+    if hit:
+        logging.warning(f"{name} failed ({error}), serving the last known good result")
+        _count_fallback(name, 'stale')
+    elif default is not None:
+        logging.warning(f"{name} failed ({error}), serving the default result")
+        _count_fallback(name, 'default')
+        value = default()
+    else:
+        _count_fallback(name, 'failed')
+        return False, None
+    cache_utils.skip_store()
+    return True, value
+
+
+# serve the last known good result (else default(), if given) when the function
+# raises or returns None; without either the error is raised. Goes below @cached, so
+# fallbacks are not cached. Works on coroutine functions too.
+def serve_stale(default=None):
+    def decorator(func):
+        name = func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = cache_utils.make_key('stale', name, args, kwargs)
+                try:
+                    value = await func(*args, **kwargs)
+                    error = None
+                except Exception as e:
+                    value, error = None, e
+                if value is not None:
+                    _stale.set(key, value, config['stale_ttl'])
+                    return value
+                served, value = _fallback(name, key, default, error or "no result")
+                if not served and error is not None:
+                    raise error
+                return value
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                key = cache_utils.make_key('stale', name, args, kwargs)
+                try:
+                    value = func(*args, **kwargs)
+                    error = None
+                except Exception as e:
+                    value, error = None, e
+                if value is not None:
+                    _stale.set(key, value, config['stale_ttl'])
+                    return value
+                served, value = _fallback(name, key, default, error or "no result")
+                if not served and error is not None:
+                    raise error
+                return value
+        return wrapper
+    return decorator
+
+
+def _breaker_gauges():
+    values = {}
+    for source, breaker in sorted(_breakers.items()):
+        values[f'{source}_state'] = breaker.state
+        values[f'{source}_opened'] = breaker.opened
+        values[f'{source}_rejected'] = breaker.rejected
+    return values
+
+
+def _fallback_gauges():
+    with _fallbacks_lock:
+        return {f'{name}_{kind}': count for name, counts in _fallbacks.items() for kind, count in counts.items()}
+
+
+metrics_utils.add_gauges('breaker', _breaker_gauges)
+metrics_utils.add_gauges('fallback', _fallback_gauges)
+
+
+def reset():
+    with _breakers_lock:
+        _breakers.clear()
+    with _fallbacks_lock:
+        _fallbacks.clear()
+    _stale.clear()
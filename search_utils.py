@@ -0,0 +1,52 @@
+import bisect
+
+
+# in-memory type-ahead index over a list of names: prefix matches come from a
+# sorted array (binary search), then substring matches from one scan of the
+# names joined into a single string
+class NameIndex:
+    def __init__(self, names):
+        self.names = sorted({name for name in names if name}, key=lambda name: (name.lower(), name))
+        self.keys = [name.lower() for name in self.names]
+        self.offsets = []
+        offset = 0
+        for key in self.keys:
+            self.offsets.append(offset)
+            offset += len(key) + 1
+        self.text = '\n'.join(self.keys)
+
+    def __len__(self):
+        return len(self.names)
+
+    def contains(self, name):
+        i = bisect.bisect_left(self.keys, name.lower())
+        while i < len(self.keys) and self.keys[i] == name.lower():
+            if self.names[i] == name:
+                return True
+            i += 1
+        return False
+
+    # up to limit names matching the query, prefix matches first, both in name order
+    def search(self, query, limit=20):
+        query = (query or '').strip().lower()
+        if not query:
+            return self.names[:limit]
+
+        matches = []
+        i = bisect.bisect_left(self.keys, query)
+        prefix_start = i
+        while i < len(self.keys) and len(matches) < limit and self.keys[i].startswith(query):
+            matches.append(i)
+            i += 1
+        prefix_end = i
+        if len(matches) < limit and '\n' not in query:
+            pos = self.text.find(query)
+            while pos != -1 and len(matches) < limit:
+                i = bisect.bisect_right(self.offsets, pos) - 1
+                if not prefix_start <= i < prefix_end:
+                    matches.append(i)
+                # continue the scan at the next name
+                if i + 1 >= len(self.offsets):
+                    break
+                pos = self.text.find(query, self.offsets[i + 1])
+        return [self.names[i] for i in matches]
@@ -0,0 +1,456 @@
+import bisect
+import datetime
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import resilience_utils
+
+# offline snapshot: everything the six widgets need, exported from MySQL, MongoDB and
+# Neo4j into a directory of .npy arrays that are memory-mapped read-only, so gunicorn
+# workers share the pages through the OS cache and need no database connection.
+#
+#   snapshot/CURRENT                  name of the current version
+#   snapshot/<version>/manifest.json  format, counts and year range
+#   snapshot/<version>/*.npy          arrays (strings as UTF-8 bytes + offsets)
+#
+# With use_snapshot (or RFE_BACKEND=snapshot) the widget and list functions of the
+# utils modules answer from the snapshot, and favorite keywords are kept in a local
+# SQLite file. `python manage.py export-snapshot` writes a new version.
+use_snapshot = os.environ.get('RFE_BACKEND') == 'snapshot'
+snapshot_path = 'snapshot'
+favorites_path = 'favorites.sqlite3'
+snapshot_format = 1
+keep_versions = 2
+
+
+# a column of strings stored as one UTF-8 buffer and the offsets of each string
+class Strings:
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def encode(cls, names):
+        encoded = [name.encode('utf-8') for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        return self.raw(i).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def tolist(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+
+# sorted strings (by UTF-8 bytes, the order Cypher sorts names in), looked up by
+# bisection, so opening a snapshot doesn't build any dictionaries
+class SortedStrings(Strings):
+    class _Keys:
+        def __init__(self, strings):
+            self.strings = strings
+
+        def __len__(self):
+            return len(self.strings)
+
+        def __getitem__(self, i):
+            return self.strings.raw(i)
+
+    def range(self, name):
+        keys = self._Keys(self)
+        key = name.encode('utf-8')
+        lo = bisect.bisect_left(keys, key)
+        return lo, bisect.bisect_right(keys, key, lo)
+
+    def find(self, name):
+        lo, hi = self.range(name)
+        return lo if lo < hi else None
+
+    # the columns of a name, as KRCMatrix.columns.get
+    def get(self, name, default=None):
+        row = self.find(name)
+        return default if row is None else [row]
+
+
+# indices of the concatenated ranges ptr[row]:ptr[row + 1] of the given rows, and for
+# each index the position of its row in rows
+def _ranges(ptr, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum()), owner
+
+
+def _top_k(scores, k):
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind='stable')]
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != snapshot_format:
+            raise ValueError(f"{path} has snapshot format {self.manifest.get('format')}, expected {snapshot_format}")
+        self.version = self.manifest['version']
+        self._arrays = {}
+        self._lock = threading.Lock()
+        self.keywords = self.sorted_strings('keyword')
+        self.faculty = self.sorted_strings('faculty')
+        self.institutes = self.sorted_strings('institute')
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            with self._lock:
+                array = self._arrays.get(name)
+                if array is None:
+                    array = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+                    self._arrays[name] = array
+        return array
+
+    def strings(self, name):
+        return Strings(self[name + '_data'], self[name + '_offsets'])
+
+    def sorted_strings(self, name):
+        return SortedStrings(self[name + '_data'], self[name + '_offsets'])
+
+    def _names(self, strings, indices):
+        return [strings[int(i)] for i in indices]
+
+    # widget 1
+    def keyword_trend(self, keyword):
+        row = self.keywords.find(keyword)
+        start_year, _ = self.manifest['years']
+        counts = self['trend_counts'][row] if row is not None else np.zeros(0, dtype=np.int64)
+        years = np.flatnonzero(counts > 0)
+        return pd.DataFrame({"year": (years + start_year).astype(np.int64),
+                             "publication count": np.asarray(counts[years], dtype=np.int64)})
+
+    # widget 2: KRC per faculty over the keyword's entries of start_year..end_year, one
+    # row per affiliation
+    def top_professors(self, keyword, start_year, end_year, k=10):
+        row = self.keywords.find(keyword)
+        empty = pd.DataFrame({'Professor': pd.Series(dtype=object), 'Institute': pd.Series(dtype=object),
+                              'Citation Score': pd.Series(dtype='float64')})
+        if row is None:
+            return empty
+        ptr = self['krc_ptr']
+        entries = slice(ptr[row], ptr[row + 1])
+        years = self['krc_year'][entries]
+        mask = (years >= start_year) & (years <= end_year)
+        faculty, inverse = np.unique(self['krc_faculty'][entries][mask], return_inverse=True)
+        totals = np.bincount(inverse, weights=self['krc_value'][entries][mask], minlength=len(faculty))
+        affiliations, owner = _ranges(self['affiliation_ptr'], faculty)
+        if not len(affiliations):
+            return empty
+        scores = np.round(totals[owner], 2)
+        top = _top_k(scores, k)
+        return pd.DataFrame({'Professor': self._names(self.faculty, faculty[owner[top]]),
+                             'Institute': self._names(self.institutes, self['affiliation_institute'][affiliations[top]]),
+                             'Citation Score': scores[top]})
+
+    # widget 3
+    def top_keywords_of_univ(self, univ):
+        row = self.institutes.find(univ)
+        keywords = self['institute_top_keywords'][row] if row is not None else np.zeros(0, dtype=np.int32)
+        n = int((keywords >= 0).sum())
+        counts = self['institute_top_counts'][row, :n] if n else np.zeros(0, dtype=np.int64)
+        return pd.DataFrame({'Keyword': self._names(self.keywords, keywords[:n]),
+                             'Professor Count': np.asarray(counts, dtype=np.int64)})
+
+    # widget 4: KRC of the professor's interests, summed over faculty of that name
+    def top_keywords_of_prof(self, prof, k=10):
+        lo, hi = self.faculty.range(prof)
+        interests, _ = _ranges(self['interest_ptr'], np.arange(lo, hi))
+        keywords, inverse = np.unique(self['interest_keyword'][interests], return_inverse=True)
+        scores = np.round(np.bincount(inverse, weights=self['interest_krc'][interests], minlength=len(keywords)), 2)
+        top = _top_k(scores, k)
+        return pd.DataFrame({'Keyword': self._names(self.keywords, keywords[top]), 'Citation Score': scores[top]})
+
+    def keyword_list(self, name):
+        return self._names(self.keywords, self[name])
+
+    def count(self, name):
+        return self.manifest['counts'][name]
+
+
+_snapshot = None
+_snapshot_mtime = None
+_snapshot_lock = threading.Lock()
+
+
+# the current snapshot, reopened when an export has made a new version current
+def get_snapshot():
+    global _snapshot, _snapshot_mtime
+    current = os.path.join(snapshot_path, 'CURRENT')
+    try:
+        mtime = os.stat(current).st_mtime
+    except OSError:
+        raise FileNotFoundError(f"no snapshot in {snapshot_path}, run `python manage.py export-snapshot`")
+    if _snapshot is not None and mtime == _snapshot_mtime:
+        return _snapshot
+    with _snapshot_lock:
+        if _snapshot is None or mtime != _snapshot_mtime:
+            with open(current, encoding='utf-8') as f:
+                version = f.read().strip()
+            _snapshot = Snapshot(os.path.join(snapshot_path, version))
+            _snapshot_mtime = mtime
+    return _snapshot
+
+
+# favorite keywords in snapshot mode: a local SQLite file shared by the workers
+def _favorites_db():
+    db = sqlite3.connect(favorites_path, timeout=10)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS fav_keywords "
+               "(session_id TEXT NOT NULL, name TEXT NOT NULL, PRIMARY KEY (session_id, name))")
+    return db
+
+
+def fetch_favorites(session_id):
+    db = _favorites_db()
+    try:
+        rows = db.execute("SELECT name FROM fav_keywords WHERE session_id = ? ORDER BY rowid", (session_id, ))
+        return [row[0] for row in rows]
+    finally:
+        db.close()
+
+
+def add_favorites(session_id, keywords):
+    db = _favorites_db()
+    try:
+        with db:
+            db.executemany("INSERT OR IGNORE INTO fav_keywords (session_id, name) VALUES (?, ?)",
+                           [(session_id, keyword) for keyword in keywords])
+    finally:
+        db.close()
+    return True
+
+
+def delete_favorites(session_id, keywords):
+    db = _favorites_db()
+    try:
+        with db:
+            db.executemany("DELETE FROM fav_keywords WHERE session_id = ? AND name = ?",
+                           [(session_id, keyword) for keyword in keywords])
+    finally:
+        db.close()
+    return True
+
+
+# CSR pointer of sorted row numbers
+def _pointer(rows, n):
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=ptr[1:])
+    return ptr
+
+
+# name -> position in the sorted names, for the export
+def _positions(sorted_names, names):
+    index = {}
+    for i, name in enumerate(sorted_names):
+        index.setdefault(name, i)
+    return np.array([index[name] for name in names], dtype=np.int64)
+
+
+def _sort_names(names):
+    return sorted(names, key=lambda name: name.encode('utf-8'))
+
+
+# read everything the widgets need from the three databases; the utils modules are
+# imported here because they import this module for the backend switch
+def collect():
+    import mongodb_utils
+    import mysql_utils
+    import neo4j_utils
+
+    def query(text, parameters=None, **kwargs):
+        return neo4j_utils.conn.query(text, parameters, db=neo4j_utils.database, name='export_snapshot', **kwargs)
+
+    def frame(text, columns):
+        return query(text, transformer=lambda result: result.to_df()).reindex(columns=columns)
+
+    trend = mongodb_utils.KeywordTrendTable(mongodb_utils.start_year, mongodb_utils.end_year)
+    trend.refresh()
+    return {
+        'years': [mongodb_utils.start_year, mongodb_utils.end_year],
+        'trend': trend,
+        # read directly, the list functions would serve a stale list when a database fails
+        'mongo_keywords': list(mongodb_utils.iter_keywords()),
+        'mysql_keywords': list(mysql_utils.iter_all_keywords()),
+        'krc_matrix': mysql_utils.KRCMatrix.build(),
+        'faculty': query("MATCH (f:FACULTY) RETURN elementId(f) AS id, f.name AS name"),
+        'institutes': query("MATCH (i:INSTITUTE) RETURN elementId(i) AS id, i.name AS name"),
+        'affiliations': query('''
+            MATCH (f:FACULTY)-[:AFFILIATION_WITH]->(i:INSTITUTE)
+            RETURN elementId(f) AS faculty, elementId(i) AS institute'''),
+        # KRC per (keyword, faculty, year), the grain of widget 2's year slider
+        'entries': frame('''
+            MATCH (k:KEYWORD)<-[l:LABEL_BY]-(p:PUBLICATION)<-[:PUBLISH]-(f:FACULTY)
+            WHERE p.year IS NOT NULL
+            RETURN k.name AS keyword, elementId(f) AS faculty, p.year AS year,
+                   SUM(p.numCitations * l.score) AS krc''', ['keyword', 'faculty', 'year', 'krc']),
+        'interests': frame('''
+            MATCH (f:FACULTY)-[:INTERESTED_IN]->(k:KEYWORD)
+            RETURN DISTINCT elementId(f) AS faculty, k.name AS keyword''', ['faculty', 'keyword']),
+        'institute_keywords': query(neo4j_utils.institute_keywords_query, {'k': neo4j_utils.institute_keywords_k}),
+        'counts': {'publications': mongodb_utils.count_publications(), **neo4j_utils.count_nodes()},
+    }
+
+
+def build_arrays(data):
+    arrays = {}
+
+    def add_strings(name, names):
+        strings = Strings.encode(names)
+        arrays[name + '_data'], arrays[name + '_offsets'] = strings.data, strings.offsets
+
+    trend = data['trend']
+    entries, interests, krc_matrix = data['entries'], data['interests'], data['krc_matrix']
+    trend_index, trend_table = trend.rows
+    keyword_names = _sort_names(set(trend_index) | set(data['mongo_keywords']) | set(data['mysql_keywords'])
+                                | set(entries['keyword']) | set(interests['keyword'])
+                                | set(krc_matrix.keyword_names.tolist())
+                                | {name for record in data['institute_keywords'] for name in record['keywords']})
+    add_strings('keyword', keyword_names)
+    keyword_index = {name: i for i, name in enumerate(keyword_names)}
+
+    # faculty and institutes sorted by name, duplicate names kept
+    faculty = sorted(data['faculty'], key=lambda record: (record['name'] or '').encode('utf-8'))
+    faculty_index = {record['id']: i for i, record in enumerate(faculty)}
+    add_strings('faculty', [record['name'] or '' for record in faculty])
+    institutes = sorted(data['institutes'], key=lambda record: (record['name'] or '').encode('utf-8'))
+    institute_index = {record['id']: i for i, record in enumerate(institutes)}
+    institute_names = [record['name'] or '' for record in institutes]
+    add_strings('institute', institute_names)
+
+    # widget 1: keyword x year publication counts
+    trend_counts = np.zeros((len(keyword_names), len(trend.years)), dtype=np.int32)
+    for name, row in trend_index.items():
+        trend_counts[keyword_index[name]] = trend_table[row]
+    arrays['trend_counts'] = trend_counts
+    arrays['mongo_keywords'] = _positions(keyword_names, data['mongo_keywords'])
+    arrays['mysql_keywords'] = _positions(keyword_names, data['mysql_keywords'])
+
+    # widget 2: (faculty, year) KRC entries grouped by keyword, and affiliations by faculty
+    keyword_rows = entries['keyword'].map(keyword_index).to_numpy(dtype=np.int64)
+    faculty_rows = entries['faculty'].map(faculty_index).to_numpy(dtype=np.int64)
+    order = np.lexsort((faculty_rows, entries['year'].to_numpy(), keyword_rows))
+    arrays['krc_ptr'] = _pointer(keyword_rows, len(keyword_names))
+    arrays['krc_year'] = entries['year'].to_numpy(dtype=np.int16)[order]
+    arrays['krc_faculty'] = faculty_rows.astype(np.int32)[order]
+    arrays['krc_value'] = entries['krc'].fillna(0).to_numpy(dtype=np.float64)[order]
+
+    affiliation = sorted((faculty_index[record['faculty']], institute_index[record['institute']])
+                         for record in data['affiliations'])
+    arrays['affiliation_ptr'] = _pointer(np.array([f for f, _ in affiliation], dtype=np.int64), len(faculty))
+    arrays['affiliation_institute'] = np.array([i for _, i in affiliation], dtype=np.int32)
+
+    # widget 3: top keywords per institute (institutes of the same name share a list)
+    k = max([len(record['keywords']) for record in data['institute_keywords']] + [1])
+    top_keywords = np.full((len(institutes), k), -1, dtype=np.int32)
+    top_counts = np.zeros((len(institutes), k), dtype=np.int64)
+    by_name = {record['institute']: record for record in data['institute_keywords']}
+    for row, name in enumerate(institute_names):
+        record = by_name.get(name)
+        if record is not None:
+            top_keywords[row, :len(record['keywords'])] = [keyword_index[name] for name in record['keywords']]
+            top_counts[row, :len(record['counts'])] = record['counts']
+    arrays['institute_top_keywords'] = top_keywords
+    arrays['institute_top_counts'] = top_counts
+
+    # widget 4: total KRC of each (faculty, interest keyword) with publications
+    totals = entries.groupby(['faculty', 'keyword'], as_index=False)['krc'].sum()
+    interest_krc = interests.merge(totals, on=['faculty', 'keyword'])
+    interest_faculty = interest_krc['faculty'].map(faculty_index).to_numpy(dtype=np.int64)
+    order = np.argsort(interest_faculty, kind='stable')
+    arrays['interest_ptr'] = _pointer(interest_faculty, len(faculty))
+    arrays['interest_keyword'] = interest_krc['keyword'].map(keyword_index).to_numpy(dtype=np.int32)[order]
+    arrays['interest_krc'] = interest_krc['krc'].fillna(0).to_numpy(dtype=np.float64)[order]
+
+    # widgets 5 & 6: the MySQL KRC matrix with its columns mapped onto the keyword dictionary
+    # (MySQL keywords of the same name share a column, as they share a name in score())
+    coo = krc_matrix.krc.tocoo()
+    columns = np.array([keyword_index[name] for name in krc_matrix.keyword_names.tolist()], dtype=np.int64)
+    shape = (krc_matrix.krc.shape[0], len(keyword_names))
+    krc = sparse.csc_matrix((coo.data, (coo.row, columns[coo.col])), shape=shape)
+    hits = sparse.csc_matrix((krc_matrix.hits.tocoo().data, (coo.row, columns[coo.col])), shape=shape)
+    add_strings('rec_faculty', krc_matrix.faculty_names.tolist())
+    add_strings('rec_university', krc_matrix.univ_names.tolist())
+    arrays['rec_faculty_univ'] = krc_matrix.faculty_univ
+    arrays['rec_indptr'] = krc.indptr
+    arrays['rec_indices'] = krc.indices
+    arrays['rec_krc'] = krc.data
+    arrays['rec_hits'] = hits.data
+    return arrays
+
+
+# export a new snapshot version and make it current; returns its directory
+def export(path=None):
+    path = path or snapshot_path
+    start = time.perf_counter()
+    # bulk reads, not bound by the per-query deadlines
+    with resilience_utils.no_deadline():
+        data = collect()
+    arrays = build_arrays(data)
+    # fixed-width, so versions sort by time; the pid keeps concurrent exports apart
+    version = f"{datetime.datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}"
+    directory = os.path.join(path, version)
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_directory, name + '.npy'), np.ascontiguousarray(array))
+    manifest = {
+        'format': snapshot_format,
+        'version': version,
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'years': data['years'],
+        'counts': data['counts'],
+        'sizes': {'keywords': len(data['trend'].rows[0]), 'faculty': len(data['faculty']),
+                  'institutes': len(data['institutes']), 'krc_entries': len(data['entries'])},
+    }
+    with open(os.path.join(tmp_directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_directory, directory)
+
+    # switch CURRENT atomically, then drop the oldest versions
+    current = os.path.join(path, 'CURRENT')
+    current_tmp = f"{current}.{os.getpid()}.tmp"
+    with open(current_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_tmp, current)
+    versions = sorted(name for name in os.listdir(path)
+                      if os.path.isdir(os.path.join(path, name)) and not name.endswith('.tmp'))
+    for old in versions[:-keep_versions]:
+        shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+    logging.info(f"Snapshot {version} exported to {directory} in {time.perf_counter() - start:.1f}s")
+    return directory
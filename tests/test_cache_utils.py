@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import cache_utils
+import resilience_utils
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = cache_utils.LRUCache(16)
+    monkeypatch.setattr(cache_utils, '_backend', backend)
+    resilience_utils.reset()
+    yield backend
+    resilience_utils.reset()
+
+
+def test_results_are_cached_per_arguments(backend):
+    calls = []
+
+    @cache_utils.cached('test')
+    def lookup(name):
+        calls.append(name)
+        return name.upper()
+
+    assert lookup('a') == 'A'
+    assert lookup('a') == 'A'
+    assert lookup('b') == 'B'
+    assert calls == ['a', 'b']
+
+    cache_utils.invalidate('test')
+    lookup('a')
+    assert calls == ['a', 'b', 'a']
+
+
+def test_keys_use_the_arguments_as_passed(backend):
+    @cache_utils.cached('test')
+    def lookup(name):
+        return f"[{name}]"
+
+    assert lookup(' a') == '[ a]'
+    assert lookup('a') == '[a]'
+    assert cache_utils.make_key('test', 'f', ({'b', 'a'}, ), {}) == \
+        cache_utils.make_key('test', 'f', ({'a', 'b'}, ), {})
+    assert cache_utils.make_key('test', 'f', (['b', 'a'], ), {}) != \
+        cache_utils.make_key('test', 'f', (['a', 'b'], ), {})
+
+
+def test_skip_store_returns_the_result_without_caching_it(backend):
+    calls = []
+
+    @cache_utils.cached('test')
+    def lookup(name):
+        calls.append(name)
+        if len(calls) == 1:
+            cache_utils.skip_store()
+        return len(calls)
+
+    assert lookup('a') == 1
+    assert lookup('a') == 2
+    assert lookup('a') == 2
+
+
+def test_skip_store_does_not_leak_to_the_next_call(backend):
+    @cache_utils.cached('outer')
+    def outer(name):
+        return inner(name)
+
+    @cache_utils.cached('inner')
+    def inner(name):
+        cache_utils.skip_store()
+        return name
+
+    @cache_utils.cached('other')
+    def other(name):
+        return object()
+
+    outer('a')
+    assert backend.get(cache_utils.make_key('outer', outer.__qualname__, ('a', ), {})) == (False, None)
+    first = other('a')
+    assert other('a') is first
+
+
+def test_stale_fallbacks_are_not_cached(backend):
+    results = {'a': 1}
+
+    @cache_utils.cached('test')
+    @resilience_utils.serve_stale(default=lambda: 0)
+    def lookup(key):
+        return results[key]
+
+    assert lookup('b') == 0
+    results['b'] = 2
+    assert lookup('b') == 2
+
+
+def test_coroutine_functions_honour_skip_store(backend):
+    calls = []
+
+    @cache_utils.cached('test')
+    async def lookup(name):
+        calls.append(name)
+        if len(calls) == 1:
+            cache_utils.skip_store()
+        return len(calls)
+
+    assert asyncio.run(lookup('a')) == 1
+    assert asyncio.run(lookup('a')) == 2
+    assert asyncio.run(lookup('a')) == 2
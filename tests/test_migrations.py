@@ -0,0 +1,57 @@
+import pytest
+
+# migrations imports the three data layers; the databases themselves are stubbed
+pytest.importorskip('mysql.connector')
+pytest.importorskip('neo4j')
+pytest.importorskip('pymongo')
+
+import migrations
+import mysql_utils
+
+
+class FakeCursor:
+    column_names = ('id', 'select_type', 'table')
+
+
+class FakeDatabase:
+    instances = []
+
+    def __init__(self, config):
+        self.config = config
+        self.cursor = FakeCursor()
+        self.queries = []
+        FakeDatabase.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    def fetch_data(self, query, values=None, name=None):
+        self.queries.append((query, values))
+        return [(1, 'SIMPLE', 'keyword')]
+
+
+@pytest.fixture
+def fake_database(monkeypatch):
+    FakeDatabase.instances = []
+    monkeypatch.setattr(mysql_utils, 'MySQLDatabase', FakeDatabase)
+    return FakeDatabase
+
+
+def test_mysql_explain_runs_without_raise_on_warnings(fake_database):
+    plan = migrations._mysql_explain("select id from keyword where name = %s", ('x', ))
+
+    db, = fake_database.instances
+    assert db.config['raise_on_warnings'] is False
+    assert db.queries == [("EXPLAIN select id from keyword where name = %s", ('x', ))]
+    assert plan == [{'id': 1, 'select_type': 'SIMPLE', 'table': 'keyword'}]
+
+
+def test_mysql_explain_leaves_the_shared_config_alone(fake_database):
+    migrations._mysql_explain("select 1")
+
+    assert mysql_utils.config['raise_on_warnings'] is True
+    assert {k: v for k, v in fake_database.instances[0].config.items() if k != 'raise_on_warnings'} == \
+        {k: v for k, v in mysql_utils.config.items() if k != 'raise_on_warnings'}
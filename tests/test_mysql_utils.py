@@ -0,0 +1,74 @@
+import ast
+import pathlib
+
+import pytest
+
+
+# _keyword_filter is plain Python; it is compiled from the source so its tests run
+# without the MySQL driver and NumPy
+def load_function(name):
+    path = pathlib.Path(__file__).resolve().parents[1] / "mysql_utils.py"
+    tree = ast.parse(path.read_text())
+    node, = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name == name]
+    namespace = {}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), str(path), 'exec'), namespace)
+    return namespace[name]
+
+
+_keyword_filter = load_function('_keyword_filter')
+
+
+@pytest.mark.parametrize('n, size', [(1, 1), (2, 2), (3, 4), (4, 4), (5, 8), (9, 16)])
+def test_keyword_filter_pads_to_a_power_of_two(n, size):
+    keywords = [f"k{i}" for i in range(n)]
+    placeholders, values = _keyword_filter(iter(keywords))
+
+    assert placeholders == ", ".join(["%s"] * size)
+    assert values == tuple(keywords) + (None, ) * (size - n)
+
+
+def test_keyword_filter_of_no_keywords_matches_nothing():
+    assert _keyword_filter([]) == ("null", ())
+
+
+def krc_matrix():
+    np = pytest.importorskip('numpy')
+    sparse = pytest.importorskip('scipy.sparse')
+    pytest.importorskip('mysql.connector')
+    import mysql_utils
+
+    # faculty a, c at university u0 and b, d at u1; d matched "ml" without a score
+    rows, cols = [0, 1, 1, 2, 3], [0, 0, 1, 1, 0]
+    shape = (4, 2)
+    return mysql_utils.KRCMatrix(
+        faculty_names=np.array(['a', 'b', 'c', 'd']), faculty_univ=np.array([0, 1, 0, 1]),
+        univ_names=np.array(['u0', 'u1']), keyword_ids=np.array([10, 20]),
+        keyword_names=np.array(['ml', 'db']),
+        krc=sparse.csc_matrix(([5.0, 3.0, 4.0, 1.0, 0.0], (rows, cols)), shape=shape),
+        hits=sparse.csc_matrix(([1, 1, 1, 1, 1], (rows, cols)), shape=shape),
+    )
+
+
+def test_recommend_ranks_professors_and_universities():
+    professors, universities = krc_matrix().recommend(['ml', 'db'], k=2)
+
+    assert professors == [
+        {"Professor": 'b', "Institute": 'u1', "Total Citation Score": 7.0},
+        {"Professor": 'a', "Institute": 'u0', "Total Citation Score": 5.0},
+    ]
+    assert universities == [
+        {"Institute": 'u1', "Related Professor Count": 2, "Total Citation Score": 7.0},
+        {"Institute": 'u0', "Related Professor Count": 2, "Total Citation Score": 6.0},
+    ]
+
+
+def test_recommend_counts_a_keyword_once_and_skips_unmatched_faculty():
+    professors, universities = krc_matrix().recommend(['ml', 'ml'], k=5)
+
+    assert [row["Professor"] for row in professors] == ['a', 'b', 'd']
+    assert [row["Total Citation Score"] for row in professors] == [5.0, 3.0, 0.0]
+    assert [(row["Institute"], row["Related Professor Count"]) for row in universities] == [('u0', 1), ('u1', 2)]
+
+
+def test_recommend_of_unknown_keywords_is_empty():
+    assert krc_matrix().recommend(['unknown']) == ([], [])
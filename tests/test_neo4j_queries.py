@@ -0,0 +1,76 @@
+import ast
+import os
+import pathlib
+import re
+
+import pytest
+
+
+# the query constants are read from the source, so these checks need no driver
+def query_constants():
+    source = pathlib.Path(__file__).resolve().parents[1] / "neo4j_utils.py"
+    constants = {}
+    for node in ast.parse(source.read_text()).body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant) \
+                and isinstance(node.value.value, str):
+            for target in node.targets:
+                if isinstance(target, ast.Name) and target.id.endswith('_query'):
+                    constants[target.id] = node.value.value
+    return constants
+
+
+queries = query_constants()
+rewritten = ['top_professor_query', 'keyword_krc_by_year_query', 'top_keywords_of_prof_query']
+
+
+def match_clauses(query):
+    return [line.strip() for line in query.splitlines() if line.strip().startswith('MATCH')]
+
+
+@pytest.mark.parametrize('name', ['top_professor_query', 'keyword_krc_by_year_query'])
+def test_keyword_queries_anchor_on_keyword(name):
+    assert match_clauses(queries[name])[0].startswith('MATCH (k:KEYWORD {name: $keyword})')
+
+
+@pytest.mark.parametrize('name', rewritten)
+def test_relationships_are_directed(name):
+    relationships = re.findall(r'(<?)\s*-\s*\[[^\]]*\]\s*-\s*(>?)', queries[name])
+    assert relationships
+    for left, right in relationships:
+        assert bool(left) != bool(right)
+
+
+@pytest.mark.parametrize('name', rewritten)
+def test_no_cartesian_product(name):
+    for clause in match_clauses(queries[name]):
+        assert not re.search(r'\)\s*,\s*\(', clause)
+
+
+def test_top_keywords_of_prof_matches_on_node_identity():
+    query = queries['top_keywords_of_prof_query']
+    [clause] = match_clauses(query)
+    assert clause.startswith('MATCH (f:FACULTY {name: $prof})')
+    # the publication path closes back on the same faculty and keyword nodes
+    assert clause.endswith('<-[:PUBLISH]-(f)')
+    assert '(k:KEYWORD)<-[l:LABEL_BY]-' in clause
+    assert not re.search(r'\w+\.name\s*=\s*\w+\.name', query)
+
+
+# compares the rewritten queries with the originals on a live database; set
+# RFE_NEO4J_TESTS=1 with the neo4j settings of config.ini to run it
+@pytest.mark.skipif(not os.environ.get('RFE_NEO4J_TESTS'), reason="needs a live Neo4j (RFE_NEO4J_TESTS=1)")
+def test_queries_match_legacy_results():
+    pytest.importorskip('neo4j')
+    from benchmarks import check_neo4j_queries as check
+    import neo4j_utils
+
+    keywords = [row[0] for row in check.rows("MATCH (k:KEYWORD) RETURN k.name LIMIT 20", {})]
+    profs = neo4j_utils.get_prof_list.uncached()[:20]
+    for keyword in keywords:
+        parameters = {'keyword': keyword, 'start_year': 1980, 'end_year': 2020}
+        assert check.same_top(check.rows(check.legacy_top_professor_query, parameters),
+                              check.rows(neo4j_utils.top_professor_query, parameters))
+    for prof in profs:
+        parameters = {'prof': prof}
+        assert check.same_top(check.rows(check.legacy_top_keywords_of_prof_query, parameters),
+                              check.rows(neo4j_utils.top_keywords_of_prof_query, parameters))
@@ -0,0 +1,49 @@
+import pytest
+
+# KeywordKRC is plain NumPy; the driver is imported by the module but not connected
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('scipy')
+pytest.importorskip('neo4j')
+
+from neo4j_utils import KeywordKRC
+
+
+def record(year, faculty, krc, hits=1):
+    name, institute = {1: ('ann', 'mit'), 2: ('bob', 'cmu'), 3: ('cy', 'mit')}[faculty]
+    return {'year': year, 'faculty': faculty, 'institute_id': institute, 'name': name, 'institute': institute,
+            'krc': krc, 'hits': hits}
+
+
+@pytest.fixture
+def table():
+    return KeywordKRC.from_records([
+        record(2000, 1, 1.0), record(2002, 1, 2.004),
+        record(2001, 2, 5.0),
+        record(2002, 3, None),
+    ])
+
+
+def rows(df):
+    return list(zip(df['Professor'], df['Institute'], df['Citation Score']))
+
+
+def test_top_sums_the_publications_of_the_window(table):
+    assert rows(table.top(2000, 2002)) == [('bob', 'cmu', 5.0), ('ann', 'mit', 3.0), ('cy', 'mit', 0.0)]
+    assert rows(table.top(2000, 2000)) == [('ann', 'mit', 1.0)]
+    assert rows(table.top(2001, 2010)) == [('bob', 'cmu', 5.0), ('ann', 'mit', 2.0), ('cy', 'mit', 0.0)]
+
+
+def test_top_keeps_the_k_best(table):
+    assert rows(table.top(1990, 2020, k=1)) == [('bob', 'cmu', 5.0)]
+
+
+def test_windows_without_publications_are_empty(table):
+    assert table.top(2003, 2010).empty
+    assert table.top(1990, 1999).empty
+    assert table.top(2002, 2000).empty
+    assert list(table.top(2003, 2010).columns) == ['Professor', 'Institute', 'Citation Score']
+
+
+def test_no_records():
+    assert KeywordKRC.from_records([]).top(2000, 2020).empty
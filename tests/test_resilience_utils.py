@@ -0,0 +1,124 @@
+import pytest
+
+import resilience_utils
+from resilience_utils import CLOSED, OPEN, HALF_OPEN, CircuitBreaker, SourceUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience_utils, 'time', clock)
+    monkeypatch.setattr(resilience_utils, 'config', {**resilience_utils.config,
+                                                     'failure_threshold': 3, 'reset_timeout': 30})
+    resilience_utils.reset()
+    yield clock
+    resilience_utils.reset()
+
+
+def open_breaker(breaker):
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker('test')
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+    assert breaker.opened == 1
+
+
+def test_open_breaker_lets_one_probe_through_after_the_reset_timeout(clock):
+    breaker = CircuitBreaker('test')
+    open_breaker(breaker)
+
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_the_breaker(clock):
+    breaker = CircuitBreaker('test')
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+    assert not breaker.allow()
+    clock.now += 30
+    assert breaker.allow()
+
+
+def test_released_probe_lets_the_next_one_through(clock):
+    breaker = CircuitBreaker('test')
+    open_breaker(breaker)
+    clock.now += 30
+    assert breaker.allow()
+
+    breaker.release()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_protect_counts_only_the_listed_failures(clock):
+    for _ in range(5):
+        with pytest.raises(KeyError):
+            with resilience_utils.protect('test', failures=(OSError, )):
+                raise KeyError('answer of the source')
+    assert resilience_utils.get_breaker('test').state == CLOSED
+
+    for _ in range(3):
+        with pytest.raises(OSError):
+            with resilience_utils.protect('test', failures=(OSError, )):
+                raise OSError('down')
+    with pytest.raises(SourceUnavailable):
+        with resilience_utils.protect('test', failures=(OSError, )):
+            pass
+
+
+def test_serve_stale_serves_the_last_good_result(clock):
+    results = {'a': 1}
+
+    @resilience_utils.serve_stale(default=lambda: 0)
+    def lookup(key):
+        return results[key]
+
+    assert lookup('a') == 1
+    del results['a']
+    assert lookup('a') == 1
+    assert lookup('b') == 0
+
+
+def test_serve_stale_without_default_raises(clock):
+    @resilience_utils.serve_stale()
+    def lookup(key):
+        raise OSError('down')
+
+    with pytest.raises(OSError):
+        lookup('a')
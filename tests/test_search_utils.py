@@ -0,0 +1,46 @@
+from search_utils import NameIndex
+
+names = ['Machine Learning', 'machine vision', 'Deep Learning', 'learning theory', 'Databases', '', 'Deep Learning']
+
+
+def test_names_are_sorted_without_duplicates_or_blanks():
+    index = NameIndex(names)
+
+    assert index.names == ['Databases', 'Deep Learning', 'learning theory', 'Machine Learning', 'machine vision']
+    assert len(index) == 5
+
+
+def test_prefix_matches_come_first_then_substring_matches():
+    index = NameIndex(names)
+
+    assert index.search('learn') == ['learning theory', 'Deep Learning', 'Machine Learning']
+    assert index.search('  MACHINE ') == ['Machine Learning', 'machine vision']
+
+
+def test_a_name_matching_twice_is_listed_once():
+    index = NameIndex(['abab', 'cab ab'])
+
+    assert index.search('ab') == ['abab', 'cab ab']
+
+
+def test_limit_applies_across_prefix_and_substring_matches():
+    index = NameIndex(names)
+
+    assert index.search('learn', limit=2) == ['learning theory', 'Deep Learning']
+    assert index.search('', limit=2) == ['Databases', 'Deep Learning']
+    assert index.search(None, limit=1) == ['Databases']
+
+
+def test_no_match_across_name_boundaries():
+    index = NameIndex(['ab', 'cd'])
+
+    assert index.search('bc') == []
+    assert index.search('b\nc') == []
+
+
+def test_contains_is_exact():
+    index = NameIndex(names)
+
+    assert index.contains('Deep Learning')
+    assert not index.contains('deep learning')
+    assert not index.contains('Deep')